@@ -9,11 +9,39 @@ BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
 SERVER_LISTEN_ADDR = ("0.0.0.0", 8585)
 SERVER_THREAD_NUM = 16
+# Server threads grow toward this under burst and shrink back to SERVER_THREAD_NUM when idle
+# (autoscaling is off when it is not greater than SERVER_THREAD_NUM)
+SERVER_THREAD_MAX_NUM = 16
+# Worker process num, the master process supervises and respawns them (1: single process)
+SERVER_PROCESS_NUM = 1
+# Every worker process binds its own socket with SO_REUSEPORT (Linux >= 3.9), only for SERVER_PROCESS_NUM > 1
+SERVER_REUSE_PORT = False
+# Idle keep-alive connections are parked (epoll) instead of holding a server thread
+SERVER_KEEPALIVE_PARKING = True
+# Load shedding: requests queued longer than the target (seconds) under overload get 503 + Retry-After
+# (CoDel-style, measured per SERVER_QUEUE_DELAY_INTERVAL seconds; 0: disabled)
+SERVER_QUEUE_DELAY_TARGET = 0
+SERVER_QUEUE_DELAY_INTERVAL = 1
+# Requests with a larger Content-Length get 413 before the body is read, chunked bodies fail
+# once they exceed it (bytes, 0: unlimited)
+SERVER_MAX_REQUEST_BODY_SIZE = 0
+# Request bodies up to this size are spooled in memory by req.body_file(), larger ones go to a temp file
+REQUEST_BODY_SPOOL_SIZE = 1024 * 1024
+# Default request deadline (seconds) when the client sends no X-Request-Timeout/X-Request-Deadline header,
+# redis/mysql/http calls in handlers shrink their socket timeouts to the time left (0: no default deadline)
+REQUEST_TIMEOUT = 0
 SERVER_NAME = "Butterfly_app"
 
 # Log
 LOG_SIZE_LIMIT = 1024 * 1024 * 2
 LOG_BATCH_WRITE = 0
+# acc/warning/info logs are written by a background thread per log file (LoggerBase AsyncWriter),
+# lines still in the buffer are lost if the process is killed; err/crit/init logs are always written synchronously
+LOG_ASYNC_WRITE = True
+# queue_size: max lines buffered, flush_lines/flush_interval: write when so many lines are buffered or
+# so many seconds passed, fsync: None(never)/0(every write)/N(at most every N seconds),
+# block: wait (True) or drop new lines (False) when the buffer is full
+LOG_ASYNC_OPTIONS = {"queue_size": 65536, "flush_lines": 512, "flush_interval": 0.5, "fsync": None, "block": False}
 PATH_INIT_LOG = os.path.join(BASE_DIR, "logs/init.log")
 PATH_ACC_LOG = os.path.join(BASE_DIR, "logs/acc.log")
 PATH_INFO_LOG = os.path.join(BASE_DIR, "logs/info.log")
@@ -26,6 +54,16 @@ PATH_COMMON_BF_LOG = os.path.join(BASE_DIR, "logs/common_bf.log")
 # static
 STATIC_PATH = "static"
 STATIC_PREFIX = "static"
+# Static files are cached in memory (LRU, per process, 0: disabled), files larger than
+# STATIC_CACHE_FILE_SIZE_LIMIT are not cached, and cached files are re-stat'ed at most once per
+# STATIC_CACHE_CHECK_INTERVAL seconds
+STATIC_CACHE_SIZE = 32 * 1024 * 1024
+STATIC_CACHE_FILE_SIZE_LIMIT = 1024 * 1024
+STATIC_CACHE_CHECK_INTERVAL = 2
+
+# response cache
+# Max bytes of cached responses per route for handlers decorated with @funcattr.cached (LRU, per process)
+RESPONSE_CACHE_SIZE = 4 * 1024 * 1024
 
 # DB
 """
@@ -5,6 +5,9 @@
 acclog : Butterfly 访问日志
 errlog : Butterfly 错误日志
 initlog: Butterfly 启动相关信息
+
+critlog/errlog/initlog 在调用线程中直接写入(errlog 不能丢失), 其他日志由后台线程写入(LOG_ASYNC_WRITE),
+后台线程写入失败时记录到 critlog
 """
 
 from xlib import logger
@@ -19,10 +22,15 @@ critlog = logger.LoggerBase(config.PATH_CRIT_LOG, False, config.LOG_SIZE_LIMIT,
 
 errlog = logger.LoggerBase(config.PATH_ERR_LOG, False, config.LOG_SIZE_LIMIT, config.LOG_BATCH_WRITE)
 
-warninglog = logger.LoggerBase(config.PATH_WARNING_LOG, False, config.LOG_SIZE_LIMIT, config.LOG_BATCH_WRITE)
+warninglog = logger.LoggerBase(config.PATH_WARNING_LOG, False, config.LOG_SIZE_LIMIT, config.LOG_BATCH_WRITE,
+                               config.LOG_ASYNC_WRITE, config.LOG_ASYNC_OPTIONS, failure_log=critlog)
 
-infolog = logger.LoggerBase(config.PATH_INFO_LOG, False, config.LOG_SIZE_LIMIT, config.LOG_BATCH_WRITE)
+infolog = logger.LoggerBase(config.PATH_INFO_LOG, False, config.LOG_SIZE_LIMIT, config.LOG_BATCH_WRITE,
+                            config.LOG_ASYNC_WRITE, config.LOG_ASYNC_OPTIONS, failure_log=critlog)
 
-acclog = logger.LoggerBase(config.PATH_ACC_LOG, False, config.LOG_SIZE_LIMIT, config.LOG_BATCH_WRITE)
+# acclog 均由 httpgateway._mk_ret 写入, 不记录调用者
+acclog = logger.LoggerBase(config.PATH_ACC_LOG, False, config.LOG_SIZE_LIMIT, config.LOG_BATCH_WRITE,
+                           config.LOG_ASYNC_WRITE, config.LOG_ASYNC_OPTIONS, capture_caller=False,
+                           failure_log=critlog)
 
 initlog = logger.LoggerBase(config.PATH_INIT_LOG, False, config.LOG_SIZE_LIMIT, config.LOG_BATCH_WRITE)
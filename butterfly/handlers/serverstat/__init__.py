@@ -0,0 +1,76 @@
+#!/usr/bin/python
+# coding=utf8
+"""
+# File Name: __init__.py
+# Description:
+    Showing the server statistics
+
+    CherryPyWSGIServer 运行时统计(线程数/队列长度/Parked/Load Shed/Queue Full Rejected 等)
+    以及 WSGIGateway 统计(load_shed_count/static_cache), 日志后台写线程统计(written/dropped),
+    各路由响应缓存统计(funcattr.cached: hits/misses/evictions),
+    各路由并发限制统计(funcattr.max_concurrency: in_flight/limit/rejected),
+    多进程模式下为处理本次请求的子进程的统计
+
+# Version:
+    1.0.2(20261018)
+
+"""
+import os
+import logging
+
+from conf import logger_conf
+from xlib.httpgateway import Request
+from xlib import retstat
+from xlib.middleware import funcattr
+
+__info = "serverstat"
+__version = "1.0.2"
+
+
+def _eval_stats(stats):
+    """
+    统计值为 lambda 时, 计算其结果
+    """
+    data = {}
+    for key, value in stats.items():
+        if callable(value):
+            try:
+                value = value(stats)
+            except BaseException:
+                value = None
+        if isinstance(value, dict):
+            value = _eval_stats(value)
+        data[key] = value
+    return data
+
+
+@funcattr.api
+def serverstat(req):
+    """
+    server statistics
+    """
+    isinstance(req, Request)
+    import wsgiapp
+
+    data = {"pid": os.getpid()}
+    for name, stats in getattr(logging, "statistics", {}).items():
+        if name.startswith("CherryPy HTTPServer"):
+            # Worker Threads 为线程级统计, 数量较多, 不返回
+            stats = dict((k, v) for k, v in stats.items() if k != "Worker Threads")
+            data["server"] = _eval_stats(stats)
+    data["gateway"] = wsgiapp.wsgigw.stats()
+    data["logger"] = {}
+    for name in ("acclog", "errlog", "warninglog", "infolog"):
+        log_stats = getattr(logger_conf, name).stats()
+        if log_stats is not None:
+            data["logger"][name] = log_stats
+    data["response_cache"] = {}
+    data["concurrency"] = {}
+    for route in wsgiapp.route.get_router().routes():
+        cache_stats = getattr(route.protocol, "stats", lambda: None)()
+        if cache_stats is not None:
+            data["response_cache"][route.pattern] = cache_stats
+        bulkhead = getattr(route.protocol, "bulkhead", None)
+        if bulkhead is not None:
+            data["concurrency"][route.pattern] = bulkhead.stats()
+    return retstat.OK, data, [(__info, __version)]
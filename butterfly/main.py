@@ -26,5 +26,12 @@ if __name__ == '__main__':
         config.SERVER_LISTEN_ADDR,
         wsgiapp.application,
         config.SERVER_THREAD_NUM,
-        perfork=1)
+        max=config.SERVER_THREAD_MAX_NUM,
+        perfork=config.SERVER_PROCESS_NUM,
+        after_perfork=wsgiapp.after_perfork,
+        keep_alive_parking=config.SERVER_KEEPALIVE_PARKING,
+        reuse_port=config.SERVER_REUSE_PORT,
+        queue_delay_target=config.SERVER_QUEUE_DELAY_TARGET,
+        queue_delay_interval=config.SERVER_QUEUE_DELAY_INTERVAL,
+        max_request_body_size=config.SERVER_MAX_REQUEST_BODY_SIZE)
     server.start()
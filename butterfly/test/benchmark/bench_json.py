@@ -0,0 +1,76 @@
+#!/usr/bin/python
+# coding=utf8
+"""
+# File Name: bench_json.py
+# Description:
+    JSON 编解码耗时测试, 对比可用的实现(json/simplejson/ujson)
+
+    payload:
+        list_resp : 列表接口响应, 100 行, 含 datetime 字段
+        post_body : 普通 POST 请求参数
+        ret_data  : 星桥 task ret_data
+
+    未安装的实现不参与测试, 可 pip install simplejson ujson 后对比
+
+    结果(ujson 1.35, simplejson 3.17.6):
+        list_resp  dumps json 1092us simplejson 1348us, loads json 815us ujson 232us
+        post_body  dumps json  7.1us simplejson 10.5us, loads json 6.8us ujson 1.5us
+
+Usage:
+    cd butterfly && python test/benchmark/bench_json.py
+"""
+import os
+import sys
+import timeit
+import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from xlib.util import json_util
+
+NUMBER = 2000
+
+PAYLOADS = {
+    "list_resp": {
+        "stat": "OK",
+        "total": 100,
+        "list": [{
+            "id": i,
+            "name": "instance-%d" % i,
+            "ip": "10.0.%d.%d" % (i / 256, i % 256),
+            "port": 8585,
+            "status": "running",
+            "tags": ["bj", "online", "v1.1.14"],
+            "extra": {"cpu": 0.35, "mem": 1024 * 1024 * 512, "owner": u"蝴蝶"},
+            "c_time": datetime.datetime(2021, 7, 20, 10, 1, 2),
+            "u_time": datetime.datetime(2021, 7, 21, 11, 2, 3),
+        } for i in range(100)],
+    },
+    "post_body": {"job_namespace": "butterfly", "job_name": "deploy", "page_index": 1, "page_size": 20,
+                  "operator": "meetbill", "job_extra": {"host": "127.0.0.1", "retry": 3}},
+    "ret_data": {"stat": "OK", "data": {"task_id": 12345, "hosts": ["10.0.0.%d" % i for i in range(20)],
+                                        "cost": 1.234, "success": True, "message": None}},
+}
+
+
+def run(name, func):
+    """
+    单项测试
+    """
+    cost = min(timeit.repeat(func, number=NUMBER, repeat=3))
+    print "{name:<36} {us:>10.2f} us/op".format(name=name, us=cost / NUMBER * 1e6)
+
+
+if __name__ == "__main__":
+    for payload_name in sorted(PAYLOADS):
+        payload = PAYLOADS[payload_name]
+        body = json_util.dumps(payload)
+        print "{name} ({size} bytes)".format(name=payload_name, size=len(body))
+        for codec in sorted(json_util.DUMPS_CODECS):
+            json_util.use(dumps_name=codec)
+            run("  dumps %s" % codec, lambda: json_util.dumps(payload))
+        for codec in sorted(json_util.LOADS_CODECS):
+            json_util.use(loads_name=codec)
+            run("  loads %s" % codec, lambda: json_util.loads(body))
+    json_util.use()
+    print "auto: dumps={dumps} loads={loads}".format(dumps=json_util.dumps_codec, loads=json_util.loads_codec)
@@ -0,0 +1,112 @@
+#!/usr/bin/python
+# coding=utf8
+"""
+# File Name: bench_keepalive_parking.py
+# Description:
+    CherryPyWSGIServer 在大量空闲 keep-alive 连接下的吞吐测试
+
+    (1) 启动 16 线程的 CherryPyWSGIServer
+    (2) 建立 1000 个 keep-alive 连接, 每个连接发送一个请求后保持空闲
+    (3) 4 个客户端线程在新的 keep-alive 连接上持续请求 5 秒, 统计 QPS 及延迟
+
+    分别测试 keep_alive_parking 关闭/开启两种情况
+
+Usage:
+    cd butterfly && python test/benchmark/bench_keepalive_parking.py
+"""
+import os
+import sys
+import time
+import socket
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from xlib import cherrypy_wsgiserver
+
+IDLE_CONNS = 1000
+CLIENT_THREADS = 4
+DURATION = 5
+REQUEST = "GET /ping HTTP/1.1\r\nHost: localhost\r\n\r\n"
+
+
+def app(environ, start_response):
+    """
+    ping
+    """
+    body = "pong"
+    start_response("200 OK", [("Content-Type", "text/plain"), ("Content-Length", str(len(body)))])
+    return [body]
+
+
+def read_response(sock):
+    """
+    读取一个 Content-Length 为 4 的响应
+    """
+    data = ""
+    while not data.endswith("\r\n\r\npong"):
+        chunk = sock.recv(4096)
+        if not chunk:
+            raise socket.error("closed")
+        data += chunk
+
+
+def client(port, stop_at, latencies):
+    """
+    在一个 keep-alive 连接上持续请求
+    """
+    sock = socket.create_connection(("127.0.0.1", port))
+    sock.settimeout(30)
+    while time.time() < stop_at:
+        start = time.time()
+        sock.sendall(REQUEST)
+        try:
+            read_response(sock)
+        except socket.error:
+            break
+        latencies.append(time.time() - start)
+    sock.close()
+
+
+def run(keep_alive_parking):
+    """
+    单轮测试
+    """
+    server = cherrypy_wsgiserver.CherryPyWSGIServer(
+        ("127.0.0.1", 0), app, 16, perfork=1, request_queue_size=2048,
+        keep_alive_parking=keep_alive_parking)
+    server_thread = threading.Thread(target=server.start)
+    server_thread.setDaemon(True)
+    server_thread.start()
+    while not server.ready:
+        time.sleep(0.05)
+    port = server.socket.getsockname()[1]
+
+    idle = []
+    for _ in range(IDLE_CONNS):
+        sock = socket.create_connection(("127.0.0.1", port))
+        sock.sendall(REQUEST)
+        idle.append(sock)
+
+    latencies = []
+    stop_at = time.time() + DURATION
+    threads = [threading.Thread(target=client, args=(port, stop_at, latencies)) for _ in range(CLIENT_THREADS)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    for sock in idle:
+        sock.close()
+    server.stop()
+
+    latencies.sort()
+    count = len(latencies)
+    p99 = latencies[int(count * 0.99) - 1] * 1000 if count else float("nan")
+    print "keep_alive_parking={parking:<5} idle_conns={idle} requests={count:<6} qps={qps:<8.1f} p99={p99:.2f}ms".format(
+        parking=str(keep_alive_parking), idle=IDLE_CONNS, count=count, qps=count / float(DURATION), p99=p99)
+
+
+if __name__ == "__main__":
+    run(False)
+    run(True)
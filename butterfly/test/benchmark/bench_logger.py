@@ -0,0 +1,54 @@
+#!/usr/bin/python
+# coding=utf8
+"""
+# File Name: bench_logger.py
+# Description:
+    LoggerBase 写日志吞吐测试(lines/s), 日志写入临时目录
+
+    sync           : 调用线程直接写入, 记录调用者 filename:lineno
+    sync_no_caller : 调用线程直接写入, 不记录调用者(acclog 的配置)
+    async_no_caller: 后台线程写入, 不记录调用者
+
+Usage:
+    cd butterfly && python test/benchmark/bench_logger.py
+"""
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from xlib import logger
+
+LINES = 200000
+LINE = ("127.0.0.1\t8e0061286fd52998\tGET\t/demo_api/hello\tcost:0.000199\tstat:OK\tuser:-\t"
+        "talk:\tparams:str_info=hello\terror_msg:\tres:")
+
+
+def run(name, **kwargs):
+    """
+    单项测试
+    """
+    tmpdir = tempfile.mkdtemp()
+    try:
+        log = logger.LoggerBase(os.path.join(tmpdir, "acc.log"), False, 1024 * 1024 * 1024, 0, **kwargs)
+        start = time.time()
+        for _ in xrange(LINES):
+            log.log(LINE)
+        log.flush()
+        cost = time.time() - start
+        print "{name:<16} {lps:>10.0f} lines/s".format(name=name, lps=LINES / cost)
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == "__main__":
+    run("sync")
+    try:
+        run("sync_no_caller", capture_caller=False)
+        run("async_no_caller", capture_caller=False, async_write=True)
+    except TypeError:
+        # capture_caller 参数之前的版本
+        run("async", async_write=True)
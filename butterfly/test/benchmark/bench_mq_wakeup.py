@@ -0,0 +1,108 @@
+#!/usr/bin/python
+# coding=utf8
+"""
+# File Name: bench_mq_wakeup.py
+# Description:
+    百川 worker 空闲时的出队延迟及 redis 负载测试
+
+    QUEUE_NUM 个队列, 生产者每隔 0.2~1s 随机向一个队列入队一条消息(data 为入队时间), 消费者循环出队:
+        poll   : dequeue_any 为空时 sleep(5)(旧的 Worker.work 方式)
+        notify : dequeue_any 为空时 Queue.wait_any 阻塞等待入队通知
+    统计入队到出队的延迟, 以及测试期间 redis 每秒处理的命令数(INFO total_commands_processed, 含生产者)
+
+    需要本地 redis-server, 测试使用的 key 均以 mq:queue:{bench_wakeup_ / mq:notify:{bench_wakeup_ 等开头, 结束后删除
+
+Usage:
+    cd butterfly && python test/benchmark/bench_mq_wakeup.py [REDIS_URL] [DURATION]
+"""
+import os
+import sys
+import time
+import random
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from xlib.db import redisorm
+from xlib.mq.queue import Queue
+from xlib.mq import defaults
+
+REDIS_URL = "redis://localhost:6379/15?socket_timeout=10"
+DURATION = 30
+QUEUE_NUM = 20
+
+
+def produce(queues, stop_event):
+    """
+    随机间隔入队
+    """
+    while not stop_event.is_set():
+        stop_event.wait(random.uniform(0.2, 1))
+        random.choice(queues).enqueue("%.6f" % time.time(), result_ttl=0)
+
+
+def consume(mode, queues, connection, stop_event, latencies):
+    """
+    出队并记录延迟
+    """
+    while not stop_event.is_set():
+        result = Queue.dequeue_any(list(queues), connection=connection)
+        if result == defaults.RATE_LIMITED:
+            time.sleep(0.02)
+            continue
+        if result is None:
+            if mode == "poll":
+                stop_event.wait(5)
+            else:
+                Queue.wait_any(queues, timeout=1, connection=connection)
+            continue
+        msg, queue = result
+        latencies.append(time.time() - float(msg.data))
+        connection.zrem("mq:wip:{%s}" % queue.name, msg.id)
+        msg.delete()
+
+
+def run(mode, connection, duration):
+    """
+    单项测试
+    """
+    queues = [Queue("bench_wakeup_%d" % i, connection=connection) for i in range(QUEUE_NUM)]
+    for queue in queues:
+        queue.delete()
+    latencies = []
+    stop_event = threading.Event()
+    threads = [threading.Thread(target=produce, args=(queues, stop_event)),
+               threading.Thread(target=consume, args=(mode, queues, connection, stop_event, latencies))]
+
+    commands_before = connection.info("stats")["total_commands_processed"]
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop_event.set()
+    for thread in threads:
+        thread.join()
+    commands = connection.info("stats")["total_commands_processed"] - commands_before
+
+    for queue in queues:
+        queue.delete()
+        connection.delete("mq:wip:{%s}" % queue.name)
+    latencies.sort()
+    if not latencies:
+        print "{mode:<8} no msgs".format(mode=mode)
+        return
+    print ("{mode:<8} msgs={count:<4} latency avg {avg:>8.1f} ms  p50 {p50:>8.1f} ms  p99 {p99:>8.1f} ms  "
+           "redis {ops:>6.1f} cmds/s").format(
+        mode=mode, count=len(latencies),
+        avg=sum(latencies) / len(latencies) * 1000,
+        p50=latencies[len(latencies) // 2] * 1000,
+        p99=latencies[int(len(latencies) * 0.99)] * 1000,
+        ops=commands / float(duration))
+
+
+if __name__ == "__main__":
+    redis_url = sys.argv[1] if len(sys.argv) > 1 else REDIS_URL
+    duration = int(sys.argv[2]) if len(sys.argv) > 2 else DURATION
+    connection = redisorm.Database.from_url(redis_url)
+    print "{queue_num} queues, {duration}s".format(queue_num=QUEUE_NUM, duration=duration)
+    for mode in ("poll", "notify"):
+        run(mode, connection, duration)
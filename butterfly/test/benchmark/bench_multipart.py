@@ -0,0 +1,112 @@
+#!/usr/bin/python
+# coding=utf8
+"""
+# File Name: bench_multipart.py
+# Description:
+    multipart/form-data 解析吞吐及内存测试
+
+    请求 body 为 FILE_NUM 个 FILE_SIZE 的随机文件 + 2 个普通字段, 先写入临时文件, 模拟 wsgi.input
+    每种方式在单独的子进程中执行, 记录耗时及进程最大 RSS:
+        stream : Request.parse_multipart, 按 64KB 读取, 文件写入临时文件并计算 md5
+        memory : 读取整个 body 到内存后解析(旧的 read_wsgi_post + parse_multipart_raw 方式)
+        cgi    : 标准库 cgi.FieldStorage
+
+    结果(Python 2.7, ext4):
+        4 x 32MB : stream 304 MB/s maxrss 16 MB, memory 210 MB/s maxrss 273 MB, cgi 91 MB/s maxrss 17 MB
+        16 x 4MB : stream 299 MB/s maxrss 16 MB, memory 215 MB/s maxrss 145 MB, cgi 81 MB/s maxrss 18 MB
+    stream 的内存占用与请求大小无关, 吞吐主要受 md5 及写临时文件限制
+
+Usage:
+    cd butterfly && python test/benchmark/bench_multipart.py [FILE_NUM] [FILE_SIZE_MB]
+"""
+import os
+import sys
+import cgi
+import time
+import resource
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from xlib import httpgateway
+from xlib import multipart
+
+BOUNDARY = "----butterflyBench7MA4YWxkTrZu0gW"
+FILE_NUM = 4
+FILE_SIZE = 32 * 1024 * 1024
+
+
+def make_body_file(file_num, file_size):
+    """
+    生成 multipart body 文件
+
+    Returns:
+        (String) 文件路径
+    """
+    fd, path = tempfile.mkstemp(prefix="bench_multipart_")
+    with os.fdopen(fd, "wb") as f:
+        for name in ("title", "desc"):
+            f.write("--%s\r\nContent-Disposition: form-data; name=\"%s\"\r\n\r\n%s\r\n" % (BOUNDARY, name, name * 10))
+        for i in range(file_num):
+            f.write("--%s\r\nContent-Disposition: form-data; name=\"file%d\"; filename=\"file%d.bin\"\r\n"
+                    "Content-Type: application/octet-stream\r\n\r\n" % (BOUNDARY, i, i))
+            for _ in range(file_size / (1024 * 1024)):
+                f.write(os.urandom(1024 * 1024))
+            f.write("\r\n")
+        f.write("--%s--\r\n" % BOUNDARY)
+    return path
+
+
+def make_wsgienv(path):
+    return {
+        "REQUEST_METHOD": "POST",
+        "CONTENT_TYPE": "multipart/form-data; boundary=" + BOUNDARY,
+        "CONTENT_LENGTH": str(os.path.getsize(path)),
+        "wsgi.input": open(path, "rb"),
+    }
+
+
+def run_stream(wsgienv):
+    req = httpgateway.Request("reqid", wsgienv, "127.0.0.1")
+    parts = req.parse_multipart()
+    req.close()
+    return len(parts)
+
+
+def run_memory(wsgienv):
+    body = httpgateway.read_wsgi_post(wsgienv)
+    return len(httpgateway.parse_multipart_raw(body))
+
+
+def run_cgi(wsgienv):
+    form = cgi.FieldStorage(fp=wsgienv["wsgi.input"], environ=wsgienv, keep_blank_values=True)
+    return len(form.list)
+
+
+MODES = {"stream": run_stream, "memory": run_memory, "cgi": run_cgi}
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3 and sys.argv[1] in MODES:
+        # 子进程: 执行单项测试
+        mode, path = sys.argv[1:]
+        wsgienv = make_wsgienv(path)
+        start = time.time()
+        count = MODES[mode](wsgienv)
+        cost = time.time() - start
+        size_mb = int(wsgienv["CONTENT_LENGTH"]) / 1024.0 / 1024
+        maxrss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+        print "  {mode:<8} parts={count} {speed:>8.0f} MB/s  maxrss {rss:>6.0f} MB".format(
+            mode=mode, count=count, speed=size_mb / cost, rss=maxrss_mb)
+        sys.exit(0)
+
+    file_num = int(sys.argv[1]) if len(sys.argv) > 1 else FILE_NUM
+    file_size = int(sys.argv[2]) * 1024 * 1024 if len(sys.argv) > 2 else FILE_SIZE
+    body_path = make_body_file(file_num, file_size)
+    try:
+        print "{file_num} x {size} MB".format(file_num=file_num, size=file_size / 1024 / 1024)
+        for mode in ("stream", "memory", "cgi"):
+            subprocess.check_call([sys.executable, os.path.abspath(__file__), mode, body_path])
+    finally:
+        os.remove(body_path)
@@ -0,0 +1,98 @@
+#!/usr/bin/python
+# coding=utf8
+"""
+# File Name: bench_redis_script.py
+# Description:
+    Lua 脚本调用方式测试: EVAL(每次发送源码) 与 script_registry(EVALSHA)
+
+    (1) 每次调用发送的字节数(按 RESP 协议编码, 不需要 redis-server)
+    (2) 每秒调用次数(需要 redis-server, 无法连接时跳过), 脚本为 mq_lpop, 队列为空
+
+    结果(Python 2.7, 字节数, 本地无 redis-server 未测试 ops/s):
+        mq_empty         EVAL   655 B  EVALSHA   148 B
+        mq_lpop          EVAL   227 B  EVALSHA   146 B
+        mq_dequeue       EVAL  1328 B  EVALSHA   232 B
+        mq_start_msg     EVAL   402 B  EVALSHA   154 B
+        cas              EVAL   391 B  EVALSHA   120 B
+
+Usage:
+    cd butterfly && python test/benchmark/bench_redis_script.py [REDIS_URL]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from xlib.db import redisorm
+from xlib.db.redis.connection import Connection
+from xlib.db.redis.exceptions import ConnectionError
+from xlib.mq import queue
+
+REDIS_URL = "redis://localhost:6379/15?socket_timeout=2&socket_connect_timeout=0.5"
+NUMBER = 20000
+
+# 脚本名称 => (KEYS, ARGV), 与实际调用的参数长度一致
+CALLS = [
+    ("mq_empty", ["mq:queue:{bench_script}", "mq:scheduled:{bench_script}"], ["mq:msg:"]),
+    ("mq_lpop", ["mq:queue:{bench_script}", "mq:wip:{bench_script}"], [1634567890]),
+    ("mq_dequeue", ["mq:queue:{bench_script}", "mq:wip:{bench_script}", "mq:rate_limit:{bench_script}:worker"],
+     [20, 1634567890, "1634567890.12", 30, 1]),
+    ("mq_start_msg", ["mq:msg:0123456789abcdef"], ["started", "2021-10-18T12:00:00.000000Z", ""]),
+    ("cas", ["bench_script"], ["old_value", "new_value"]),
+]
+
+
+def packed_size(connection, *args):
+    """
+    命令编码后的字节数
+    """
+    return sum(len(chunk) for chunk in connection.pack_command(*args))
+
+
+def bench_bytes(database):
+    """
+    每次调用发送的字节数
+    """
+    connection = Connection()
+    for name, keys, args in CALLS:
+        script = database.script_registry.get(name)
+        eval_size = packed_size(connection, "EVAL", script.script, len(keys), *(keys + args))
+        evalsha_size = packed_size(connection, "EVALSHA", script.sha, len(keys), *(keys + args))
+        print "{name:<16} EVAL {eval:>5} B  EVALSHA {evalsha:>5} B".format(
+            name=name, eval=eval_size, evalsha=evalsha_size)
+
+
+def bench_ops(database):
+    """
+    每秒调用次数
+    """
+    keys = ["mq:queue:{bench_script}", "mq:wip:{bench_script}"]
+    args = [1634567890]
+    source = database.script_registry.get(queue.LUA_LPOP).script
+    database.load_scripts()
+
+    start = time.time()
+    for _ in range(NUMBER):
+        database.eval(source, len(keys), *(keys + args))
+    eval_cost = time.time() - start
+
+    start = time.time()
+    for _ in range(NUMBER):
+        database.script_registry(queue.LUA_LPOP, keys=keys, args=args)
+    evalsha_cost = time.time() - start
+
+    print "mq_lpop EVAL {eval:>8.0f} ops/s  EVALSHA {evalsha:>8.0f} ops/s".format(
+        eval=NUMBER / eval_cost, evalsha=NUMBER / evalsha_cost)
+
+
+if __name__ == "__main__":
+    redis_url = sys.argv[1] if len(sys.argv) > 1 else REDIS_URL
+    database = redisorm.Database.from_url(redis_url)
+    bench_bytes(database)
+    try:
+        database.ping()
+    except ConnectionError:
+        print "redis-server {url} unavailable, skip ops/s".format(url=redis_url)
+    else:
+        bench_ops(database)
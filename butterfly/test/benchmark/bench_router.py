@@ -0,0 +1,59 @@
+#!/usr/bin/python
+# coding=utf8
+"""
+# File Name: bench_router.py
+# Description:
+    Router 路由匹配耗时测试
+
+    (1) 注册 5000 个静态路由(/app{i}/func{j}) 及 5000 个动态路由(/app{i}/res{j}/{name}, /app{i}/res{j}/{id:int}/sub)
+    (2) 分别测试 dict 查找(原 apicube 方式)/Router 静态路由/Router 动态路由/未匹配的耗时
+
+Usage:
+    cd butterfly && python test/benchmark/bench_router.py
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from xlib import urls
+
+APPS = 50
+ROUTES_PER_APP = 100
+NUMBER = 100000
+
+
+def build():
+    """
+    注册路由
+    """
+    apicube = {}
+    router = urls.Router()
+    for i in range(APPS):
+        for j in range(ROUTES_PER_APP):
+            path = "/app%d/func%d" % (i, j)
+            apicube[path] = path
+            router.add(path, path)
+            router.add("/app%d/res%d/{name}" % (i, j), "res", methods=["GET"])
+            router.add("/app%d/res%d/{id:int}/sub" % (i, j), "sub")
+    return apicube, router
+
+
+def run(name, func):
+    """
+    单项测试
+    """
+    cost = min(timeit.repeat(func, number=NUMBER, repeat=3))
+    print "{name:<16} {us:>8.3f} us/op {ops:>12.0f} ops/s".format(
+        name=name, us=cost / NUMBER * 1e6, ops=NUMBER / cost)
+
+
+if __name__ == "__main__":
+    apicube, router = build()
+    print "routes: {count}".format(count=len(router.routes()))
+    run("dict", lambda: apicube.get("/app25/func50"))
+    run("router static", lambda: router.match("/app25/func50", "GET"))
+    run("router dynamic", lambda: router.match("/app25/res50/host1", "GET"))
+    run("router int", lambda: router.match("/app25/res50/12/sub", "GET"))
+    run("router miss", lambda: router.match("/app25/res50/x/y/z", "GET"))
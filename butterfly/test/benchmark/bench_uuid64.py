@@ -0,0 +1,36 @@
+#!/usr/bin/python
+# coding=utf8
+"""
+# File Name: bench_uuid64.py
+# Description:
+    reqid 生成耗时测试: v1(uuid_generate_time + DES) 与 v2(位混淆)
+
+Usage:
+    cd butterfly && python test/benchmark/bench_uuid64.py
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from xlib import uuid64
+
+NUMBER = 20000
+
+
+def run(name, func):
+    """
+    单项测试
+    """
+    cost = min(timeit.repeat(func, number=NUMBER, repeat=3))
+    print "{name:<8} {us:>8.2f} us/op {ops:>12.0f} ops/s".format(
+        name=name, us=cost / NUMBER * 1e6, ops=NUMBER / cost)
+    return cost
+
+
+if __name__ == "__main__":
+    generator = uuid64.UUID64()
+    v1 = run("gen_v1", generator.gen_v1)
+    v2 = run("gen", generator.gen)
+    print "speedup: {speedup:.1f}x".format(speedup=v1 / v2)
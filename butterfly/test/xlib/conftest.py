@@ -9,13 +9,16 @@
 
 """
 import os
+import time
 import pytest
 from xlib import httpgateway
 from xlib import protocol_json
 from xlib import protocol_file
 from xlib import retstat
+from xlib import deadline
 from conf import config
 from xlib import logger
+from xlib.middleware import funcattr
 
 PATH_ACC_LOG = "logs/acc.log_test"
 PATH_ERR_LOG = "logs/err.log_test"
@@ -27,6 +30,56 @@ def demo_test1(req, str_info):
     return retstat.OK, {"str_info": str_info}
 
 
+@funcattr.params(is_detail=bool)
+def demo_page(req, page_index=1, is_detail=False):
+    return retstat.OK, {"page_index": page_index, "is_detail": is_detail}
+
+
+demo_cached_calls = []
+
+
+@funcattr.cached(ttl=60, vary=["page_index"])
+def demo_cached(req, page_index=1, trace=None):
+    demo_cached_calls.append(page_index)
+    if page_index < 0:
+        return retstat.ERR_BAD_PARAMS, {}
+    if page_index == 4:
+        return retstat.OK, {"page_index": page_index}, [("Set-Cookie", "sid=%s" % trace)]
+    return retstat.OK, {"page_index": page_index}, [("Cache-Control", "max-age=60")]
+
+
+def demo_stream(req, count=3, fail_at=-1):
+    def rows():
+        for i in range(count):
+            if i == fail_at:
+                raise ValueError("fail at %s" % i)
+            yield {"id": i, "name": "x" * 100}
+    return retstat.OK, {"total": count, "list": rows()}
+
+
+demo_upload_files = []
+
+
+def demo_upload(req, title, file, count=1):
+    demo_upload_files.append(file)
+    return retstat.OK, {"title": title, "count": count, "filename": file.filename,
+                        "size": file.size, "md5": file.hashes["md5"]}
+
+
+@funcattr.max_concurrency(1)
+def demo_limited(req, count=0):
+    def rows():
+        for i in range(count):
+            yield i
+    return retstat.OK, {"list": rows()} if count else {}
+
+
+def demo_deadline(req, sleep=0.0):
+    time.sleep(sleep)
+    deadline.check()
+    return retstat.OK, {"deadline": req.deadline}
+
+
 def demo_file1(req):
     return retstat.OK, {"filename": "test/static_file/test_html.html", "is_download": False}
 
@@ -44,6 +97,42 @@ def init_data():
                                                     True,
                                                     True,
                                                     errlog)
+    apicube["/demo_page"] = protocol_json.Protocol(demo_page,
+                                                   retstat.ERR_SERVER_EXCEPTION,
+                                                   retstat.ERR_BAD_PARAMS,
+                                                   True,
+                                                   True,
+                                                   errlog)
+    apicube["/demo_cached"] = protocol_json.Protocol(demo_cached,
+                                                     retstat.ERR_SERVER_EXCEPTION,
+                                                     retstat.ERR_BAD_PARAMS,
+                                                     True,
+                                                     True,
+                                                     errlog)
+    apicube["/demo_stream"] = protocol_json.Protocol(demo_stream,
+                                                     retstat.ERR_SERVER_EXCEPTION,
+                                                     retstat.ERR_BAD_PARAMS,
+                                                     True,
+                                                     True,
+                                                     errlog)
+    apicube["/demo_upload"] = protocol_json.Protocol(demo_upload,
+                                                     retstat.ERR_SERVER_EXCEPTION,
+                                                     retstat.ERR_BAD_PARAMS,
+                                                     True,
+                                                     True,
+                                                     errlog)
+    apicube["/demo_limited"] = protocol_json.Protocol(demo_limited,
+                                                      retstat.ERR_SERVER_EXCEPTION,
+                                                      retstat.ERR_BAD_PARAMS,
+                                                      True,
+                                                      True,
+                                                      errlog)
+    apicube["/demo_deadline"] = protocol_json.Protocol(demo_deadline,
+                                                       retstat.ERR_SERVER_EXCEPTION,
+                                                       retstat.ERR_BAD_PARAMS,
+                                                       True,
+                                                       True,
+                                                       errlog)
     apicube["/demo_file1"] = protocol_file.Protocol(demo_file1,
                                                     retstat.ERR_SERVER_EXCEPTION,
                                                     retstat.ERR_BAD_PARAMS,
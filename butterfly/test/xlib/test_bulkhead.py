@@ -0,0 +1,87 @@
+#!/usr/bin/python
+# coding=utf8
+"""
+# File Name: test_bulkhead.py
+# Description:
+    路由并发限制测试
+
+"""
+import time
+import threading
+
+import pytest
+
+from xlib import bulkhead
+from xlib import httpgateway
+
+
+def test_bulkhead():
+    """
+    达到上限时立即拒绝, 释放后可再次获取
+    """
+    limiter = bulkhead.Bulkhead(2)
+    assert limiter.acquire()
+    assert limiter.acquire()
+    assert not limiter.acquire()
+    limiter.release()
+    assert limiter.acquire()
+    limiter.release()
+    limiter.release()
+    assert limiter.stats() == {"limit": 2, "queue_timeout": 0, "in_flight": 0, "waiting": 0, "peak": 2,
+                               "accepted": 3, "rejected": 1}
+
+    with pytest.raises(ValueError):
+        bulkhead.Bulkhead(0)
+
+
+def test_bulkhead_queue_timeout():
+    """
+    达到上限时最多等待 queue_timeout 秒
+    """
+    limiter = bulkhead.Bulkhead(1, queue_timeout=0.05)
+    assert limiter.acquire()
+    start = time.time()
+    assert not limiter.acquire()
+    assert time.time() - start >= 0.05
+
+    # 等待期间释放
+    timer = threading.Timer(0.01, limiter.release)
+    timer.start()
+    limiter.queue_timeout = 5
+    assert limiter.acquire()
+    timer.join()
+    assert limiter.stats()["in_flight"] == 1
+
+
+def test_on_close():
+    """
+    响应发送完成后执行回调, 仅执行一次
+    """
+    calls = []
+    assert httpgateway.on_close(("body",), lambda: calls.append(1)) == ("body",)
+    assert calls == [1]
+
+    def gen():
+        yield "a"
+        yield "b"
+    content = httpgateway.on_close(gen(), lambda: calls.append(2))
+    assert calls == [1]
+    assert list(content) == ["a", "b"]
+    content.close()
+    content.close()
+    assert calls == [1, 2]
+
+    closed = []
+
+    class Body(object):
+        def __iter__(self):
+            return iter(["a"])
+
+        def close(self):
+            closed.append(True)
+
+    body = Body()
+    assert httpgateway.on_close(body, lambda: calls.append(3)) is body
+    body.close()
+    assert closed == [True]
+    assert calls == [1, 2, 3]
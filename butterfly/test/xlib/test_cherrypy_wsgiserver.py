@@ -0,0 +1,439 @@
+#!/usr/bin/python
+# coding=utf8
+"""
+# File Name: test_cherrypy_wsgiserver.py
+# Description:
+    CherryPyWSGIServer 测试, 在本地随机端口启动 server
+
+"""
+import os
+import sys
+import time
+import signal
+import socket
+import threading
+import subprocess
+
+import pytest
+
+from xlib import cherrypy_wsgiserver
+
+REQUEST = "GET /ping HTTP/1.1\r\nHost: localhost\r\n\r\n"
+
+
+def ping_app(environ, start_response):
+    """
+    test wsgi app
+    """
+    body = "pong"
+    start_response("200 OK", [("Content-Type", "text/plain"), ("Content-Length", str(len(body)))])
+    return [body]
+
+
+def wait_until(func, timeout=5):
+    """
+    等待 func() 为 True
+    """
+    end = time.time() + timeout
+    while time.time() < end:
+        if func():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def read_responses(sock, count):
+    """
+    读取 count 个响应
+    """
+    data = ""
+    while data.count("pong") < count:
+        chunk = sock.recv(4096)
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+
+@pytest.fixture()
+def parking_server():
+    """
+    开启 keep-alive parking 的 server
+    """
+    server = cherrypy_wsgiserver.CherryPyWSGIServer(
+        ("127.0.0.1", 0), ping_app, 2, perfork=1, keep_alive_parking=True)
+    server_thread = threading.Thread(target=server.start)
+    server_thread.setDaemon(True)
+    server_thread.start()
+    assert wait_until(lambda: server.ready and server.parking is not None)
+    yield server
+    server.stop()
+
+
+def test_keepalive_parking(parking_server):
+    """
+    请求处理完成后, 空闲的 keep-alive 连接交还给 server, 不占用 worker 线程
+    """
+    port = parking_server.socket.getsockname()[1]
+    sock = socket.create_connection(("127.0.0.1", port))
+    sock.settimeout(5)
+
+    sock.sendall(REQUEST)
+    assert read_responses(sock, 1).startswith("HTTP/1.1 200 OK")
+    assert wait_until(lambda: len(parking_server.parking) == 1)
+    assert wait_until(lambda: parking_server.requests.idle == 2)
+
+    # 同一个连接上的下一个请求
+    sock.sendall(REQUEST)
+    assert read_responses(sock, 1).startswith("HTTP/1.1 200 OK")
+    sock.close()
+
+
+def test_keepalive_parking_pipelining(parking_server):
+    """
+    pipelining 的请求已在读缓存区中时, 由 worker 线程继续处理
+    """
+    port = parking_server.socket.getsockname()[1]
+    sock = socket.create_connection(("127.0.0.1", port))
+    sock.settimeout(5)
+
+    sock.sendall(REQUEST * 3)
+    assert read_responses(sock, 3).count("HTTP/1.1 200 OK") == 3
+    sock.close()
+
+
+def test_keepalive_parking_expire(parking_server):
+    """
+    parked 的连接空闲超过 timeout 后被关闭
+    """
+    parking_server.timeout = 0.1
+    port = parking_server.socket.getsockname()[1]
+    sock = socket.create_connection(("127.0.0.1", port))
+    sock.settimeout(5)
+
+    sock.sendall(REQUEST)
+    read_responses(sock, 1)
+    assert wait_until(lambda: len(parking_server.parking) == 1)
+    assert wait_until(lambda: len(parking_server.parking) == 0, timeout=3)
+    assert sock.recv(4096) == ""
+    sock.close()
+
+
+PERFORK_SERVER = """
+import os
+import sys
+sys.path.insert(0, %(root)r)
+from xlib import cherrypy_wsgiserver
+
+
+def pid_app(environ, start_response):
+    body = "%%s %%s" %% (os.getpid(), environ["wsgi.multiprocess"])
+    start_response("200 OK", [("Content-Type", "text/plain"), ("Content-Length", str(len(body)))])
+    return [body]
+
+
+def after_perfork(worker_index):
+    sys.stdout.write("worker %%s %%s\\n" %% (worker_index, os.getpid()))
+    sys.stdout.flush()
+
+
+cherrypy_wsgiserver.CherryPyWSGIServer(
+    ("127.0.0.1", %(port)d), pid_app, 2, perfork=2, after_perfork=after_perfork,
+    reuse_port=%(reuse_port)r).start()
+"""
+
+
+def get_free_port():
+    """
+    获取一个空闲端口
+    """
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def get_pid(port):
+    """
+    请求 server, 返回处理请求的进程 pid
+    """
+    sock = socket.create_connection(("127.0.0.1", port))
+    sock.settimeout(5)
+    sock.sendall("GET / HTTP/1.0\r\n\r\n")
+    data = ""
+    while True:
+        chunk = sock.recv(4096)
+        if not chunk:
+            break
+        data += chunk
+    sock.close()
+    pid, multiprocess = data.split("\r\n\r\n", 1)[1].split()
+    assert multiprocess == "True"
+    return int(pid)
+
+
+@pytest.mark.parametrize("reuse_port", [False, True])
+def test_perfork_respawn(reuse_port):
+    """
+    多进程模式: 主进程在子进程退出后重新拉起, 收到 SIGTERM 后停止所有子进程
+    """
+    root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    port = get_free_port()
+    master = subprocess.Popen(
+        [sys.executable, "-c", PERFORK_SERVER % {"root": root, "port": port, "reuse_port": reuse_port}],
+        stdout=subprocess.PIPE)
+    try:
+        workers = {}
+        for _ in range(2):
+            _, index, pid = master.stdout.readline().split()
+            workers[int(index)] = int(pid)
+        assert sorted(workers) == [0, 1]
+
+        assert wait_until(lambda: get_pid(port) in workers.values())
+
+        # 杀掉 0 号子进程, 主进程重新拉起
+        os.kill(workers[0], signal.SIGKILL)
+        _, index, pid = master.stdout.readline().split()
+        assert int(index) == 0
+        assert int(pid) not in workers.values()
+        workers[0] = int(pid)
+
+        pids = set()
+        for _ in range(50):
+            try:
+                pids.add(get_pid(port))
+            except socket.error:
+                pass
+        assert pids <= set(workers.values())
+        assert pids
+
+        master.send_signal(signal.SIGTERM)
+        assert wait_until(lambda: master.poll() is not None)
+        assert master.returncode == 0
+    finally:
+        if master.poll() is None:
+            master.kill()
+
+
+class BlockingConn(object):
+    """
+    worker 线程处理时阻塞, 直到 release 被设置
+    """
+    queued_at = None
+
+    def __init__(self, release):
+        self.release = release
+
+    def communicate(self):
+        self.release.wait()
+        return False
+
+    def close(self):
+        pass
+
+
+class KeepAliveConn(BlockingConn):
+    """
+    处理完成后保持连接(交还给 parking)
+    """
+
+    def __init__(self, release):
+        BlockingConn.__init__(self, release)
+        self.closed = threading.Event()
+
+    def communicate(self):
+        self.release.wait()
+        return True
+
+    def close(self):
+        self.closed.set()
+
+
+def test_keepalive_parking_stopped():
+    """
+    server stop 后(parking 为 None), worker 线程关闭处理完成的 keep-alive 连接
+    """
+    server = cherrypy_wsgiserver.CherryPyWSGIServer(("127.0.0.1", 0), ping_app, 1, perfork=1,
+                                                    keep_alive_parking=True)
+    pool = server.requests
+    pool.start()
+    release = threading.Event()
+    try:
+        conn = KeepAliveConn(release)
+        pool.put(conn)
+        assert wait_until(lambda: pool.idle == 0)
+        assert server.parking is None
+        release.set()
+        assert conn.closed.wait(5)
+        # worker 线程没有因 AttributeError 退出
+        assert wait_until(lambda: pool.idle == 1)
+    finally:
+        release.set()
+        pool.stop()
+
+
+def test_thread_pool_autoscaler():
+    """
+    队列积压时扩容到 max, 负载下降后缩容到 min
+    """
+    server = cherrypy_wsgiserver.CherryPyWSGIServer(("127.0.0.1", 0), ping_app, 2, max=6, perfork=1)
+    pool = server.requests
+    pool.start()
+    autoscaler = cherrypy_wsgiserver.ThreadPoolAutoScaler(pool)
+    autoscaler.shrink_delay = 0
+    release = threading.Event()
+    try:
+        for _ in range(5):
+            pool.put(BlockingConn(release))
+        assert wait_until(lambda: pool.idle == 0)
+
+        # 2 个线程繁忙, 队列中积压 3 个连接
+        autoscaler.tick()
+        assert len(pool._threads) == 5
+        assert wait_until(lambda: pool.qsize == 0)
+
+        # 继续积压, 不超过 max
+        for _ in range(4):
+            pool.put(BlockingConn(release))
+        assert wait_until(lambda: pool.idle == 0)
+        autoscaler.tick()
+        assert len(pool._threads) == 6
+
+        # 负载下降后逐步缩容到 min
+        release.set()
+        assert wait_until(lambda: pool.qsize == 0 and pool.idle == len(pool._threads))
+        for _ in range(50):
+            autoscaler.tick()
+            time.sleep(0.02)
+        assert wait_until(lambda: pool._cull_dead() >= 0 and len(pool._threads) == 2)
+    finally:
+        release.set()
+        pool.stop()
+
+
+def test_queue_delay_shedder():
+    """
+    CoDel: 突发排队只丢弃超过 interval 的请求, 持续排队(过载)时丢弃超过 target 的请求
+    """
+    shedder = cherrypy_wsgiserver.QueueDelayShedder(0.05, 0.2)
+    assert shedder.retry_after == 1
+
+    # 非过载状态
+    assert not shedder.should_shed(0.1)
+    assert shedder.should_shed(0.3)
+
+    # 本 interval 内最小排队耗时超过 target, 下个 interval 进入过载状态
+    time.sleep(0.25)
+    assert not shedder.should_shed(0.01)
+    assert shedder.should_shed(0.1)
+
+    # 本 interval 内最小排队耗时低于 target, 下个 interval 恢复
+    time.sleep(0.25)
+    assert not shedder.should_shed(0.1)
+    assert shedder.shed_count == 2
+
+
+def test_queue_full_503():
+    """
+    队列满时, 新连接返回 503
+    """
+    server = cherrypy_wsgiserver.CherryPyWSGIServer(("127.0.0.1", 0), ping_app, 1, perfork=1)
+    server.requests._queue = cherrypy_wsgiserver.queue.Queue(1)
+    server.requests._queue_put_timeout = 0.01
+    server.requests.put(BlockingConn(threading.Event()))
+    server_sock, client_sock = socket.socketpair()
+    try:
+        conn = server.ConnectionClass(server, server_sock)
+        server._put_conn(conn)
+        data = client_sock.recv(4096)
+        assert data.startswith("HTTP/1.1 503 Service Unavailable\r\n")
+        assert "Retry-After: 1\r\n" in data
+        assert server.stats["Queue Full Rejected"](server.stats) == 1
+    finally:
+        client_sock.close()
+
+
+def test_file_wrapper_sendfile(tmpdir, monkeypatch):
+    """
+    wsgi.file_wrapper: 声明了 Content-Length 时使用 sendfile 发送, 否则按块读取发送
+    """
+    path = tmpdir.join("data.bin")
+    body = os.urandom(3 * 1024 * 1024 + 7)
+    path.write(body, mode="wb")
+
+    def file_app(environ, start_response):
+        headers = [("Content-Type", "application/octet-stream")]
+        if environ["PATH_INFO"] == "/sendfile":
+            headers.append(("Content-Length", str(len(body))))
+        start_response("200 OK", headers)
+        return environ["wsgi.file_wrapper"](open(str(path), "rb"), 65536)
+
+    calls = []
+    real_sendfile = cherrypy_wsgiserver.sendfile
+    if real_sendfile is None:
+        pytest.skip("sendfile not available")
+
+    def counting_sendfile(*args):
+        calls.append(args)
+        return real_sendfile(*args)
+    monkeypatch.setattr(cherrypy_wsgiserver, "sendfile", counting_sendfile)
+
+    server = cherrypy_wsgiserver.CherryPyWSGIServer(("127.0.0.1", 0), file_app, 2, perfork=1)
+    server_thread = threading.Thread(target=server.start)
+    server_thread.setDaemon(True)
+    server_thread.start()
+    assert wait_until(lambda: server.ready)
+    port = server.socket.getsockname()[1]
+    try:
+        for path_info, use_sendfile in (("/sendfile", True), ("/chunked", False)):
+            del calls[:]
+            sock = socket.create_connection(("127.0.0.1", port))
+            sock.settimeout(5)
+            sock.sendall("GET %s HTTP/1.0\r\n\r\n" % path_info)
+            data = ""
+            while True:
+                chunk = sock.recv(65536)
+                if not chunk:
+                    break
+                data += chunk
+            sock.close()
+            head, content = data.split("\r\n\r\n", 1)
+            assert head.startswith("HTTP/1.1 200 OK")
+            assert content == body
+            assert bool(calls) == use_sendfile
+    finally:
+        server.stop()
+
+
+def test_max_request_body_size():
+    """
+    Content-Length 超过 max_request_body_size 时, 不读取 body 直接返回 413
+    """
+    def echo_app(environ, start_response):
+        body = environ["wsgi.input"].read(int(environ["CONTENT_LENGTH"]))
+        start_response("200 OK", [("Content-Type", "text/plain"), ("Content-Length", str(len(body)))])
+        return [body]
+
+    server = cherrypy_wsgiserver.CherryPyWSGIServer(
+        ("127.0.0.1", 0), echo_app, 2, perfork=1, max_request_body_size=10)
+    server_thread = threading.Thread(target=server.start)
+    server_thread.setDaemon(True)
+    server_thread.start()
+    assert wait_until(lambda: server.ready)
+    port = server.socket.getsockname()[1]
+    try:
+        for body, status in (("x" * 10, "200 OK"), ("x" * 11, "413 Request Entity Too Large")):
+            sock = socket.create_connection(("127.0.0.1", port))
+            sock.settimeout(5)
+            sock.sendall("POST / HTTP/1.0\r\nContent-Length: %d\r\n\r\n%s" % (len(body), body))
+            data = ""
+            while True:
+                chunk = sock.recv(4096)
+                if not chunk:
+                    break
+                data += chunk
+            sock.close()
+            assert data.startswith("HTTP/1.1 %s\r\n" % status)
+    finally:
+        server.stop()
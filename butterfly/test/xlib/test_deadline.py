@@ -0,0 +1,126 @@
+#!/usr/bin/python
+# coding=utf8
+"""
+# File Name: test_deadline.py
+# Description:
+    请求 deadline 测试
+
+"""
+import time
+import socket
+
+import pytest
+
+from xlib import deadline
+from xlib.db.redis import connection as redis_connection
+from xlib.db.redis.exceptions import TimeoutError as RedisTimeoutError
+from xlib.ral import nshead
+
+
+@pytest.fixture()
+def request_deadline():
+    """
+    测试结束后清除线程内的 deadline
+    """
+    yield deadline.set_deadline
+    deadline.set_deadline(None)
+
+
+def test_parse_headers():
+    """
+    X-Request-Timeout 为相对时间, X-Request-Deadline 为绝对时间, 同时存在时取较早的
+    """
+    assert deadline.parse_headers({}, 100.0) is None
+    assert deadline.parse_headers({}, 100.0, 5) == 105.0
+    assert deadline.parse_headers({"HTTP_X_REQUEST_TIMEOUT": "1.5"}, 100.0, 5) == 101.5
+    assert deadline.parse_headers({"HTTP_X_REQUEST_DEADLINE": "103"}, 100.0) == 103.0
+    assert deadline.parse_headers({"HTTP_X_REQUEST_TIMEOUT": "10", "HTTP_X_REQUEST_DEADLINE": "103"}, 100.0) == 103.0
+    assert deadline.parse_headers({"HTTP_X_REQUEST_TIMEOUT": "abc"}, 100.0) is None
+
+
+def test_shrink_timeout(request_deadline):
+    """
+    按剩余时间缩短超时, 超过 deadline 时抛出 DeadlineExceeded
+    """
+    assert deadline.shrink_timeout(3) == 3
+    assert deadline.shrink_timeout(None) is None
+    assert not deadline.expired()
+
+    request_deadline(time.time() + 1)
+    assert 0.9 < deadline.shrink_timeout(3) <= 1
+    assert 0.9 < deadline.shrink_timeout(None) <= 1
+    assert deadline.shrink_timeout(0.1) == 0.1
+    deadline.check()
+
+    request_deadline(time.time() - 0.01)
+    assert deadline.expired()
+    with pytest.raises(deadline.DeadlineExceeded):
+        deadline.shrink_timeout(3)
+    with pytest.raises(deadline.DeadlineExceeded):
+        deadline.check()
+
+
+def test_socket_timeout(request_deadline):
+    """
+    nshead 读取时按剩余时间缩短超时, 结束后恢复
+    """
+    server, client = socket.socketpair()
+    try:
+        client.settimeout(5)
+        request_deadline(time.time() + 0.05)
+        start = time.time()
+        with pytest.raises(socket.timeout):
+            nshead.nshead_read(client)
+        assert time.time() - start < 1
+        assert client.gettimeout() == 5
+    finally:
+        server.close()
+        client.close()
+
+
+def test_redis_connection(request_deadline, monkeypatch):
+    """
+    redis 命令按剩余时间缩短超时; 已超过 deadline 时不发送命令
+    """
+    pairs = []
+
+    def connect():
+        pairs.append(socket.socketpair())
+        return pairs[-1][1]
+
+    conn = redis_connection.Connection(socket_timeout=5)
+    monkeypatch.setattr(conn, "_connect", connect)
+    try:
+        conn.send_command("PING")
+        assert pairs[-1][0].recv(100) == "*1\r\n$4\r\nPING\r\n"
+        pairs[-1][0].sendall("+PONG\r\n")
+        assert conn.read_response() == "PONG"
+
+        # server 不响应, 在 deadline 时超时(断开连接)
+        request_deadline(time.time() + 0.05)
+        conn.send_command("PING")
+        assert pairs[-1][0].recv(100) == "*1\r\n$4\r\nPING\r\n"
+        start = time.time()
+        with pytest.raises(RedisTimeoutError):
+            conn.read_response()
+        assert time.time() - start < 1
+        assert conn._sock is None
+
+        # 已超过 deadline
+        request_deadline(None)
+        conn.connect()
+        request_deadline(time.time() - 0.01)
+        with pytest.raises(deadline.DeadlineExceeded):
+            conn.send_command("PING")
+        pairs[-1][0].setblocking(False)
+        with pytest.raises(socket.error):
+            pairs[-1][0].recv(100)
+
+        # 没有 deadline 时恢复 socket_timeout
+        request_deadline(None)
+        conn.send_command("PING")
+        assert conn._sock.gettimeout() == 5
+    finally:
+        for server, client in pairs:
+            server.close()
+            client.close()
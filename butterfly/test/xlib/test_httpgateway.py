@@ -8,7 +8,16 @@
 # Description:
 
 """
+import os
+import hashlib
+from cStringIO import StringIO
+
+import pytest
+
 from xlib import httpgateway
+from xlib.middleware import funcattr
+
+
 def test_check_param():
     """
     check_param
@@ -50,3 +59,122 @@ def test_get_func_name():
     assert httpgateway.get_func_name(wsgienv_3) == "/echo/ceshi"
     assert httpgateway.get_func_name(wsgienv_4) == "/echo/ceshi"
     assert httpgateway.get_func_name(wsgienv_5) == "/"
+
+def test_parse_range():
+    """
+    解析 Range 请求头
+    """
+    assert httpgateway.parse_range("bytes=0-499", 1000) == [(0, 499)]
+    assert httpgateway.parse_range("bytes=500-", 1000) == [(500, 999)]
+    assert httpgateway.parse_range("bytes=-200", 1000) == [(800, 999)]
+    assert httpgateway.parse_range("bytes=900-2000", 1000) == [(900, 999)]
+    assert httpgateway.parse_range("bytes=0-0, -1", 1000) == [(0, 0), (999, 999)]
+    # 无法满足: 416
+    assert httpgateway.parse_range("bytes=1000-", 1000) == []
+    # 格式不合法: 忽略 Range
+    assert httpgateway.parse_range("bytes=5-1", 1000) is None
+    assert httpgateway.parse_range("bytes=a-b", 1000) is None
+    assert httpgateway.parse_range("items=0-1", 1000) is None
+
+
+def test_param_schema():
+    """
+    ParamSchema: 注册时生成参数描述, 请求时检查参数及类型转换
+    """
+    @funcattr.params(is_detail=bool, tags=list)
+    def hosts(req, name, page_index=1, ratio=0.5, is_detail=False, tags=None, owner=None):
+        pass
+
+    schema = httpgateway.ParamSchema(hosts)
+    assert schema.args == ("req", "name", "page_index", "ratio", "is_detail", "tags", "owner")
+    assert schema.required == frozenset(["req", "name"])
+    assert schema.defaults["page_index"] == 1
+    assert [(name, hint) for name, hint, _ in schema.coercers] == [
+        ("page_index", int), ("ratio", float), ("is_detail", bool), ("tags", list)]
+
+    assert schema.check({"req": None, "name": "a"})
+    assert schema.check({"req": None, "name": "a", "owner": "b"})
+    assert not schema.check({"req": None})
+    assert not schema.check({"req": None, "name": "a", "unknown": 1})
+
+    params = {"req": None, "name": "a", "page_index": "3", "ratio": "0.1", "is_detail": "true", "tags": "x"}
+    schema.coerce(params)
+    assert params == {"req": None, "name": "a", "page_index": 3, "ratio": 0.1, "is_detail": True, "tags": ["x"]}
+
+    # JSON body 中的参数已带有类型, 不转换
+    params = {"req": None, "name": "a", "page_index": 2.0, "tags": ["x", "y"]}
+    schema.coerce(params)
+    assert params["page_index"] == 2.0
+    assert params["tags"] == ["x", "y"]
+
+    with pytest.raises(httpgateway.ParamTypeError):
+        schema.coerce({"page_index": "abc"})
+    with pytest.raises(httpgateway.ParamTypeError):
+        schema.coerce({"is_detail": "maybe"})
+
+    # check_param 结果一致
+    for params in ({"req": None, "name": "a"}, {"req": None}, {"req": None, "name": "a", "x": 1}):
+        assert schema.check(params) == httpgateway.check_param(hosts, params)
+
+
+def _body_req(body, content_length=None, **env):
+    wsgienv = {"wsgi.input": StringIO(body), "CONTENT_LENGTH": str(len(body) if content_length is None else content_length)}
+    wsgienv.update(env)
+    return httpgateway.Request("reqid", wsgienv, "127.0.0.1")
+
+
+def test_iter_body():
+    """
+    按块读取请求 body, 只读取 Content-Length 大小
+    """
+    req = _body_req("a" * 10 + "rest", content_length=10)
+    assert list(req.iter_body(4)) == ["aaaa", "aaaa", "aa"]
+    # wsgi.input 只能读取一次
+    with pytest.raises(ValueError):
+        list(req.iter_body())
+
+    # 客户端发送的数据少于 Content-Length
+    req = _body_req("abc", content_length=10)
+    with pytest.raises(IOError):
+        list(req.iter_body())
+
+    # 没有 Content-Length 时, 只有 chunked 请求读取 wsgi.input
+    assert list(_body_req("abc", content_length="").iter_body()) == []
+    req = _body_req("abc", content_length="", HTTP_TRANSFER_ENCODING="chunked")
+    assert list(req.iter_body(2)) == ["ab", "c"]
+
+
+def test_body_file():
+    """
+    body 超过 body_spool_size 时写入临时文件, 可多次读取
+    """
+    req = _body_req("x" * 100)
+    req.body_spool_size = 1024
+    body_file = req.body_file()
+    assert not body_file._rolled
+    assert body_file.read() == "x" * 100
+
+    req = _body_req("x" * 100)
+    req.body_spool_size = 10
+    body_file = req.body_file(16)
+    assert body_file._rolled
+    assert body_file.read() == "x" * 100
+    assert req.body_file().read(3) == "xxx"
+    assert "".join(req.iter_body(7)) == "x" * 100
+
+
+def test_body_to_file(tmpdir):
+    """
+    流式保存 body 并计算 hash
+    """
+    body = os.urandom(200 * 1024 + 3)
+    path = str(tmpdir.join("body"))
+    ret = _body_req(body).body_to_file(path, ("md5", "sha1"))
+    assert ret == {"size": len(body), "md5": hashlib.md5(body).hexdigest(), "sha1": hashlib.sha1(body).hexdigest()}
+    with open(path, "rb") as f:
+        assert f.read() == body
+
+    # 失败时删除已写入的文件
+    with pytest.raises(IOError):
+        _body_req(body, content_length=len(body) + 1).body_to_file(path)
+    assert not os.path.exists(path)
@@ -0,0 +1,83 @@
+#!/usr/bin/python
+# coding=utf8
+"""
+# File Name: test_json_util.py
+# Description:
+    JSON 编解码测试
+
+"""
+import decimal
+import datetime
+
+import pytest
+
+from xlib.util import json_util
+
+
+@pytest.fixture(params=sorted(json_util.DUMPS_CODECS))
+def dumps_codec(request):
+    """
+    依次使用所有可用的 dumps 实现
+    """
+    json_util.use(dumps_name=request.param)
+    yield request.param
+    json_util.use()
+
+
+def test_dumps(dumps_codec):
+    """
+    datetime/date/Decimal 由 json_default 处理, 返回 utf8 编码的 str
+    """
+    data = {
+        "time": datetime.datetime(2021, 7, 20, 10, 1, 2),
+        "date": datetime.date(2021, 7, 20),
+        "price": decimal.Decimal("1.5"),
+        "name": u"蝴蝶",
+    }
+    ret = json_util.dumps(data, sort_keys=True)
+    assert isinstance(ret, str)
+    assert ret == ('{"date": "2021-07-20", "name": "\\u8774\\u8776", "price": 1.5, '
+                   '"time": "2021-07-20 10:01:02"}')
+
+    with pytest.raises(TypeError):
+        json_util.dumps({"obj": object()})
+
+
+def test_loads():
+    """
+    字符串解析为 unicode, 格式错误时抛出 ValueError
+    """
+    assert json_util.loads('{"name": "meetbill", "ids": [1, 2.5]}') == {u"name": u"meetbill", u"ids": [1, 2.5]}
+    assert isinstance(json_util.loads('"meetbill"'), unicode)
+    with pytest.raises(ValueError):
+        json_util.loads("{")
+
+
+def test_ujson_fallback(monkeypatch):
+    """
+    ujson 无法解析时使用标准库重新解析
+    """
+    class FakeUjson(object):
+        @staticmethod
+        def loads(s, precise_float=False):
+            if s.startswith("["):
+                raise OverflowError("int too big")
+            return "ujson"
+
+    monkeypatch.setattr(json_util, "ujson", FakeUjson)
+    assert json_util._ujson_loads("{}") == "ujson"
+    assert json_util._ujson_loads("[18446744073709551616]") == [18446744073709551616]
+    with pytest.raises(ValueError):
+        json_util._ujson_loads("[")
+
+
+def test_use():
+    """
+    指定实现
+    """
+    json_util.use("json", "json")
+    assert (json_util.dumps_codec, json_util.loads_codec) == ("json", "json")
+    with pytest.raises(KeyError):
+        json_util.use("unknown")
+    json_util.use()
+    assert json_util.loads_codec == ("ujson" if json_util.ujson else "json")
@@ -0,0 +1,188 @@
+#!/usr/bin/python
+# coding=utf8
+"""
+# File Name: test_logger.py
+# Description:
+    LoggerBase 测试
+
+"""
+import os
+import sys
+import time
+import threading
+
+from xlib import logger
+
+
+def read_lines(path):
+    """
+    读取日志行
+    """
+    with open(str(path)) as f:
+        return f.read().splitlines()
+
+
+def test_async_write(tmpdir):
+    """
+    后台线程写入: 按行数及时间写入
+    """
+    path = tmpdir.join("acc.log")
+    acclog = logger.LoggerBase(str(path), False, 0, 0, True,
+                               {"flush_lines": 10, "flush_interval": 0.2})
+    try:
+        for i in range(10):
+            acclog.log("line_%s" % i)
+        # 达到 flush_lines 时写入
+        end = time.time() + 2
+        while (not path.exists() or len(read_lines(path)) < 10) and time.time() < end:
+            time.sleep(0.01)
+        assert len(read_lines(path)) == 10
+
+        # 达到 flush_interval 时写入
+        acclog.log("line_10")
+        time.sleep(0.5)
+        lines = read_lines(path)
+        assert len(lines) == 11
+        assert lines[-1].endswith("line_10")
+
+        acclog.log("line_11")
+        assert acclog.flush(timeout=2)
+        assert read_lines(path)[-1].endswith("line_11")
+    finally:
+        acclog._writer.stop()
+
+
+def test_async_write_threads(tmpdir):
+    """
+    多线程写入, 不丢日志
+    """
+    path = tmpdir.join("acc.log")
+    acclog = logger.LoggerBase(str(path), False, 0, 0, True, {"flush_lines": 64})
+
+    def write(n):
+        for i in range(500):
+            acclog.log("thread_%s_%s" % (n, i))
+
+    threads = [threading.Thread(target=write, args=(n,)) for n in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert acclog.flush(timeout=5)
+    acclog._writer.stop()
+    assert len(read_lines(path)) == 4000
+    assert acclog._writer.dropped == 0
+
+
+def test_async_write_overflow(tmpdir):
+    """
+    缓冲区满: 丢弃或等待
+    """
+    path = tmpdir.join("acc.log")
+    acclog = logger.LoggerBase(str(path), False, 0, 0, True,
+                               {"queue_size": 5, "flush_lines": 100, "flush_interval": 60})
+    writer = acclog._writer
+    writer.stop()
+    for i in range(8):
+        acclog.log("line_%s" % i)
+    assert writer.dropped == 8
+
+    blocking_writer = logger.AsyncWriter(acclog, queue_size=5, flush_lines=100, flush_interval=0.1, block=True)
+    acclog._writer = blocking_writer
+    blocking_writer.start()
+    for i in range(20):
+        acclog.log("line_%s" % i)
+    assert blocking_writer.dropped == 0
+    assert acclog.flush(timeout=2)
+    blocking_writer.stop()
+    assert len(read_lines(path)) == 20
+
+
+def test_async_write_failure(tmpdir, monkeypatch):
+    """
+    写入失败: 计入 failed 而不是 written, 只在第一次失败时记录到 failure_log
+    """
+    path = tmpdir.join("acc.log")
+    crit_path = tmpdir.join("crit.log")
+    critlog = logger.LoggerBase(str(crit_path), False, 0, 0)
+    acclog = logger.LoggerBase(str(path), False, 0, 0, True, {"flush_interval": 60}, failure_log=critlog)
+
+    def write_lines(lines):
+        raise OSError(28, "No space left on device")
+    monkeypatch.setattr(acclog, "_write_lines", write_lines)
+    for _ in range(2):
+        for i in range(3):
+            acclog.log("line_%s" % i)
+        assert acclog.flush(timeout=5)
+    assert acclog.stats()["failed"] == 6
+    assert acclog.stats()["written"] == 0
+    crit_lines = read_lines(crit_path)
+    assert len(crit_lines) == 1
+    assert "async_log_write_failed" in crit_lines[0]
+    assert "No space left on device" in crit_lines[0]
+
+    monkeypatch.undo()
+    acclog.log("line_ok")
+    assert acclog.flush(timeout=5)
+    acclog._writer.stop()
+    assert acclog.stats()["written"] == 1
+    assert len(read_lines(path)) == 1
+
+
+def test_batch_write_flush(tmpdir):
+    """
+    batch_write 模式下, flush 写入剩余的日志
+    """
+    path = tmpdir.join("err.log")
+    errlog = logger.LoggerBase(str(path), False, 0, 3)
+    for i in range(5):
+        errlog.log("line_%s" % i)
+    assert len(read_lines(path)) == 3
+    errlog.flush()
+    assert len(read_lines(path)) == 5
+
+
+def test_log_format(tmpdir):
+    """
+    日志行格式: 时间, pid, 调用者(capture_caller 为 False 时为 "-"), 日志内容
+    """
+    path = tmpdir.join("err.log")
+    errlog = logger.LoggerBase(str(path), False, 0, 0)
+    errlog.log("with_caller")
+    path_acc = tmpdir.join("acc.log")
+    acclog = logger.LoggerBase(str(path_acc), False, 0, 0, capture_caller=False)
+    acclog.log("without_caller", "info")
+
+    tm, pid, caller, msg = read_lines(path)[0].split("\t")
+    assert time.strptime(tm, "%Y-%m-%d %H:%M:%S")
+    assert int(pid) == os.getpid()
+    assert caller.endswith("test_logger.py:%s" % (sys._getframe().f_lineno - 8))
+    assert msg == "with_caller"
+    assert read_lines(path_acc)[0].split("\t")[2:] == ["-", "without_caller", "info"]
+
+
+def test_size_check(tmpdir, monkeypatch):
+    """
+    写入 FILE_SIZE_CHECK_LINES 行后, 每 SIZE_CHECK_EVERY_LINES 行检查一次文件大小
+    """
+    monkeypatch.setattr(logger.LoggerBase, "FILE_SIZE_CHECK_LINES", 10)
+    monkeypatch.setattr(logger.LoggerBase, "SIZE_CHECK_EVERY_LINES", 5)
+    path = tmpdir.join("err.log")
+    errlog = logger.LoggerBase(str(path), False, 1024 * 1024, 0)
+    fstat_calls = []
+    real_fstat = os.fstat
+
+    def counting_fstat(fd):
+        fstat_calls.append(fd)
+        return real_fstat(fd)
+    monkeypatch.setattr(logger.os, "fstat", counting_fstat)
+    for i in range(31):
+        errlog.log("line_%s" % i)
+    # 在写第 12, 18, 24, 30 行前检查
+    assert len(fstat_calls) == 4
+
+    # 超过 size_limit 时清空文件
+    errlog._size_limit = 1
+    for i in range(5):
+        errlog.log("line_%s" % i)
+    assert len(read_lines(path)) < 5
@@ -0,0 +1,565 @@
+#!/usr/bin/python
+# coding=utf8
+"""
+# File Name: test_mq_worker.py
+# Description:
+    百川 worker 批量出队, 消息状态变更及延迟消息测试
+
+    记录 worker 发送的 redis 命令, 检查每次状态变更(成功/失败)只有一次往返(MULTI/EXEC), 且命令与逐个执行时一致
+    Lua 脚本的返回值由 RecordingRedis.script_results 指定; 本地有 redis-server 时另外测试批量出队的限流
+
+"""
+import json
+import time
+import Queue
+import datetime
+
+import pytest
+
+from xlib import protocol_json
+from xlib import retstat
+from xlib.db import redisorm
+from xlib.db.redis.exceptions import ConnectionError
+from xlib.mq.msg import Msg, MsgStatus
+from xlib.mq import defaults
+from xlib.mq import queue as mq_queue
+from xlib.mq.worker import Worker
+from test.xlib import conftest
+
+
+class RecordingPipeline(object):
+    """
+    记录 pipeline 中的命令, execute 时计为一次往返
+    """
+
+    def __init__(self, client):
+        self._client = client
+        self.commands = []
+
+    def __getattr__(self, name):
+        def command(*args):
+            self.commands.append((name,) + args)
+            return self
+        return command
+
+    def execute(self):
+        self._client.round_trips.append(self.commands)
+        return [True] * len(self.commands)
+
+
+class RecordingScriptRegistry(object):
+    """
+    记录 Lua 脚本调用, call_many 的所有调用计为一次往返
+    """
+
+    def __init__(self, client):
+        self._client = client
+
+    def _result(self, name, keys, args):
+        # 返回值为函数时按每次调用的 keys/args 计算
+        result = self._client.script_results.get(name)
+        if callable(result):
+            return result(keys, args)
+        return result
+
+    def __call__(self, name, keys=None, args=None):
+        self._client.round_trips.append([("evalsha", name, keys, args)])
+        return self._result(name, keys, args)
+
+    def call_many(self, name, calls):
+        self._client.round_trips.append([("evalsha", name, keys, args) for keys, args in calls])
+        return [self._result(name, keys, args) for keys, args in calls]
+
+
+class RecordingRedis(object):
+    """
+    记录 redis 命令, 直接执行的命令每个计为一次往返
+    """
+    connection_pool = None
+
+    def __init__(self):
+        self.round_trips = []
+        # Lua 脚本名称 => 返回值, 或按 (keys, args) 计算返回值的函数
+        self.script_results = {}
+        self.script_registry = RecordingScriptRegistry(self)
+
+    def pipeline(self, transaction=True):
+        return RecordingPipeline(self)
+
+    def rate_limit(self, name, limit=5, per=60, debug=False):
+        return redisorm.RateLimit(self, name, limit=limit, per=per, debug=debug)
+
+    def __getattr__(self, name):
+        def command(*args):
+            self.round_trips.append([(name,) + args])
+        return command
+
+
+def demo_msg(req, count=1):
+    if count < 0:
+        return retstat.ERR_BAD_PARAMS, {}
+    return retstat.OK, {"count": count}
+
+
+@pytest.fixture()
+def worker():
+    connection = RecordingRedis()
+    apicube = {"demo_msg": protocol_json.Protocol(demo_msg, retstat.ERR_SERVER_EXCEPTION, retstat.ERR_BAD_PARAMS,
+                                                  True, True, conftest.errlog)}
+    return Worker(["demo_msg"], name="worker_test", connection=connection,
+                  acclog=conftest.acclog, errlog=conftest.errlog, apicube=apicube)
+
+
+def make_msg(connection, data="{}", result_ttl=None):
+    msg = Msg.create(data, connection=connection, result_ttl=result_ttl, origin="demo_msg")
+    msg.started_at = datetime.datetime.utcnow()
+    msg.ended_at = msg.started_at + datetime.timedelta(seconds=1)
+    return msg
+
+
+def command_names(round_trip):
+    return [command[0] for command in round_trip]
+
+
+def test_handle_msg_success(worker):
+    """
+    成功: 计数/状态/结果/finished registry/过期时间/移出 wip 在一次往返中完成
+    """
+    queue = worker.queues[0]
+    msg = make_msg(worker.connection, result_ttl=600)
+    worker.handle_msg_success(msg, queue, queue.started_msg_registry)
+
+    assert len(worker.connection.round_trips) == 1
+    round_trip = worker.connection.round_trips[0]
+    assert command_names(round_trip) == ["hincrby", "hincrbyfloat", "hset", "hmset", "zadd", "expire", "zrem"]
+    assert round_trip[2] == ("hset", msg.key, "status", MsgStatus.FINISHED)
+    assert round_trip[4][1] == "mq:finished:{demo_msg}"
+    assert round_trip[5] == ("expire", msg.key, 600)
+    assert round_trip[6] == ("zrem", "mq:wip:{demo_msg}", msg.id)
+
+    # result_ttl 为 0 时不保存结果
+    worker.connection.round_trips = []
+    msg = make_msg(worker.connection, result_ttl=0)
+    worker.handle_msg_success(msg, queue, queue.started_msg_registry)
+    assert [command_names(r) for r in worker.connection.round_trips] == [["hincrby", "hincrbyfloat", "zrem"]]
+
+
+def test_handle_msg_failure(worker):
+    """
+    失败: 状态/移出 wip/failed registry(含 exc_info)/计数在一次往返中完成
+    """
+    msg = make_msg(worker.connection)
+    worker.handle_msg_failure(msg, exc_string="Traceback")
+
+    assert len(worker.connection.round_trips) == 1
+    round_trip = worker.connection.round_trips[0]
+    assert command_names(round_trip) == ["hset", "zrem", "hmset", "expire", "zadd", "hincrby", "hincrbyfloat"]
+    assert round_trip[0] == ("hset", msg.key, "status", MsgStatus.FAILED)
+    assert round_trip[1] == ("zrem", "mq:wip:{demo_msg}", msg.id)
+    assert "exc_info" in round_trip[2][2]
+    assert round_trip[4][1] == "mq:failed:{demo_msg}"
+    assert msg.exc_info == "Traceback"
+
+
+@pytest.mark.parametrize("count,status", [(1, MsgStatus.FINISHED), (-1, MsgStatus.FAILED)])
+def test_perform_msg(worker, count, status):
+    """
+    执行消息后, cost 与结束状态在同一次往返中写入(出队时已设置 started)
+    """
+    queue = worker.queues[0]
+    msg = make_msg(worker.connection, data=json.dumps({"count": count}), result_ttl=600)
+    assert worker.perform_msg(msg, queue)
+
+    assert len(worker.connection.round_trips) == 1
+    round_trip = worker.connection.round_trips[0]
+    assert round_trip[0][:3] == ("hset", msg.key, "cost")
+    assert ("hset", msg.key, "status", status) in round_trip
+    assert msg.get_status(refresh=False) == status
+
+
+def test_enqueue_in(worker):
+    """
+    延迟消息: msg 及延迟消息 ZSET 在一次往返中写入, 并通知 worker
+    """
+    queue = worker.queues[0]
+    before = time.time()
+    msg = queue.enqueue_in(datetime.timedelta(seconds=30), "{}", result_ttl=600)
+    assert msg.get_status(refresh=False) == MsgStatus.SCHEDULED
+
+    assert len(worker.connection.round_trips) == 1
+    round_trip = worker.connection.round_trips[0]
+    assert command_names(round_trip) == ["sadd", "hmset", "zadd", "rpush", "ltrim"]
+    assert round_trip[1][2]["status"] == MsgStatus.SCHEDULED
+    zadd = round_trip[2]
+    assert zadd[1] == "mq:scheduled:{demo_msg}"
+    assert before + 30 <= zadd[2][msg.id] <= time.time() + 30
+    assert round_trip[3][1] == "mq:notify:{demo_msg}"
+
+    # datetime 为 UTC 时间
+    worker.connection.round_trips = []
+    msg = queue.enqueue_at(datetime.datetime(2021, 10, 18, 0, 0, 0, 500000), "{}")
+    assert worker.connection.round_trips[0][2][2][msg.id] == 1634515200.5
+
+
+def test_enqueue_scheduled_msgs(worker):
+    """
+    worker 移动到期的延迟消息, 并按下一个延迟消息的执行时间缩短空闲等待时间
+    """
+    worker.connection.script_results[mq_queue.LUA_ENQUEUE_SCHEDULED] = [[], None]
+    worker.enqueue_scheduled_msgs()
+    # 没有到期消息时只有一次往返
+    assert len(worker.connection.round_trips) == 1
+    round_trip = worker.connection.round_trips[0]
+    assert round_trip[0][:3] == ("evalsha", mq_queue.LUA_ENQUEUE_SCHEDULED,
+                                 ["mq:scheduled:{demo_msg}", "mq:queue:{demo_msg}", "mq:notify:{demo_msg}"])
+    assert worker._get_idle_wait_timeout() == worker.wait_timeout
+
+    worker.connection.script_results[mq_queue.LUA_ENQUEUE_SCHEDULED] = [[], "%.3f" % (time.time() + 2.5)]
+    worker.enqueue_scheduled_msgs()
+    assert worker._get_idle_wait_timeout() == 3
+    # 下一个延迟消息的执行时间早于 SCHEDULE_CHECK_INTERVAL 时提前检查
+    worker.connection.script_results[mq_queue.LUA_ENQUEUE_SCHEDULED] = [[], "%.3f" % (time.time() - 1)]
+    worker.enqueue_scheduled_msgs()
+    assert worker._next_schedule_check < time.time()
+    assert worker._get_idle_wait_timeout() == 1
+
+
+def test_enqueue_scheduled(worker, queues):
+    """
+    每个队列一次调用(只使用该队列 hashtag 下的 key), 在一次往返中移动; 再一次往返设置移动的消息为 queued
+    """
+    connection = worker.connection
+    results = {"mq:scheduled:{demo_msg}": [["id1", "id2"], "1634515230.5"],
+               "mq:scheduled:{other_msg}": [["id3"], "1634515200.5"]}
+    connection.script_results[mq_queue.LUA_ENQUEUE_SCHEDULED] = lambda keys, args: results[keys[0]]
+    assert mq_queue.Queue.enqueue_scheduled(queues, connection=connection) == 1634515200.5
+
+    assert len(connection.round_trips) == 2
+    move_calls, set_queued_calls = connection.round_trips
+    assert [call[2] for call in move_calls] == [
+        ["mq:scheduled:{demo_msg}", "mq:queue:{demo_msg}", "mq:notify:{demo_msg}"],
+        ["mq:scheduled:{other_msg}", "mq:queue:{other_msg}", "mq:notify:{other_msg}"]]
+    assert [call[1] for call in set_queued_calls] == [mq_queue.LUA_SET_QUEUED] * 3
+    assert [call[2] for call in set_queued_calls] == [["mq:msg:id1"], ["mq:msg:id2"], ["mq:msg:id3"]]
+    assert set_queued_calls[0][3][:2] == [MsgStatus.SCHEDULED, MsgStatus.QUEUED]
+
+
+def test_enqueue_scheduled_redis(redis_db):
+    """
+    到期的延迟消息移动到队列中并设置为 queued, 已出队(started)的消息不会被改回 queued
+    """
+    queue = mq_queue.Queue("scheduled_msg", connection=redis_db)
+    due_msg = queue.enqueue_at(time.time() - 1, "{}")
+    later_msg = queue.enqueue_at(time.time() + 600, "{}")
+    next_time = mq_queue.Queue.enqueue_scheduled([queue], connection=redis_db)
+    assert abs(next_time - redis_db.zscore(queue.scheduled_key, later_msg.id)) < 1e-3
+    assert queue.get_msg_ids() == [due_msg.id]
+    assert Msg.fetch(due_msg.id, connection=redis_db).get_status() == MsgStatus.QUEUED
+
+    redis_db.hset(later_msg.key, "status", MsgStatus.STARTED)
+    redis_db.zadd(queue.scheduled_key, {later_msg.id: time.time() - 1})
+    assert mq_queue.Queue.enqueue_scheduled([queue], connection=redis_db) is None
+    assert Msg.fetch(later_msg.id, connection=redis_db).get_status() == MsgStatus.STARTED
+
+
+def test_empty(worker):
+    """
+    清空队列时同时删除延迟消息
+    """
+    queue = worker.queues[0]
+    queue.empty()
+    assert worker.connection.round_trips == [[
+        ("evalsha", mq_queue.LUA_EMPTY, ["mq:queue:{demo_msg}", "mq:scheduled:{demo_msg}"], ["mq:msg:"])]]
+
+
+def msg_hash(msg):
+    """
+    mq_start_msg 的返回值: msg hash(HGETALL 格式)
+    """
+    raw_data = []
+    for key, value in msg.to_dict().items():
+        raw_data.extend([key, value])
+    return raw_data
+
+
+def start_msg_results(msgs):
+    """
+    按 msg key 返回 msg hash, 不在 msgs 中的消息视为已删除
+    """
+    by_key = dict((msg.key, msg_hash(msg)) for msg in msgs)
+    return lambda keys, args: by_key.get(keys[0])
+
+
+@pytest.fixture()
+def queues(worker, monkeypatch):
+    """
+    两个队列, 不打乱顺序
+    """
+    monkeypatch.setattr(mq_queue.random, "shuffle", lambda lst: None)
+    return [worker.queues[0], mq_queue.Queue("other_msg", connection=worker.connection)]
+
+
+def test_dequeue_many(worker, queues):
+    """
+    批量出队: 每个队列一次调用(只使用该队列 hashtag 下的 key), 在一次往返中出队, 再一次往返设置消息状态
+    """
+    connection = worker.connection
+    msgs = [make_msg(connection) for _ in range(3)]
+    ids = {"mq:queue:{demo_msg}": [msgs[0].id, msgs[2].id], "mq:queue:{other_msg}": [msgs[1].id]}
+    connection.script_results[mq_queue.LUA_DEQUEUE] = lambda keys, args: [0, ids[keys[0]], 0]
+    connection.script_results[mq_queue.LUA_START_MSG] = start_msg_results(msgs)
+    result = mq_queue.Queue.dequeue_many(queues, 5, connection=connection, handle_worker="worker_test")
+
+    assert [(msg.id, queue.name) for msg, queue in result] == [
+        (msgs[0].id, "demo_msg"), (msgs[2].id, "demo_msg"), (msgs[1].id, "other_msg")]
+    assert len(connection.round_trips) == 2
+    dequeue_calls, start_calls = connection.round_trips
+    assert [call[2] for call in dequeue_calls] == [
+        ["mq:queue:{demo_msg}", "mq:wip:{demo_msg}", "mq:rate_limit:{demo_msg}:worker"],
+        ["mq:queue:{other_msg}", "mq:wip:{other_msg}", "mq:rate_limit:{other_msg}:worker"]]
+    # n 平均分配到各队列
+    assert [call[3][0] for call in dequeue_calls] == [3, 2]
+    assert [call[3][3:] for call in dequeue_calls] == [[30, 1], [30, 1]]
+    assert [call[1] for call in start_calls] == [mq_queue.LUA_START_MSG] * 3
+    assert [call[2] for call in start_calls] == [[msgs[0].key], [msgs[2].key], [msgs[1].key]]
+    assert start_calls[0][3][0] == MsgStatus.STARTED
+    assert start_calls[0][3][2] == "worker_test"
+
+
+def test_dequeue_many_backlog(worker, queues):
+    """
+    有队列取满分配的数量且还有消息, 其他队列未取满时, 再对该队列出队剩余的数量
+    """
+    connection = worker.connection
+    msgs = [make_msg(connection) for _ in range(4)]
+    backlog = [msg.id for msg in msgs]
+
+    def dequeue(keys, args):
+        if keys[0] == "mq:queue:{other_msg}":
+            return [0, [], 0]
+        msg_ids, backlog[:args[0]] = backlog[:args[0]], []
+        return [0, msg_ids, len(backlog)]
+    connection.script_results[mq_queue.LUA_DEQUEUE] = dequeue
+    connection.script_results[mq_queue.LUA_START_MSG] = start_msg_results(msgs)
+    result = mq_queue.Queue.dequeue_many(queues, 4, connection=connection)
+
+    assert [msg.id for msg, _ in result] == [msg.id for msg in msgs]
+    assert [[(call[2][0], call[3][0]) for call in round_trip] for round_trip in connection.round_trips[:2]] == [
+        [("mq:queue:{demo_msg}", 2), ("mq:queue:{other_msg}", 2)], [("mq:queue:{demo_msg}", 2)]]
+    assert len(connection.round_trips) == 3
+
+    # n 小于队列数时, 未分配的队列在下一轮出队
+    connection.round_trips = []
+    backlog[:] = []
+    result = mq_queue.Queue.dequeue_many(queues, 1, connection=connection)
+    assert result == []
+    assert [[call[2][0] for call in round_trip] for round_trip in connection.round_trips] == [
+        ["mq:queue:{demo_msg}"], ["mq:queue:{other_msg}"]]
+
+
+def test_dequeue_many_unpickle_error(worker, queues):
+    """
+    无法解析及已删除的消息被跳过, 不影响同一批次的其他消息
+    """
+    connection = worker.connection
+    msgs = [make_msg(connection) for _ in range(3)]
+    ids = {"mq:queue:{demo_msg}": [msgs[0].id, msgs[2].id], "mq:queue:{other_msg}": [msgs[1].id]}
+    connection.script_results[mq_queue.LUA_DEQUEUE] = lambda keys, args: [0, ids[keys[0]], 0]
+    bad_hash = msg_hash(msgs[0]) + ["meta", "not a pickle"]
+    start_msg = start_msg_results(msgs[1:2])
+    connection.script_results[mq_queue.LUA_START_MSG] = lambda keys, args: (
+        bad_hash if keys[0] == msgs[0].key else start_msg(keys, args))
+    result = mq_queue.Queue.dequeue_many(queues, 5, connection=connection)
+    assert [(msg.id, queue.name) for msg, queue in result] == [(msgs[1].id, "other_msg")]
+
+
+@pytest.mark.parametrize("limited,counts,expected", [
+    # 所有非空队列均被限流
+    ([1, 1], [0, 0], defaults.RATE_LIMITED),
+    # 部分队列被限流, 没有取到消息
+    ([1, 0], [0, 0], defaults.RATE_LIMITED),
+    # 部分队列被限流, 其他队列取到消息
+    ([1, 0], [0, 1], 1),
+    # 队列均为空
+    ([0, 0], [0, 0], 0),
+])
+def test_dequeue_many_rate_limited(worker, queues, limited, counts, expected):
+    """
+    没有取到消息且有非空队列被限流时返回 RATE_LIMITED
+    """
+    connection = worker.connection
+    msgs = [make_msg(connection) for _ in range(sum(counts))]
+    rows = {}
+    for queue, queue_limited, count in zip(queues, limited, counts):
+        rows[queue.key] = [queue_limited, [msgs.pop(0).id for _ in range(count)], 0]
+    connection.script_results[mq_queue.LUA_DEQUEUE] = lambda keys, args: rows[keys[0]]
+    connection.script_results[mq_queue.LUA_START_MSG] = lambda keys, args: msg_hash(make_msg(connection))
+    result = mq_queue.Queue.dequeue_many(queues, 5, connection=connection)
+    if expected == defaults.RATE_LIMITED:
+        assert result == defaults.RATE_LIMITED
+    else:
+        assert len(result) == expected
+
+
+class Future(object):
+    def __init__(self):
+        self.callbacks = []
+
+    def add_done_callback(self, callback):
+        self.callbacks.append(callback)
+
+    def exception(self):
+        return None
+
+
+class BoundedPool(object):
+    """
+    与 wsgiapp 中的 BoundedThreadPoolExecutor 相同, 有 max_workers 个线程, 任务队列长度为 max_workers * 2
+    提交的任务不执行, done() 时调用回调
+    """
+
+    def __init__(self, max_workers):
+        self._max_workers = max_workers
+        self._work_queue = Queue.Queue(max_workers * 2)
+        self.tasks = []
+
+    def submit(self, fn, **kwargs):
+        task = Future()
+        self.tasks.append(task)
+        return task
+
+    def done(self):
+        task = self.tasks.pop(0)
+        for callback in task.callbacks:
+            callback(task)
+
+
+def test_get_dequeue_batch_size(worker):
+    """
+    批量出队的消息数不超过线程池的空闲线程数及 DEQUEUE_BATCH_SIZE, 任务队列有空位时也不多出队
+    """
+    assert worker._get_dequeue_batch_size() == defaults.DEQUEUE_BATCH_SIZE
+
+    worker.pool = BoundedPool(defaults.DEQUEUE_BATCH_SIZE * 2)
+    assert worker._get_dequeue_batch_size() == defaults.DEQUEUE_BATCH_SIZE
+
+    worker.pool = BoundedPool(4)
+    assert worker._get_dequeue_batch_size() == 4
+    for _ in range(3):
+        worker._submit_msg(None, None)
+    assert worker._get_dequeue_batch_size() == 1
+    worker._submit_msg(None, None)
+    assert worker._get_dequeue_batch_size() == 0
+    assert worker.pool._work_queue.qsize() == 0
+
+    worker.pool.done()
+    assert worker._get_dequeue_batch_size() == 1
+
+
+REDIS_URL = "redis://localhost:6379/15?socket_timeout=2&socket_connect_timeout=0.5"
+
+
+@pytest.fixture()
+def redis_db():
+    database = redisorm.Database.from_url(REDIS_URL)
+    try:
+        database.ping()
+    except ConnectionError:
+        pytest.skip("redis-server unavailable")
+    database.flushdb()
+    yield database
+    database.flushdb()
+
+
+def test_dequeue_many_rate_limit_redis(redis_db):
+    """
+    限流按出队的消息数计算: 被限流的队列出队的消息数不超过剩余的限流次数, 空队列不消耗限流次数
+    """
+    queue = mq_queue.Queue("limit_msg", connection=redis_db)
+    queue.rate_limit = redis_db.rate_limit("mq:rate_limit:{limit_msg}", limit=3, per=60)
+    empty_queue = mq_queue.Queue("empty_msg", connection=redis_db)
+
+    assert mq_queue.Queue.dequeue_many([queue, empty_queue], 10, connection=redis_db) == []
+    assert redis_db.llen("mq:rate_limit:{limit_msg}:worker") == 0
+    assert redis_db.llen("mq:rate_limit:{empty_msg}:worker") == 0
+
+    for _ in range(5):
+        queue.enqueue_call("{}")
+    assert len(mq_queue.Queue.dequeue_many([queue], 2, connection=redis_db)) == 2
+    assert len(mq_queue.Queue.dequeue_many([queue, empty_queue], 10, connection=redis_db)) == 1
+    assert mq_queue.Queue.dequeue_many([queue, empty_queue], 10, connection=redis_db) == defaults.RATE_LIMITED
+    assert queue.count == 2
+    assert redis_db.llen("mq:rate_limit:{limit_msg}:worker") == 3
+
+
+class ConnectionPool(object):
+    def __init__(self, socket_timeout):
+        self.connection_kwargs = {"socket_timeout": socket_timeout}
+
+
+@pytest.mark.parametrize("socket_timeout,wait_timeout", [
+    (None, defaults.WORKER_WAIT_TIMEOUT),
+    (10, defaults.WORKER_WAIT_TIMEOUT),
+    (3, 2),
+    (2, 1),
+    (1.5, 1),
+    # BLPOP 超时为整数, 无法小于 socket_timeout 时不 BLPOP
+    (1.2, None),
+    (1, None),
+    (0.5, None),
+])
+def test_get_wait_timeout(worker, socket_timeout, wait_timeout):
+    """
+    BLPOP 等待时间小于 socket_timeout
+    """
+    worker.connection.connection_pool = ConnectionPool(socket_timeout)
+    assert worker._get_wait_timeout() == wait_timeout
+
+
+def test_wait_for_msgs(worker, monkeypatch):
+    """
+    空闲时 BLPOP 超时后继续等待通知, 不重新出队; 收到通知或超过 WORKER_IDLE_POLL_INTERVAL 后返回
+    """
+    notify = [None, None, ("mq:notify:{demo_msg}", "1")]
+
+    def blpop(keys, timeout=0):
+        worker.connection.round_trips.append([("blpop", keys, timeout)])
+        return notify.pop(0)
+    worker.connection.blpop = blpop
+
+    worker._next_schedule_check = time.time() + 10
+    worker.wait_for_msgs()
+    assert [command_names(r) for r in worker.connection.round_trips] == [["blpop"]] * 3
+    assert worker.connection.round_trips[0][0][1:] == (["mq:notify:{demo_msg}"], worker.wait_timeout)
+    assert worker._next_schedule_check == 0
+
+    worker.connection.round_trips = []
+    notify = [None, None]
+    monkeypatch.setattr(defaults, "WORKER_IDLE_POLL_INTERVAL", 0)
+    worker.wait_for_msgs()
+    assert len(worker.connection.round_trips) == 1
+
+    # socket_timeout 过小时轮询, 不 BLPOP
+    worker.connection.round_trips = []
+    worker.wait_timeout = None
+    sleeps = []
+    monkeypatch.setattr(time, "sleep", sleeps.append)
+    worker.wait_for_msgs()
+    assert worker.connection.round_trips == []
+    assert sleeps == [defaults.WORKER_POLL_INTERVAL]
+
+
+def test_empty_scheduled_redis(redis_db):
+    """
+    清空队列时删除延迟消息的 hash
+    """
+    queue = mq_queue.Queue("empty_scheduled_msg", connection=redis_db)
+    queued_msg = queue.enqueue_call("{}")
+    scheduled_msg = queue.enqueue_in(datetime.timedelta(seconds=600), "{}")
+    assert queue.count == 1
+    assert queue.scheduled_count == 1
+
+    assert queue.empty() == 2
+    assert not redis_db.exists(queued_msg.key)
+    assert not redis_db.exists(scheduled_msg.key)
+    assert queue.scheduled_count == 0
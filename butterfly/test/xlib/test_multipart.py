@@ -0,0 +1,151 @@
+#!/usr/bin/python
+# coding=utf8
+"""
+# File Name: test_multipart.py
+# Description:
+    multipart/form-data 流式解析测试
+
+"""
+import os
+import hashlib
+
+import pytest
+
+from xlib import multipart
+
+BOUNDARY = "----butterflyBoundary7MA4YWxk"
+
+
+def make_body(parts, boundary=BOUNDARY):
+    """
+    构造 multipart/form-data body
+
+    Args:
+        parts: (List) [(name, filename, data)], filename 为 None 时为普通字段
+    """
+    lines = []
+    for name, filename, data in parts:
+        lines.append("--" + boundary)
+        if filename is None:
+            lines.append('Content-Disposition: form-data; name="%s"' % name)
+        else:
+            lines.append('Content-Disposition: form-data; name="%s"; filename="%s"' % (name, filename))
+            lines.append("Content-Type: application/octet-stream")
+        lines.append("")
+        lines.append(data)
+    lines.append("--" + boundary + "--")
+    lines.append("")
+    return "\r\n".join(lines)
+
+
+def feed_in_chunks(body, chunk_size, **kwargs):
+    parser = multipart.MultipartParser(BOUNDARY, **kwargs)
+    for i in range(0, len(body), chunk_size):
+        parser.feed(body[i: i + chunk_size])
+    return parser.close()
+
+
+def test_get_boundary():
+    """
+    解析 Content-Type 中的 boundary
+    """
+    assert multipart.get_boundary("multipart/form-data; boundary=abc") == "abc"
+    assert multipart.get_boundary('Multipart/Form-Data; charset=utf8; boundary="a b;c"') == "a b;c"
+    assert multipart.get_boundary("multipart/form-data") is None
+    assert multipart.get_boundary("application/json") is None
+    assert multipart.get_boundary(None) is None
+    assert multipart.parse_header('form-data; name="f"; filename="a\\"b.txt"') == (
+        "form-data", {"name": "f", "filename": 'a"b.txt'})
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 64, 65536])
+def test_parse(chunk_size):
+    """
+    任意分块时结果一致, 文件内容为二进制(包含换行及类似 boundary 的数据)
+    """
+    data = os.urandom(5000) + "\r\n--" + BOUNDARY[:-1] + "\r\n\r\n" + "\n" * 3
+    body = make_body([("title", None, "蝴蝶\r\nline2"), ("empty", None, ""),
+                      ("file", "C:\\tmp\\a.bin", data), ("file2", "b.txt", "")])
+    parts = feed_in_chunks("preamble\r\n" + body + "epilogue", chunk_size, hash_names=("md5", "sha1"))
+    try:
+        assert [name for name, _ in parts] == ["title", "empty", "file", "file2"]
+        assert parts[0][1] == "蝴蝶\r\nline2"
+        assert parts[1][1] == ""
+
+        upload = parts[2][1]
+        assert isinstance(upload, multipart.UploadFile)
+        assert upload.filename == "a.bin"
+        assert upload.content_type == "application/octet-stream"
+        assert upload.size == len(data)
+        assert upload.hashes == {"md5": hashlib.md5(data).hexdigest(), "sha1": hashlib.sha1(data).hexdigest()}
+        with upload.open() as f:
+            assert f.read() == data
+        assert parts[3][1].size == 0
+    finally:
+        for _, value in parts:
+            if isinstance(value, multipart.UploadFile):
+                value.remove()
+    assert not os.path.exists(upload.path)
+
+
+def test_upload_save(tmpdir):
+    """
+    save 后不再删除文件
+    """
+    parts = multipart.parse([make_body([("file", "a.txt", "hello")])], BOUNDARY)
+    upload = parts[0][1]
+    path = str(tmpdir.join("a.txt"))
+    upload.save(path)
+    upload.remove()
+    assert open(path).read() == "hello"
+
+
+def test_parse_error(tmpdir):
+    """
+    格式错误/超出限制/数据不完整时抛出 MultipartError, 并删除已写入的临时文件
+    """
+    spool_dir = str(tmpdir)
+    body = make_body([("file", "a.txt", "x" * 1000), ("title", None, "y" * 100)])
+
+    with pytest.raises(multipart.MultipartError):
+        feed_in_chunks(body[:-10], 64, spool_dir=spool_dir)
+    assert os.listdir(spool_dir) == []
+
+    with pytest.raises(multipart.MultipartError):
+        feed_in_chunks(body, 64, spool_dir=spool_dir, max_field_size=10)
+    assert os.listdir(spool_dir) == []
+
+    with pytest.raises(multipart.MultipartError):
+        feed_in_chunks(body.replace("form-data; ", "attachment; "), 64, spool_dir=spool_dir)
+
+    with pytest.raises(multipart.MultipartError):
+        multipart.MultipartParser(None)
+
+
+def test_parse_multipart_raw(monkeypatch):
+    """
+    parse_multipart_raw: 文件字段保存在内存中, 字段值不去掉首尾空格
+    """
+    from xlib import httpgateway
+
+    def mkstemp(*args, **kwargs):
+        raise AssertionError("parse_multipart_raw should not write temp files")
+    monkeypatch.setattr(multipart.tempfile, "mkstemp", mkstemp)
+
+    data = os.urandom(4096) + "\r\n--" + BOUNDARY[:-1]
+    body = make_body([("a", None, " 1 "), ("empty", None, ""), ("f", "a.bin", data)])
+    assert httpgateway.parse_multipart_raw(body) == {"a": " 1 ", "f": data}
+
+
+def test_parse_multipart_raw_lenient():
+    """
+    parse_multipart_raw: 仅 \\n 换行或格式错误时按行解析, 返回可以解析的字段(去掉首尾空格)
+    """
+    from xlib import httpgateway
+
+    body = make_body([("a", None, "1 "), ("b", None, "2")])
+    assert httpgateway.parse_multipart_raw(body.replace("\r\n", "\n")) == {"a": "1", "b": "2"}
+    # 数据不完整
+    truncated = body[:body.rindex("--" + BOUNDARY)]
+    assert httpgateway.parse_multipart_raw(truncated) == {"a": "1", "b": "2"}
+    assert httpgateway.parse_multipart_raw("") == {}
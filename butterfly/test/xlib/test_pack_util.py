@@ -0,0 +1,77 @@
+#!/usr/bin/python
+# coding=utf8
+"""
+# File Name: test_pack_util.py
+# Description:
+    二进制编解码(mcpack/msgpack)测试
+
+"""
+import decimal
+import datetime
+
+import pytest
+
+from xlib.util import pack_util
+
+
+def test_negotiate():
+    """
+    仅在 Accept 明确包含二进制编码且优先级高于 JSON 时使用
+    """
+    assert pack_util.negotiate(None) is None
+    assert pack_util.negotiate("*/*") is None
+    assert pack_util.negotiate("application/json") is None
+    assert pack_util.negotiate("application/x-mcpack") == pack_util.MCPACK
+    assert pack_util.negotiate("application/json;q=0.5, application/x-mcpack") == pack_util.MCPACK
+    assert pack_util.negotiate("application/x-mcpack;q=0.5, application/json") is None
+    assert pack_util.negotiate("application/x-mcpack, application/json") is None
+    assert pack_util.negotiate("application/x-mcpack;q=0") is None
+    assert pack_util.negotiate("application/x-unknownpack") is None
+
+    assert pack_util.content_type_of({"CONTENT_TYPE": "application/x-mcpack; charset=utf8"}) == pack_util.MCPACK
+    assert pack_util.content_type_of({"CONTENT_TYPE": "application/json"}) is None
+    assert pack_util.content_type_of({}) is None
+
+
+@pytest.mark.parametrize("content_type", sorted(pack_util.CODECS))
+def test_dumps_loads(content_type):
+    """
+    datetime/date/Decimal 与 JSON 一致, 字符串解码为 unicode
+    """
+    data = {
+        "stat": "OK",
+        "name": "蝴蝶",
+        "total": 2 ** 40,
+        "ratio": 0.5,
+        "ok": True,
+        "none": None,
+        "c_time": datetime.datetime(2021, 7, 20, 10, 1, 2),
+        "price": decimal.Decimal("1.5"),
+        "list": [{"id": 1}, {"id": 2}],
+        "tags": ("a", "b"),
+    }
+    ret = pack_util.loads(content_type, pack_util.dumps(content_type, data))
+    assert ret == {
+        u"stat": u"OK",
+        u"name": u"蝴蝶",
+        u"total": 2 ** 40,
+        u"ratio": 0.5,
+        u"ok": True,
+        u"none": None,
+        u"c_time": u"2021-07-20 10:01:02",
+        u"price": 1.5,
+        u"list": [{u"id": 1}, {u"id": 2}],
+        u"tags": [u"a", u"b"],
+    }
+
+
+def test_mcpack_unsupported():
+    """
+    mcpack 不支持的值抛出异常, 由调用方回退为 JSON
+    """
+    with pytest.raises(TypeError):
+        pack_util.dumps(pack_util.MCPACK, {"big": 2 ** 70})
+    with pytest.raises(TypeError):
+        pack_util.dumps(pack_util.MCPACK, {"obj": object()})
+    with pytest.raises(ValueError):
+        pack_util.dumps(pack_util.MCPACK, {"mixed": [1, "a"]})
@@ -8,6 +8,7 @@
 # Description:
 
 """
+import os
 
 from test.xlib import util
 
@@ -25,3 +26,65 @@ def test_demo_file1(init_data):
     header_dict = util.get_header_dict(headers)
     assert status == "200 OK"
     assert header_dict["Content-Type"] == "text/html; charset=UTF-8"
+
+    # 文件内容以 file wrapper 的形式返回, 不读入内存
+    with open("test/static_file/test_html.html", "rb") as f:
+        assert "".join(content) == f.read()
+    assert header_dict["Content-Length"] == str(os.path.getsize("test/static_file/test_html.html"))
+    content.close()
+
+
+def test_demo_file1_conditional_and_range(init_data):
+    """
+    条件请求返回 304, Range 请求返回 206/416
+    """
+    with open("test/static_file/test_html.html", "rb") as f:
+        file_content = f.read()
+    size = len(file_content)
+
+    environ = {"PATH_INFO": "/demo_file1", "REMOTE_ADDR": "192.10.10.10", "REQUEST_METHOD": "GET"}
+    status, headers, content = init_data.process(dict(environ))
+    content.close()
+    header_dict = dict(headers)
+    etag = header_dict["ETag"]
+    assert header_dict["Accept-Ranges"] == "bytes"
+
+    # If-None-Match
+    status, headers, content = init_data.process(dict(environ, HTTP_IF_NONE_MATCH=etag))
+    assert status == "304 Not Modified"
+    assert content == ""
+
+    # If-Modified-Since
+    status, headers, content = init_data.process(
+        dict(environ, HTTP_IF_MODIFIED_SINCE=header_dict["Last-Modified"]))
+    assert status == "304 Not Modified"
+
+    # 单个 Range
+    status, headers, content = init_data.process(dict(environ, HTTP_RANGE="bytes=1-4"))
+    header_dict = dict(headers)
+    assert status == "206 Partial Content"
+    assert header_dict["Content-Range"] == "bytes 1-4/%d" % size
+    assert "".join(content) == file_content[1:5]
+    content.close()
+
+    # If-Range 不匹配时返回完整文件
+    status, headers, content = init_data.process(dict(environ, HTTP_RANGE="bytes=1-4", HTTP_IF_RANGE='"other"'))
+    assert status == "200 OK"
+    assert "".join(content) == file_content
+    content.close()
+
+    # 多个 Range
+    status, headers, content = init_data.process(dict(environ, HTTP_RANGE="bytes=0-1,-2"))
+    header_dict = dict(headers)
+    assert status == "206 Partial Content"
+    assert header_dict["Content-Type"].startswith("multipart/byteranges; boundary=")
+    body = "".join(content)
+    content.close()
+    assert len(body) == int(header_dict["Content-Length"])
+    assert "Content-Range: bytes 0-1/%d\r\n\r\n%s\r\n" % (size, file_content[:2]) in body
+    assert "Content-Range: bytes %d-%d/%d\r\n\r\n%s\r\n" % (size - 2, size - 1, size, file_content[-2:]) in body
+
+    # 无法满足的 Range
+    status, headers, content = init_data.process(dict(environ, HTTP_RANGE="bytes=%d-" % size))
+    assert status == "416 Requested Range Not Satisfiable"
+    assert dict(headers)["Content-Range"] == "bytes */%d" % size
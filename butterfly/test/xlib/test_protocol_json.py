@@ -8,8 +8,20 @@
 # Description:
 
 """
+import os
+import time
+import json
+import hashlib
+from cStringIO import StringIO
+
+import pytest
+
 from conf import config
 from test.xlib import util
+from test.xlib import conftest
+from xlib import deadline
+from xlib.util import pack_util
+from test.xlib import test_multipart
 
 
 def test_demo_test1(init_data):
@@ -101,3 +113,273 @@ def test_static(init_data):
     assert content == ""
 
     # File exist
+
+
+def test_load_shed(init_data, monkeypatch):
+    """
+    server 判定排队超时的请求, 不执行 handler, 直接返回 503
+    """
+    environ={
+            "PATH_INFO":"/demo_test1",
+            "REMOTE_ADDR": "192.10.10.10",
+            "QUERY_STRING": "str_info=meetbill",
+            "cherrypy.queue_delay": 2.5,
+            "cherrypy.load_shed": 1
+            }
+    acclogs = []
+    monkeypatch.setattr(init_data._acclog, "log", acclogs.append)
+    status, headers, content = init_data.process(environ)
+    headers_dict = dict(headers)
+    assert status == "503 Service Unavailable"
+    assert headers_dict["Retry-After"] == "1"
+    assert headers_dict["x-reason"] == "Load Shed"
+    assert init_data.load_shed_count == 1
+    assert "stat:ERR_LOAD_SHED" in acclogs[0]
+    assert "queue=2500.000" in acclogs[0]
+
+
+def test_param_coerce(init_data):
+    """
+    query string 参数按 handler 参数类型转换, 转换失败时返回 ERR_BAD_PARAMS
+    """
+    environ = {
+        "PATH_INFO": "/demo_page",
+        "REMOTE_ADDR": "192.10.10.10",
+        "QUERY_STRING": "page_index=2&is_detail=true"
+    }
+    status, headers, content = init_data.process(environ)
+    assert status == "200 OK"
+    assert json.loads(content[0]) == {"stat": "OK", "page_index": 2, "is_detail": True}
+
+    environ["QUERY_STRING"] = "page_index=abc"
+    status, headers, content = init_data.process(environ)
+    assert content == ('{"stat": "ERR_BAD_PARAMS"}',)
+    assert dict(headers)["x-reason"] == "Param type error"
+
+
+def test_response_cache(init_data):
+    """
+    funcattr.cached: 按 vary 参数缓存序列化后的响应, If-None-Match 匹配时返回 304
+    """
+    del conftest.demo_cached_calls[:]
+    environ = {
+        "PATH_INFO": "/demo_cached",
+        "REMOTE_ADDR": "192.10.10.10",
+        "QUERY_STRING": "page_index=2&trace=a"
+    }
+    status, headers, content = init_data.process(environ)
+    assert status == "200 OK"
+    assert json.loads(content[0]) == {"stat": "OK", "page_index": 2}
+    etag = dict(headers)["ETag"]
+    assert dict(headers)["Cache-Control"] == "max-age=60"
+
+    # 参数经过类型转换后相同, 不在 vary 中的参数不影响 key
+    environ["QUERY_STRING"] = "page_index=02&trace=b"
+    status, headers, content2 = init_data.process(environ)
+    assert content2 == content
+    assert dict(headers)["ETag"] == etag
+    assert dict(headers)["Cache-Control"] == "max-age=60"
+    assert conftest.demo_cached_calls == [2]
+
+    environ["HTTP_IF_NONE_MATCH"] = etag
+    status, headers, content = init_data.process(environ)
+    assert status == "304 Not Modified"
+    assert content == ""
+    assert conftest.demo_cached_calls == [2]
+    del environ["HTTP_IF_NONE_MATCH"]
+
+    # 不同参数 / 非 OK 响应不缓存
+    environ["QUERY_STRING"] = "page_index=3"
+    init_data.process(environ)
+    environ["QUERY_STRING"] = "page_index=-1"
+    init_data.process(environ)
+    status, headers, content = init_data.process(environ)
+    assert content == ('{"stat": "ERR_BAD_PARAMS"}',)
+    assert "ETag" not in dict(headers)
+    assert conftest.demo_cached_calls == [2, 3, -1, -1]
+
+    # handler 返回 Set-Cookie 等 headers 时不缓存
+    for trace in ["a", "b"]:
+        environ["QUERY_STRING"] = "page_index=4&trace=" + trace
+        status, headers, content = init_data.process(environ)
+        assert dict(headers)["Set-Cookie"] == "sid=" + trace
+        assert "ETag" not in dict(headers)
+    assert conftest.demo_cached_calls == [2, 3, -1, -1, 4, 4]
+
+    stats = init_data._protocols["/demo_cached"].stats()
+    assert stats["hits"] == 2
+    assert stats["misses"] == 6
+    assert stats["entries"] == 2
+    assert init_data._protocols["/demo_test1"].stats() is None
+
+
+def test_stream_response(init_data, monkeypatch):
+    """
+    data 中的迭代器字段以 JSON 数组流式输出, 不设置 Content-Length
+    """
+    environ = {
+        "PATH_INFO": "/demo_stream",
+        "REMOTE_ADDR": "192.10.10.10",
+        "QUERY_STRING": "count=2000"
+    }
+    status, headers, content = init_data.process(environ)
+    assert status == "200 OK"
+    assert "Content-Length" not in dict(headers)
+    chunks = list(content)
+    assert len(chunks) > 1
+    data = json.loads("".join(chunks))
+    assert data["stat"] == "OK"
+    assert data["total"] == 2000
+    assert [row["id"] for row in data["list"]] == range(2000)
+
+    # STAT_ADAPTOR
+    protocol = init_data._protocols["/demo_stream"]
+    monkeypatch.setattr(protocol, "_stat_adaptor", {
+        "status_name": "success", "status_map": {"OK": True, "default": False}, "message_name": "message"})
+    environ["QUERY_STRING"] = "count=0"
+    status, headers, content = init_data.process(environ)
+    assert json.loads("".join(content)) == {
+        "stat": "OK", "success": True, "message": "OK", "total": 0, "list": []}
+
+    # 迭代过程中出现异常
+    lines = []
+    monkeypatch.setattr(conftest.errlog, "log", lines.append)
+    environ["QUERY_STRING"] = "count=10&fail_at=5"
+    status, headers, content = init_data.process(environ)
+    assert status == "200 OK"
+    with pytest.raises(ValueError):
+        list(content)
+    assert "Stream json failed" in lines[-1]
+
+
+def test_mcpack_negotiation(init_data):
+    """
+    Accept 为 application/x-mcpack 时响应使用 mcpack 编码, POST body 按 Content-Type 解析
+    """
+    body = pack_util.dumps(pack_util.MCPACK, {"str_info": "蝴蝶"})
+    environ = {
+        "PATH_INFO": "/demo_test1",
+        "REMOTE_ADDR": "192.10.10.10",
+        "REQUEST_METHOD": "POST",
+        "CONTENT_TYPE": pack_util.MCPACK,
+        "CONTENT_LENGTH": str(len(body)),
+        "wsgi.input": StringIO(body),
+        "HTTP_ACCEPT": pack_util.MCPACK,
+    }
+    status, headers, content = init_data.process(environ)
+    assert status == "200 OK"
+    headers = dict(headers)
+    assert headers["Content-Type"] == pack_util.MCPACK
+    assert headers["Vary"] == "Accept"
+    assert int(headers["Content-Length"]) == len(content[0])
+    assert pack_util.loads(pack_util.MCPACK, content[0]) == {u"stat": u"OK", u"str_info": u"蝴蝶"}
+
+    # Accept 为 JSON
+    environ = {
+        "PATH_INFO": "/demo_test1",
+        "REMOTE_ADDR": "192.10.10.10",
+        "QUERY_STRING": "str_info=meetbill",
+        "HTTP_ACCEPT": "application/json",
+    }
+    status, headers, content = init_data.process(environ)
+    assert "Content-Type" not in dict(headers)
+    assert json.loads(content[0]) == {"stat": "OK", "str_info": "meetbill"}
+
+
+def test_multipart_upload(init_data):
+    """
+    multipart/form-data: 普通字段合并到参数中(按默认值转换类型), 文件字段为 UploadFile, 请求结束后删除临时文件
+    """
+    data = os.urandom(300 * 1024)
+    body = test_multipart.make_body([("title", None, "蝴蝶"), ("count", None, "2"), ("file", "a.bin", data)])
+    environ = {
+        "PATH_INFO": "/demo_upload",
+        "REMOTE_ADDR": "192.10.10.10",
+        "REQUEST_METHOD": "POST",
+        "CONTENT_TYPE": "multipart/form-data; boundary=" + test_multipart.BOUNDARY,
+        "CONTENT_LENGTH": str(len(body)),
+        "wsgi.input": StringIO(body),
+    }
+    del conftest.demo_upload_files[:]
+    status, headers, content = init_data.process(environ)
+    assert status == "200 OK"
+    assert json.loads(content[0]) == {"stat": "OK", "title": u"蝴蝶", "count": 2, "filename": "a.bin",
+                                      "size": len(data), "md5": hashlib.md5(data).hexdigest()}
+    assert not os.path.exists(conftest.demo_upload_files[0].path)
+
+    # 数据不完整
+    environ["wsgi.input"] = StringIO(body[:-100])
+    environ["CONTENT_LENGTH"] = str(len(body) - 100)
+    status, headers, content = init_data.process(environ)
+    assert json.loads(content[0])["stat"] == "ERR_BAD_PARAMS"
+
+
+def test_max_concurrency(init_data, monkeypatch):
+    """
+    路由并发数达到上限时返回 503, 流式响应发送完成后才释放
+    """
+    limiter = init_data._protocols["/demo_limited"].bulkhead
+    environ = {
+        "PATH_INFO": "/demo_limited",
+        "REMOTE_ADDR": "192.10.10.10",
+        "QUERY_STRING": "count=3",
+    }
+    acclogs = []
+    monkeypatch.setattr(init_data._acclog, "log", acclogs.append)
+    status, headers, content = init_data.process(environ)
+    assert status == "200 OK"
+    assert limiter.stats()["in_flight"] == 1
+
+    environ["QUERY_STRING"] = ""
+    status, headers, content_2 = init_data.process(environ)
+    assert status == "503 Service Unavailable"
+    headers = dict(headers)
+    assert headers["Retry-After"] == "1"
+    assert headers["x-reason"] == "Concurrency Limit"
+    assert "stat:ERR_CONCURRENCY_LIMIT" in acclogs[-1]
+
+    assert json.loads("".join(content)) == {"stat": "OK", "list": [0, 1, 2]}
+    content.close()
+    assert limiter.stats()["in_flight"] == 0
+
+    # 非流式响应立即释放
+    status, headers, content = init_data.process(environ)
+    assert status == "200 OK"
+    assert limiter.stats() == {"limit": 1, "queue_timeout": 0, "in_flight": 0, "waiting": 0, "peak": 1,
+                               "accepted": 2, "rejected": 1}
+
+
+def test_request_deadline(init_data, monkeypatch):
+    """
+    X-Request-Timeout/X-Request-Deadline 解析为 req.deadline, handler 超过 deadline 时 stat 为 ERR_DEADLINE_EXCEEDED
+    """
+    acclogs = []
+    monkeypatch.setattr(init_data._acclog, "log", acclogs.append)
+    environ = {
+        "PATH_INFO": "/demo_deadline",
+        "REMOTE_ADDR": "192.10.10.10",
+        "HTTP_X_REQUEST_TIMEOUT": "5",
+    }
+    now = time.time()
+    status, headers, content = init_data.process(environ)
+    data = json.loads(content[0])
+    assert data["stat"] == "OK"
+    assert now + 5 <= data["deadline"] < time.time() + 5
+    # 请求结束后清除线程内的 deadline
+    assert deadline.get_deadline() is None
+
+    # handler 执行中超过 deadline
+    environ["HTTP_X_REQUEST_TIMEOUT"] = "0.05"
+    environ["QUERY_STRING"] = "sleep=0.1"
+    status, headers, content = init_data.process(environ)
+    assert status == "200 OK"
+    assert json.loads(content[0])["stat"] == "ERR_DEADLINE_EXCEEDED"
+    assert dict(headers)["x-reason"] == "Deadline Exceeded"
+    assert "stat:ERR_DEADLINE_EXCEEDED" in acclogs[-1]
+
+    # 到达 handler 前已超过 deadline(如排队耗时)
+    del environ["HTTP_X_REQUEST_TIMEOUT"]
+    environ["HTTP_X_REQUEST_DEADLINE"] = str(time.time() - 1)
+    status, headers, content = init_data.process(environ)
+    assert status == "504 Gateway Timeout"
+    assert "stat:ERR_DEADLINE_EXCEEDED" in acclogs[-1]
@@ -0,0 +1,55 @@
+#!/usr/bin/python
+# coding=utf8
+"""
+# File Name: test_response_cache.py
+# Description:
+    handler 响应缓存测试
+
+"""
+import time
+
+from xlib import response_cache
+
+
+def test_response_cache_lru():
+    """
+    超出 max_bytes 时淘汰最久未使用的响应
+    """
+    cache = response_cache.ResponseCache(60, 25)
+    cache.put("a", "OK", "a" * 10, [])
+    cache.put("b", "OK", "b" * 10, [("x-demo", "1")])
+    assert cache.get("a").body == "a" * 10
+    cache.put("c", "OK", "c" * 10, [])
+
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    entry = cache.get("c")
+    assert entry.etag == response_cache.make_etag("c" * 10)
+    stats = cache.stats()
+    assert stats["entries"] == 2
+    assert stats["bytes"] == 20
+    assert stats["evictions"] == 1
+    assert stats["hits"] == 3
+    assert stats["misses"] == 1
+
+    # 超过 max_bytes 的响应不缓存
+    cache.put("d", "OK", "d" * 30, [])
+    assert cache.get("d") is None
+
+
+def test_response_cache_ttl():
+    """
+    过期的响应视为未命中
+    """
+    cache = response_cache.ResponseCache(0.05, 1024)
+    entry = cache.put("a", "OK", "body", [("x-demo", "1")])
+    assert entry.headers == (("x-demo", "1"),)
+    assert entry.etag == response_cache.make_etag("body")
+    assert entry.etag.startswith('"') and entry.etag.endswith('"')
+    assert cache.get("a") is entry
+    time.sleep(0.06)
+    assert cache.get("a") is None
+    stats = cache.stats()
+    assert stats["expired"] == 1
+    assert stats["entries"] == 0
+    assert stats["bytes"] == 0
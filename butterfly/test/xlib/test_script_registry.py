@@ -0,0 +1,176 @@
+#!/usr/bin/python
+# coding=utf8
+"""
+# File Name: test_script_registry.py
+# Description:
+    redisorm Lua 脚本注册表测试
+
+    FakeServer 替换 Database 的 evalsha/script_load/pipeline, 模拟服务端的脚本缓存(不需要 redis-server)
+"""
+import os
+import hashlib
+
+import pytest
+
+from xlib.db import redisorm
+from xlib.db.redis.exceptions import NoScriptError
+from xlib.db.redisorm import script_registry
+
+
+class FakePipeline(object):
+    """
+    非事务 pipeline, 只支持 script_load 及 evalsha
+    """
+
+    def __init__(self, server):
+        self._server = server
+        self._commands = []
+
+    def script_load(self, script):
+        self._commands.append(lambda: self._server.load(script))
+        return self
+
+    def evalsha(self, sha, numkeys, *keys_and_args):
+        self._commands.append(lambda: self._server.run(sha, numkeys, *keys_and_args))
+        return self
+
+    def execute(self, raise_on_error=True):
+        self._server.round_trips += 1
+        results = []
+        for command in self._commands:
+            try:
+                results.append(command())
+            except NoScriptError as e:
+                if raise_on_error:
+                    raise
+                results.append(e)
+        return results
+
+
+class FakeServer(object):
+    """
+    服务端脚本缓存: sha1 => 源码, 未加载的脚本 EVALSHA 时返回 NOSCRIPT
+    """
+
+    def __init__(self, database):
+        self.scripts = {}
+        self.calls = []
+        self.round_trips = 0
+        database.evalsha = self.evalsha
+        database.script_load = self.script_load
+        database.pipeline = lambda transaction=True: FakePipeline(self)
+
+    def load(self, script):
+        if isinstance(script, unicode):
+            script = script.encode("utf-8")
+        sha = hashlib.sha1(script).hexdigest()
+        self.scripts[sha] = script
+        return sha
+
+    def script_load(self, script):
+        self.calls.append(("script_load",))
+        self.round_trips += 1
+        return self.load(script)
+
+    def evalsha(self, sha, numkeys, *keys_and_args):
+        self.round_trips += 1
+        return self.run(sha, numkeys, *keys_and_args)
+
+    def run(self, sha, numkeys, *keys_and_args):
+        self.calls.append(("evalsha", sha, numkeys) + keys_and_args)
+        if sha not in self.scripts:
+            raise NoScriptError("No matching script. Please use EVAL.")
+        return self.scripts[sha], list(keys_and_args)
+
+
+@pytest.fixture()
+def database():
+    return redisorm.Database()
+
+
+@pytest.fixture()
+def server(database):
+    return FakeServer(database)
+
+
+def test_noscript_reload(database, server, monkeypatch):
+    """
+    服务端没有脚本时 SCRIPT LOAD 后重试, 之后只发送 EVALSHA
+    """
+    monkeypatch.setitem(script_registry._defined, "test_echo", "return KEYS[1]")
+    assert database.script_registry("test_echo", keys=["k"], args=[1]) == ("return KEYS[1]", ["k", 1])
+    assert [call[0] for call in server.calls] == ["evalsha", "script_load", "evalsha"]
+    sha = hashlib.sha1("return KEYS[1]").hexdigest()
+    assert server.calls[-1] == ("evalsha", sha, 1, "k", 1)
+
+    server.calls = []
+    database.script_registry("test_echo", keys=["k"], args=[2])
+    assert [call[0] for call in server.calls] == ["evalsha"]
+
+    # redis 重启后脚本缓存清空
+    server.scripts.clear()
+    assert database.script_registry("test_echo", keys=["k"], args=[3]) == ("return KEYS[1]", ["k", 3])
+
+
+def test_register_overrides_define(database, server, monkeypatch):
+    """
+    同名时单个连接注册的脚本优先于 define 的脚本, 且不影响其他连接
+    """
+    monkeypatch.setitem(script_registry._defined, "test_override", "return 'defined'")
+    assert database.script_registry("test_override")[0] == "return 'defined'"
+
+    database.script_registry.register("test_override", "return 'registered'")
+    assert database.script_registry("test_override")[0] == "return 'registered'"
+
+    other = redisorm.Database()
+    FakeServer(other)
+    assert other.script_registry("test_override")[0] == "return 'defined'"
+
+    with pytest.raises(KeyError):
+        database.script_registry.get("test_not_defined")
+
+
+def test_load(database, server, monkeypatch):
+    """
+    load 一次往返加载所有脚本, 之后调用不再 NOSCRIPT
+    """
+    monkeypatch.setitem(script_registry._defined, "test_echo", "return KEYS[1]")
+    shas = database.load_scripts()
+    assert server.round_trips == 1
+    assert sorted(shas) == database.script_registry.names()
+    assert "test_echo" in shas
+    assert "cas" in shas
+    assert shas["test_echo"] == hashlib.sha1("return KEYS[1]").hexdigest()
+
+    database.script_registry("test_echo", keys=["k"])
+    database.run_script("cas", keys=["k"], args=["old", "new"])
+    assert [call[0] for call in server.calls] == ["evalsha", "evalsha"]
+
+
+def test_call_many(database, server, monkeypatch):
+    """
+    call_many 在一次往返中多次执行脚本, NOSCRIPT 时 SCRIPT LOAD 后只重试这些调用
+    """
+    monkeypatch.setitem(script_registry._defined, "test_echo", "return KEYS[1]")
+    calls = [(["k1"], [1]), (["k2"], [])]
+    expected = [("return KEYS[1]", ["k1", 1]), ("return KEYS[1]", ["k2"])]
+    assert database.script_registry.call_many("test_echo", calls) == expected
+    assert server.round_trips == 3
+    assert [call[0] for call in server.calls] == ["evalsha", "evalsha", "script_load", "evalsha", "evalsha"]
+
+    server.calls = []
+    server.round_trips = 0
+    assert database.script_registry.call_many("test_echo", calls) == expected
+    assert server.round_trips == 1
+    assert database.script_registry.call_many("test_echo", []) == []
+
+
+@pytest.mark.parametrize("script_name", ["cas", "lock_acquire", "lock_release"])
+def test_run_script(database, server, script_name):
+    """
+    run_script 执行 script_dir 中的脚本
+    """
+    with open(os.path.join(os.path.dirname(redisorm.__file__), "scripts", script_name + ".lua")) as f:
+        source = f.read()
+    result = database.run_script(script_name, keys=["k"], args=["a", "b"])
+    assert result == (source, ["k", "a", "b"])
@@ -0,0 +1,106 @@
+#!/usr/bin/python
+# coding=utf8
+"""
+# File Name: test_static_cache.py
+# Description:
+    静态文件内存缓存测试
+
+"""
+import os
+import gzip
+import time
+from cStringIO import StringIO
+
+from xlib import static_cache
+from xlib import httpgateway
+from conf import config
+from test.xlib import conftest
+
+
+def test_static_cache(tmpdir):
+    """
+    LRU 淘汰, mtime 变化时重新加载
+    """
+    cache = static_cache.StaticCache(250, max_file_size=200, check_interval=0)
+    for name in ("a.bin", "b.bin", "c.bin"):
+        tmpdir.join(name).write("x" * 100)
+    tmpdir.join("big.bin").write("x" * 300)
+
+    path_a = str(tmpdir.join("a.bin"))
+    assert cache.get(path_a).data == "x" * 100
+    assert cache.get(path_a).data == "x" * 100
+    assert cache.get(str(tmpdir.join("b.bin"))) is not None
+    # 超过 max_bytes, 淘汰最久未使用的 a.bin
+    cache.get(path_a)
+    cache.get(str(tmpdir.join("c.bin")))
+    stats = cache.stats()
+    assert stats["files"] == 2
+    assert stats["evictions"] == 1
+    assert stats["hits"] == 2
+
+    # 超过 max_file_size 及不存在的文件不缓存
+    assert cache.get(str(tmpdir.join("big.bin"))) is None
+    assert cache.get(str(tmpdir.join("missing.bin"))) is None
+
+    # 文件变化后重新加载
+    path_c = str(tmpdir.join("c.bin"))
+    tmpdir.join("c.bin").write("y" * 50)
+    os.utime(path_c, (time.time() + 10, time.time() + 10))
+    assert cache.get(path_c).data == "y" * 50
+
+
+def test_static_cache_check_interval(tmpdir):
+    """
+    check_interval 内不检查文件变化
+    """
+    cache = static_cache.StaticCache(1024, check_interval=60)
+    path = str(tmpdir.join("a.txt"))
+    tmpdir.join("a.txt").write("old")
+    assert cache.get(path).data == "old"
+    tmpdir.join("a.txt").write("new!")
+    assert cache.get(path).data == "old"
+
+
+def test_static_cache_gateway(tmpdir):
+    """
+    WSGIGateway 静态文件缓存: gzip 及 304
+    """
+    js = "var butterfly = 1;\n" * 100
+    tmpdir.join("app.js").write(js)
+    wsgigw = httpgateway.WSGIGateway(
+        httpgateway.get_func_name,
+        conftest.errlog,
+        conftest.acclog,
+        {},
+        str(tmpdir),
+        config.STATIC_PREFIX,
+        static_cache=static_cache.StaticCache(1024 * 1024))
+    environ = {
+        "PATH_INFO": "/{prefix}/app.js".format(prefix=config.STATIC_PREFIX),
+        "REMOTE_ADDR": "192.10.10.10",
+        "REQUEST_METHOD": "GET"
+    }
+
+    status, headers, content = wsgigw.process(dict(environ))
+    headers_dict = dict(headers)
+    assert status == "200 OK"
+    assert "".join(content) == js
+    assert headers_dict["Content-Type"].endswith("javascript")
+    assert headers_dict["Vary"] == "Accept-Encoding"
+    assert "Content-Encoding" not in headers_dict
+
+    status, headers, content = wsgigw.process(dict(environ, HTTP_ACCEPT_ENCODING="gzip, deflate"))
+    headers_dict = dict(headers)
+    assert headers_dict["Content-Encoding"] == "gzip"
+    assert int(headers_dict["Content-Length"]) < len(js)
+    assert gzip.GzipFile(fileobj=StringIO("".join(content))).read() == js
+
+    # 条件请求
+    status, headers, content = wsgigw.process(
+        dict(environ, HTTP_ACCEPT_ENCODING="gzip", HTTP_IF_NONE_MATCH=headers_dict["ETag"]))
+    assert status == "304 Not Modified"
+
+    # gzip;q=0 不压缩
+    status, headers, content = wsgigw.process(dict(environ, HTTP_ACCEPT_ENCODING="gzip;q=0"))
+    assert "Content-Encoding" not in dict(headers)
+    assert wsgigw.stats()["static_cache"]["hits"] == 3
@@ -0,0 +1,189 @@
+#!/usr/bin/python
+# coding=utf8
+"""
+# File Name: test_urls.py
+# Description:
+    路由测试: 静态路由/动态路由/HTTP 方法限制
+
+"""
+import json
+import types
+
+import pytest
+
+from xlib import urls
+from xlib import retstat
+from xlib import httpgateway
+from xlib.middleware import funcattr
+from test.xlib.conftest import errlog, acclog
+
+
+def test_router_match():
+    """
+    静态路由优先, 静态段优先于路径参数, 转换失败时回溯
+    """
+    router = urls.Router()
+    router.add("/wuxing/instance", "list")
+    router.add("/wuxing/instance/{name}", "get_by_name")
+    router.add("/wuxing/instance/{id:int}/history", "history")
+    router.add("/wuxing/instance/latest", "latest")
+    router.add("/files/{file_path:path}", "files")
+    router.add("/price/{value:float}", "price")
+
+    def match(path, method="GET"):
+        route, path_params, allowed = router.match(path, method)
+        return route and route.protocol, path_params, allowed
+
+    assert match("/wuxing/instance") == ("list", None, None)
+    assert match("/wuxing/instance/latest") == ("latest", None, None)
+    assert match("/wuxing/instance/host1") == ("get_by_name", {"name": "host1"}, None)
+    assert match("/wuxing/instance/12/history") == ("history", {"id": 12}, None)
+    assert match("/wuxing/instance/abc/history") == (None, None, None)
+    assert match("/files/a/b/c.txt") == ("files", {"file_path": "a/b/c.txt"}, None)
+    assert match("/files") == (None, None, None)
+    assert match("/price/1.5") == ("price", {"value": 1.5}, None)
+    assert match("/price/x") == (None, None, None)
+    assert match("/unknown") == (None, None, None)
+
+    route = router.match("/wuxing/instance/12/history")[0]
+    assert route.pattern == "/wuxing/instance/{id:int}/history"
+    assert len(router.routes()) == 6
+
+
+def test_router_methods():
+    """
+    同一路径按 HTTP 方法注册不同 handler, 方法不匹配时返回允许的方法
+    """
+    router = urls.Router()
+    router.add("/wuxing/instance/{name}", "get", methods=["get"])
+    router.add("/wuxing/instance/{name}", "delete", methods=["DELETE"])
+    router.add("/wuxing/ping", "ping", methods=["GET", "HEAD"])
+
+    assert router.match("/wuxing/instance/a", "GET")[0].protocol == "get"
+    assert router.match("/wuxing/instance/a", "DELETE")[0].protocol == "delete"
+    assert router.match("/wuxing/instance/a", "POST") == (None, None, ["DELETE", "GET"])
+    assert router.match("/wuxing/ping", "HEAD")[0].protocol == "ping"
+    assert router.match("/wuxing/ping", "POST") == (None, None, ["GET", "HEAD"])
+
+    # 方法不匹配时继续匹配其他路由, 均不匹配时返回所有路径匹配的路由允许的方法
+    router.add("/api/item", "get_item", methods=["GET"])
+    router.add("/api/{name}", "post_name", methods=["POST"])
+    router.add("/api/{name}/{id:int}", "put_id", methods=["PUT"])
+    router.add("/api/{name}/{key}", "get_key", methods=["GET"])
+    router.add("/api/{file_path:path}", "delete_path", methods=["DELETE"])
+
+    def match(path, method):
+        route, path_params, allowed = router.match(path, method)
+        return route and route.protocol, path_params, allowed
+
+    assert match("/api/item", "GET") == ("get_item", None, None)
+    assert match("/api/item", "POST") == ("post_name", {"name": "item"}, None)
+    assert match("/api/item/1", "GET") == ("get_key", {"name": "item", "key": "1"}, None)
+    assert match("/api/item/1", "PUT") == ("put_id", {"name": "item", "id": 1}, None)
+    assert match("/api/item", "DELETE") == ("delete_path", {"file_path": "item"}, None)
+    assert router.match("/api/item", "PATCH") == (None, None, ["DELETE", "GET", "POST"])
+
+    with pytest.raises(ValueError):
+        router.add("/wuxing/instance/{name}", "get2", methods=["GET"])
+    with pytest.raises(ValueError):
+        router.add("/wuxing/instance/{other}", "other")
+    with pytest.raises(ValueError):
+        router.add("/files/{path:path}/tail", "files")
+    with pytest.raises(ValueError):
+        router.add("/wuxing/{id:uuid}", "bad_converter")
+
+
+def demo_get(req, name, verbose=False):
+    return retstat.OK, {"name": name}
+
+
+class LogCollector(object):
+    """
+    initlog
+    """
+
+    def __init__(self):
+        self.lines = []
+
+    def log(self, line):
+        self.lines.append(line)
+
+
+@pytest.fixture()
+def gateway():
+    """
+    通过 Route.add_apis 注册 handler
+    """
+    module = types.ModuleType("handlers.wuxing")
+
+    @funcattr.api
+    @funcattr.route("/wuxing/instance/{name}", methods=["GET"])
+    def get_instance(req, name, page_index=1):
+        return retstat.OK, {"name": name, "page_index": page_index}
+
+    @funcattr.api
+    @funcattr.route(methods=["POST"])
+    def delete_instance(req, name):
+        return retstat.OK, {"deleted": name}
+
+    module.get_instance = get_instance
+    module.delete_instance = delete_instance
+
+    route = urls.Route(LogCollector(), errlog)
+    route.add_apis(module, package_name="handlers.wuxing")
+    # apicube 中只有静态路由
+    assert sorted(route.get_route()) == ["/wuxing/delete_instance", "/wuxing/get_instance"]
+    yield httpgateway.WSGIGateway(httpgateway.get_func_name, errlog, acclog, route.get_route(),
+                                  router=route.get_router())
+
+
+def test_gateway_dynamic_route(gateway, monkeypatch):
+    """
+    路径参数传递给 handler, acclog 中记录注册的路径
+    """
+    lines = []
+    monkeypatch.setattr(acclog, "log", lines.append)
+    environ = {
+        "PATH_INFO": "/wuxing/instance/host1/",
+        "REQUEST_METHOD": "GET",
+        "REMOTE_ADDR": "192.10.10.10",
+        "QUERY_STRING": "page_index=2",
+    }
+    status, headers, content = gateway.process(environ)
+    assert status == "200 OK"
+    assert json.loads(content[0]) == {"stat": "OK", "name": "host1", "page_index": 2}
+    assert "\t/wuxing/instance/{name}\t" in lines[-1]
+
+    # 默认路由仍可使用
+    environ["PATH_INFO"] = "/wuxing/get_instance"
+    environ["QUERY_STRING"] = "name=host2"
+    status, headers, content = gateway.process(environ)
+    assert json.loads(content[0])["name"] == "host2"
+
+    # HTTP 方法不匹配
+    environ["PATH_INFO"] = "/wuxing/instance/host1"
+    environ["REQUEST_METHOD"] = "DELETE"
+    status, headers, content = gateway.process(environ)
+    assert status == "405 Method Not Allowed"
+    assert dict(headers)["Allow"] == "GET"
+
+    environ["PATH_INFO"] = "/wuxing/delete_instance"
+    environ["QUERY_STRING"] = "name=host1"
+    status, headers, content = gateway.process(environ)
+    assert status == "405 Method Not Allowed"
+    assert dict(headers)["Allow"] == "POST"
+
+    environ["PATH_INFO"] = "/wuxing/unknown"
+    status, headers, content = gateway.process(environ)
+    assert status == "400 Bad Request"
+
+
+def test_route_param_must_be_arg():
+    """
+    路径参数必须为 handler 的参数
+    """
+    route = urls.Route(LogCollector(), errlog)
+    with pytest.raises(ValueError):
+        route.addapi("/wuxing/instance/{host}", demo_get, True, True, True)
+    route.addapi("/wuxing/instance/{name}", demo_get, True, True, True)
+    assert route.get_route() == {}
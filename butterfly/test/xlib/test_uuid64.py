@@ -0,0 +1,83 @@
+#!/usr/bin/python
+# coding=utf8
+"""
+# File Name: test_uuid64.py
+# Description:
+    reqid 生成及解析
+
+"""
+import time
+import threading
+
+from xlib import uuid64
+
+
+def test_gen_decode():
+    """
+    v2 reqid 可以解析, v1 reqid 仍可解析
+    """
+    generator = uuid64.UUID64()
+    now = time.time()
+    reqid = generator.gen()
+    assert len(reqid) == 16
+    assert generator.is_v2(reqid)
+    info = generator.decode(reqid)
+    assert info["version"] == 2
+    assert abs(info["timestamp"] - now) < 1
+    assert info["pid_low"] == generator._pid & 0x0f
+    assert info["counter_low"] == 0
+
+    reqid_v1 = generator.gen_v1()
+    assert not generator.is_v2(reqid_v1)
+    info_v1 = generator.decode(reqid_v1)
+    assert info_v1["version"] == 1
+    assert info_v1["counter_low"] == 1
+    assert info_v1["mac_addr"][2:] == info["mac_addr"]
+
+
+def test_gen_threads():
+    """
+    多线程生成的 reqid 不重复
+    """
+    generator = uuid64.UUID64()
+    reqids = []
+
+    def gen():
+        for _ in range(1000):
+            reqids.append(generator.gen())
+
+    threads = [threading.Thread(target=gen) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(set(reqids)) == len(reqids)
+
+
+def test_gen_same_ms(monkeypatch):
+    """
+    同一毫秒内 2048 个 reqid 不重复
+    """
+    generator = uuid64.UUID64()
+    now = time.time()
+    monkeypatch.setattr(uuid64.time, "time", lambda: now)
+    reqids = [generator.gen() for _ in range(2048)]
+    assert len(set(reqids)) == len(reqids)
+    infos = [generator.decode(reqid) for reqid in reqids]
+    assert set(info["timestamp"] for info in infos) == set([infos[0]["timestamp"]])
+    assert sorted(info["counter_low"] for info in infos) == range(2048)
+
+
+def test_is_v2():
+    """
+    v2 首字符不是 16 进制字符, 全为数字的 v1 reqid 不会被识别为 v2
+    """
+    generator = uuid64.UUID64()
+    for _ in range(100):
+        reqid = generator.gen()
+        assert reqid[0] in "ghijklmn"
+        assert not reqid.isdigit()
+    # 全为数字且首位为 8/9 的 v1 reqid(DES 输出)
+    for reqid_v1 in ("9602123456789012", "8123456789012345"):
+        assert not generator.is_v2(reqid_v1)
+        assert generator.decode(reqid_v1)["version"] == 1
@@ -2,11 +2,15 @@
 """
 (1) 路由处理及 wsgigw 定义
 (2) 根据配置文件配置，进行启动【百川】worker
+(3) 多进程模式下，fork 后子进程的初始化
 """
+import os
 import threading
 import Queue as queue
 
 from xlib import httpgateway
+from xlib import static_cache
+from xlib import logger
 from conf import logger_conf
 from conf import config
 from xlib import urls
@@ -37,7 +41,13 @@ wsgigw = httpgateway.WSGIGateway(
     apicube,
     config.STATIC_PATH,
     config.STATIC_PREFIX,
-    config.HEADER_USERNAME
+    config.HEADER_USERNAME,
+    static_cache.StaticCache(config.STATIC_CACHE_SIZE,
+                             config.STATIC_CACHE_FILE_SIZE_LIMIT,
+                             config.STATIC_CACHE_CHECK_INTERVAL) if config.STATIC_CACHE_SIZE else None,
+    route.get_router(),
+    config.REQUEST_BODY_SPOOL_SIZE,
+    config.REQUEST_TIMEOUT
 )
 
 # ********************************************************
@@ -58,6 +68,11 @@ if "baichuan" in db.my_caches.keys():
     pool = BoundedThreadPoolExecutor(10)
 
     baichuan_connection = db.my_caches["baichuan"]
+    # 预加载 Lua 脚本(worker 出队使用 EVALSHA), 失败时首次调用收到 NOSCRIPT 后自动加载
+    try:
+        baichuan_connection.load_scripts()
+    except BaseException as e:
+        logger_conf.initlog.log("[module=baichuan msg=load_scripts failed: {}]".format(e))
     queues = apicube.keys()
     worker = worker.Worker(queues=queues, connection=baichuan_connection,
                            acclog=logger_conf.acclog, errlog=logger_conf.errlog,
@@ -94,6 +109,30 @@ if "baichuan" in db.my_caches.keys():
 # 将调度程序进行启动
 manager.scheduler.start()
 
+# ********************************************************
+# * Perfork                                              *
+# ********************************************************
+# 主进程 pid, 多进程模式下主进程负责【百川】worker 及定时调度, 子进程负责处理 HTTP 请求
+_master_pid = os.getpid()
+
+
+def after_perfork(worker_index):
+    """
+    多进程模式下, 子进程 fork 后执行, 重新初始化从主进程继承的资源
+
+    Args:
+        worker_index: (int) 子进程编号
+    """
+    if os.getpid() == _master_pid:
+        return
+
+    logger.reinit_after_fork()
+    db.reinit_after_fork()
+    wsgigw.reinit_after_fork()
+    logger_conf.initlog.log("[module=perfork worker_index={worker_index} pid={pid}]".format(
+        worker_index=worker_index, pid=os.getpid()))
+
+
 def application(environ, start_response):
     """
     The main WSGI application.
@@ -0,0 +1,102 @@
+# coding:utf8
+"""
+# File Name: bulkhead.py
+# Description:
+    路由并发限制(bulkhead)
+
+    (1) 每个使用 funcattr.max_concurrency 的路由一个实例, 限制同时处理的请求数,
+        避免慢接口(如大列表查询, 下载)占满 server 线程, 影响 ping 等其他接口
+    (2) 达到上限时最多等待 queue_timeout 秒, 仍无空闲时立即失败(不占用更多线程)
+    (3) 流式响应(下载等)在响应发送完成(close)后才释放
+
+    由 httpgateway.WSGIGateway 在调用 Protocol 前后使用
+"""
+import time
+import threading
+
+
+class Bulkhead(object):
+    """
+    并发限制
+
+    Attributes:
+        limit         : (Int) 最大并发数
+        queue_timeout : (Float) 达到上限时的最长等待时间(s), 为 0 时不等待
+        in_flight     : (Int) 当前处理中的请求数
+        waiting       : (Int) 当前等待中的请求数
+        peak          : (Int) 处理中请求数的最大值
+        accepted/rejected: (Int) 统计
+    """
+
+    def __init__(self, limit, queue_timeout=0):
+        """
+        Args:
+            limit         : (Int) 最大并发数
+            queue_timeout : (Float) 达到上限时的最长等待时间(s)
+        """
+        if limit < 1:
+            raise ValueError("limit must be >= 1")
+        self.limit = limit
+        self.queue_timeout = queue_timeout
+
+        self.in_flight = 0
+        self.waiting = 0
+        self.peak = 0
+        self.accepted = 0
+        self.rejected = 0
+        self._cond = threading.Condition(threading.Lock())
+
+    def acquire(self):
+        """
+        获取处理名额
+
+        Returns:
+            (Bool) 是否获取成功, 成功时处理完成后需调用 release
+        """
+        with self._cond:
+            if self.in_flight >= self.limit and self.queue_timeout > 0:
+                deadline = time.time() + self.queue_timeout
+                self.waiting += 1
+                try:
+                    while self.in_flight >= self.limit:
+                        remaining = deadline - time.time()
+                        if remaining <= 0:
+                            break
+                        self._cond.wait(remaining)
+                finally:
+                    self.waiting -= 1
+
+            if self.in_flight >= self.limit:
+                self.rejected += 1
+                return False
+            self.in_flight += 1
+            self.accepted += 1
+            if self.in_flight > self.peak:
+                self.peak = self.in_flight
+            return True
+
+    def release(self):
+        """
+        释放处理名额
+        """
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify()
+
+    def stats(self):
+        """
+        并发统计
+
+        Returns:
+            (Dict)
+        """
+        with self._cond:
+            return {
+                "limit": self.limit,
+                "queue_timeout": self.queue_timeout,
+                "in_flight": self.in_flight,
+                "waiting": self.waiting,
+                "peak": self.peak,
+                "accepted": self.accepted,
+                "rejected": self.rejected,
+            }
@@ -75,8 +75,12 @@ try:
 except BaseException:
     import Queue as queue
 import re
+import math
 import email.utils
+import select
+import signal
 import socket
+import stat
 import sys
 import threading
 import time
@@ -109,7 +113,9 @@ __all__ = ['HTTPRequest', 'HTTPConnection', 'HTTPServer',
            'SizeCheckWrapper', 'KnownLengthRFile', 'ChunkedRFile',
            'CP_makefile',
            'MaxSizeExceeded', 'NoSSLError', 'FatalSSLAlert',
-           'WorkerThread', 'ThreadPool', 'SSLAdapter',
+           'WorkerThread', 'ThreadPool', 'ThreadPoolAutoScaler',
+           'KeepAliveParking', 'QueueDelayShedder', 'SSLAdapter',
+           'FileWrapper',
            'CherryPyWSGIServer',
            'Gateway', 'WSGIGateway', 'WSGIGateway10', 'WSGIGatewayU0',
            'WSGIPathInfoDispatcher', 'get_ssl_adapter_class',
@@ -125,6 +131,10 @@ if 'win' in sys.platform and hasattr(socket, 'AF_INET6'):
 
 DEFAULT_BUFFER_SIZE = io.DEFAULT_BUFFER_SIZE
 
+# Python 2 socket module does not export SO_REUSEPORT (Linux >= 3.9)
+SO_REUSEPORT = getattr(socket, 'SO_REUSEPORT',
+                       15 if sys.platform.startswith('linux') else None)
+
 
 if six.PY3:
     def ntob(n, encoding='ISO-8859-1'):
@@ -1126,6 +1136,15 @@ class CPMakefilePY2(getattr(socket, '_fileobject', object)):
                         and e.args[0] not in socket_error_eintr):
                     raise
 
+    def has_buffered_data(self):
+        """
+        读缓存区中是否还有未处理的数据(如 pipelining 的下一个请求)
+        """
+        if isinstance(self._rbuf, six.string_types):
+            return len(self._rbuf) > 0
+        self._rbuf.seek(0, 2)
+        return self._rbuf.tell() > 0
+
     class FauxSocket(object):
 
         """Faux socket with the minimal interface required by pypy"""
@@ -1428,6 +1447,15 @@ class HTTPConnection(object):
     wbufsize = DEFAULT_BUFFER_SIZE
     RequestHandlerClass = HTTPRequest
 
+    queued_at = None
+    """time.time() when the connection was last put on the server Queue."""
+
+    queue_delay = 0.0
+    """Seconds the connection waited in the Queue before its next request."""
+
+    load_shed = 0
+    """Retry-After seconds if the next request should be shed, else 0."""
+
     def __init__(self, server, sock, makefile=CP_makefile):
         self.server = server
         self.socket = sock
@@ -1436,7 +1464,12 @@ class HTTPConnection(object):
         self.requests_seen = 0
 
     def communicate(self):
-        """Read each request and respond appropriately."""
+        """Read each request and respond appropriately.
+
+        Returns True if the connection should be parked (kept open and
+        handed back to the server until its next request is readable),
+        False if it should be closed.
+        """
         request_seen = False
         try:
             while True:
@@ -1457,9 +1490,17 @@ class HTTPConnection(object):
                     return
 
                 request_seen = True
+                if self.load_shed:
+                    # Don't keep an overloaded server busy with this client
+                    req.close_connection = True
                 req.respond()
+                # Queue delay only applies to the first request after dequeue
+                self.queue_delay = 0.0
+                self.load_shed = 0
                 if req.close_connection:
-                    return
+                    return False
+                if self._can_park():
+                    return True
         except socket.error:
             e = sys.exc_info()[1]
             errnum = e.args[0]
@@ -1512,6 +1553,19 @@ class HTTPConnection(object):
                     # Close the connection.
                     return
 
+    def _can_park(self):
+        """
+        当前请求处理完成后, 连接是否可以交还给 server 进行 parking
+
+        读缓存区中已有下一个请求的数据时(pipelining), 由当前 worker 线程继续处理
+        """
+        if self.server.parking is None or not self.server.ready:
+            return False
+        has_buffered_data = getattr(self.rfile, 'has_buffered_data', None)
+        if has_buffered_data is None:
+            return False
+        return not has_buffered_data()
+
     linger = False
 
     def _handle_no_ssl(self, req):
@@ -1645,19 +1699,33 @@ class WorkerThread(threading.Thread):
                     return
 
                 self.conn = conn
+                self.server._check_queue_delay(conn)
                 if self.server.stats['Enabled']:
                     self.start_time = time.time()
+                keep_conn_open = False
                 try:
-                    conn.communicate()
+                    keep_conn_open = conn.communicate()
                 finally:
-                    conn.close()
+                    if not keep_conn_open:
+                        conn.close()
                     if self.server.stats['Enabled']:
                         self.requests_seen += self.conn.requests_seen
                         self.bytes_read += self.conn.rfile.bytes_read
                         self.bytes_written += self.conn.wfile.bytes_written
                         self.work_time += time.time() - self.start_time
                         self.start_time = None
+                        # parked 的连接会被再次处理, 计数清零避免重复统计
+                        conn.requests_seen = 0
+                        conn.rfile.bytes_read = 0
+                        conn.wfile.bytes_written = 0
                     self.conn = None
+                    if keep_conn_open:
+                        # stop() 会将 server.parking 置为 None, 此时关闭连接
+                        parking = self.server.parking
+                        if parking is None:
+                            conn.close()
+                        else:
+                            parking.put(conn)
         except (KeyboardInterrupt, SystemExit):
             exc = sys.exc_info()[1]
             self.server.interrupt = exc
@@ -1727,10 +1795,7 @@ class ThreadPool(object):
         """Kill off worker threads (not below self.min)."""
         # Grow/shrink the pool if necessary.
         # Remove any dead threads from our list
-        for t in self._threads:
-            if not t.isAlive():
-                self._threads.remove(t)
-                amount -= 1
+        amount -= self._cull_dead()
 
         # calculate the number of threads above the minimum
         n_extra = max(len(self._threads) - self.min, 0)
@@ -1744,6 +1809,13 @@ class ThreadPool(object):
         for n in range(n_to_remove):
             self._queue.put(_SHUTDOWNREQUEST)
 
+    def _cull_dead(self):
+        """Remove dead threads from our list, return how many were removed."""
+        alive = [t for t in self._threads if t.isAlive()]
+        n_dead = len(self._threads) - len(alive)
+        self._threads = alive
+        return n_dead
+
     def stop(self, timeout=5):
         # Must shut down threads here so the code that calls
         # this method can know when all threads are stopped.
@@ -1787,6 +1859,311 @@ class ThreadPool(object):
     qsize = property(_get_qsize)
 
 
+class QueueDelayShedder(object):
+
+    """CoDel-style load shedding on the Queue delay of connections.
+
+    A connection is timestamped when it is put on the server Queue, and its
+    queue delay is measured when a worker thread takes it. Within each
+    `interval`, the minimum delay seen tells whether the Queue is a standing
+    queue (overload) or just absorbing a burst:
+
+    * while the minimum delay of the last interval stayed above `target`,
+      requests which waited longer than `target` are shed;
+    * otherwise only requests which waited longer than `interval` are shed,
+      so short bursts are served.
+
+    Shed requests are answered 503 with Retry-After (by the application,
+    see WSGIGateway10.get_environ), instead of wasting capacity on clients
+    which have likely given up already.
+    """
+
+    def __init__(self, target, interval):
+        self.target = target
+        self.interval = interval
+        self.retry_after = max(int(math.ceil(interval)), 1)
+        self.shed_count = 0
+        self._overloaded = False
+        self._min_delay = None
+        self._interval_end = time.time() + interval
+        self._lock = threading.Lock()
+
+    def should_shed(self, delay):
+        """Record a queue delay, return True if the request should be shed."""
+        now = time.time()
+        with self._lock:
+            if now >= self._interval_end:
+                self._overloaded = (self._min_delay is not None and
+                                    self._min_delay > self.target)
+                self._min_delay = delay
+                self._interval_end = now + self.interval
+            elif self._min_delay is None or delay < self._min_delay:
+                self._min_delay = delay
+
+            limit = self.target if self._overloaded else self.interval
+            if delay > limit:
+                self.shed_count += 1
+                return True
+            return False
+
+
+class ThreadPoolAutoScaler(threading.Thread):
+
+    """Grow and shrink a ThreadPool between its min and max by load.
+
+    Every `interval` seconds the controller samples the queue depth and the
+    number of busy worker threads. Busy threads = arrival rate x per-request
+    work time (Little's law), so their moving average tracks how many
+    threads the current load really needs.
+
+    * Grow as soon as more connections wait in the queue than there are
+      idle workers, by the difference (not above max).
+    * Shrink only after the pool has stayed above `headroom` x the average
+      busy threads for `shrink_delay` seconds, by half of the excess at a
+      time (not below min).
+
+    The delay and the headroom are the hysteresis that keeps bursts from
+    flapping the pool size.
+    """
+
+    interval = 0.5
+    """Sampling period in seconds."""
+
+    smoothing = 0.2
+    """Weight of the newest sample in the busy threads moving average."""
+
+    headroom = 1.5
+    """Threads kept per average busy thread before shrinking."""
+
+    shrink_delay = 15
+    """Seconds the pool must stay oversized before it is shrunk."""
+
+    def __init__(self, pool):
+        threading.Thread.__init__(self)
+        self.setDaemon(True)
+        self.setName('CP Server ThreadPoolAutoScaler')
+        self.pool = pool
+        self.busy_avg = 0.0
+        self._oversized_since = None
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.tick()
+            except BaseException:
+                self.pool.server.error_log('Error in ThreadPoolAutoScaler',
+                                           level=logging.ERROR, traceback=True)
+
+    def stop(self):
+        self._stopped.set()
+
+    def tick(self):
+        """Take one sample and grow/shrink the pool if needed."""
+        pool = self.pool
+        pool._cull_dead()
+        threads = len(pool._threads)
+        idle = pool.idle
+        qsize = pool.qsize
+        self.busy_avg += self.smoothing * ((threads - idle) - self.busy_avg)
+
+        if qsize > idle:
+            self._oversized_since = None
+            pool.grow(qsize - idle)
+            return
+
+        target = max(pool.min, int(math.ceil(self.busy_avg * self.headroom)))
+        if threads <= target:
+            self._oversized_since = None
+            return
+
+        now = time.time()
+        if self._oversized_since is None:
+            self._oversized_since = now
+        elif now - self._oversized_since >= self.shrink_delay:
+            pool.shrink(max((threads - target) // 2, 1))
+            self._oversized_since = now
+
+
+class _EpollPoller(object):
+
+    """Readability poller based on epoll (Linux)."""
+
+    def __init__(self):
+        self._epoll = select.epoll()
+
+    def register(self, fd):
+        self._epoll.register(fd, select.EPOLLIN)
+
+    def unregister(self, fd):
+        try:
+            self._epoll.unregister(fd)
+        except (IOError, OSError, ValueError):
+            pass
+
+    def poll(self, timeout):
+        return [fd for fd, _event in self._epoll.poll(timeout)]
+
+    def close(self):
+        self._epoll.close()
+
+
+class _SelectPoller(object):
+
+    """Readability poller based on select() (portable fallback)."""
+
+    def __init__(self):
+        self._fds = set()
+
+    def register(self, fd):
+        self._fds.add(fd)
+
+    def unregister(self, fd):
+        self._fds.discard(fd)
+
+    def poll(self, timeout):
+        readable, _w, _x = select.select(list(self._fds), [], [], timeout)
+        return readable
+
+    def close(self):
+        self._fds.clear()
+
+
+class KeepAliveParking(object):
+
+    """Hold idle keep-alive connections outside of the worker threads.
+
+    After a response has been written, a WorkerThread hands its connection
+    back via put() instead of blocking on the next request line. The server
+    thread polls the listening socket together with every parked connection
+    in tick(), and only queues a connection for the ThreadPool once its next
+    request is readable, so the worker threads serve active requests rather
+    than idle sockets. Parked connections idle longer than server.timeout are
+    closed, which matches the old blocking readline timeout.
+
+    Only the server thread touches the poller; put() may be called from any
+    thread and wakes the poller up through a pipe.
+    """
+
+    def __init__(self, server):
+        self.server = server
+        self._conns = {}
+        self._pending = []
+        self._lock = threading.Lock()
+        self._listen_fd = None
+        self._last_expire = time.time()
+        self._closed = False
+
+        if hasattr(select, 'epoll'):
+            self._poller = _EpollPoller()
+        else:
+            self._poller = _SelectPoller()
+
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        for fd in (self._wakeup_r, self._wakeup_w):
+            fcntl.fcntl(fd, fcntl.F_SETFL,
+                        fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+            fcntl.fcntl(fd, fcntl.F_SETFD,
+                        fcntl.fcntl(fd, fcntl.F_GETFD) | fcntl.FD_CLOEXEC)
+        self._poller.register(self._wakeup_r)
+
+    def __len__(self):
+        return len(self._conns) + len(self._pending)
+
+    def bind(self, sock):
+        """Poll the listening socket along with the parked connections."""
+        self._listen_fd = sock.fileno()
+        self._poller.register(self._listen_fd)
+
+    def put(self, conn):
+        """Park a keep-alive connection (thread-safe)."""
+        conn.last_used = time.time()
+        with self._lock:
+            if self._closed:
+                conn.close()
+                return
+            self._pending.append(conn)
+            try:
+                os.write(self._wakeup_w, b'x')
+            except OSError as e:
+                # The pipe is full, so the poller is going to wake up anyway.
+                if e.errno not in socket_errors_nonblocking:
+                    raise
+
+    def select(self, timeout):
+        """Wait for readable sockets.
+
+        Returns (listen_ready, conns): whether the listening socket has a
+        connection to accept, and the parked connections whose next request
+        is readable (they are removed from the parking).
+        """
+        with self._lock:
+            if self._closed:
+                return False, []
+            pending, self._pending = self._pending, []
+        for conn in pending:
+            fd = conn.socket.fileno()
+            self._conns[fd] = conn
+            self._poller.register(fd)
+
+        try:
+            fds = self._poller.poll(timeout)
+        except (select.error, IOError, OSError) as e:
+            if e.args[0] in socket_error_eintr:
+                return False, []
+            raise
+
+        listen_ready = False
+        conns = []
+        for fd in fds:
+            if fd == self._listen_fd:
+                listen_ready = True
+            elif fd == self._wakeup_r:
+                self._drain_wakeup()
+            else:
+                conn = self._conns.pop(fd, None)
+                if conn is not None:
+                    self._poller.unregister(fd)
+                    conns.append(conn)
+
+        self._expire()
+        return listen_ready, conns
+
+    def _drain_wakeup(self):
+        try:
+            while os.read(self._wakeup_r, 4096):
+                pass
+        except OSError as e:
+            if e.errno not in socket_errors_nonblocking:
+                raise
+
+    def _expire(self):
+        """Close parked connections idle longer than server.timeout."""
+        now = time.time()
+        if now - self._last_expire < 1:
+            return
+        self._last_expire = now
+
+        deadline = now - self.server.timeout
+        for fd, conn in list(self._conns.items()):
+            if conn.last_used < deadline:
+                del self._conns[fd]
+                self._poller.unregister(fd)
+                conn.close()
+
+    def close(self):
+        """Close every parked connection and release the poller."""
+        with self._lock:
+            self._closed = True
+            pending, self._pending = self._pending, []
+        for conn in list(self._conns.values()) + pending:
+            conn.close()
+        self._conns.clear()
+        self._poller.close()
+        os.close(self._wakeup_r)
+        os.close(self._wakeup_w)
+
+
 try:
     import fcntl
 except ImportError:
@@ -1817,6 +2194,77 @@ else:
         fcntl.fcntl(fd, fcntl.F_SETFD, old_flags | fcntl.FD_CLOEXEC)
 
 
+def _get_sendfile():
+    """Return sendfile(out_fd, in_fd, offset, count) -> bytes sent, or None.
+
+    Python 3 has os.sendfile; on Python 2 the libc call is used through
+    ctypes on Linux. Errors are raised as OSError like os.sendfile.
+    """
+    if hasattr(os, 'sendfile'):
+        return os.sendfile
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        import ctypes
+        import ctypes.util
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+                           use_errno=True)
+        c_sendfile = libc.sendfile64
+    except (ImportError, OSError, AttributeError):
+        return None
+    c_sendfile.argtypes = [ctypes.c_int, ctypes.c_int,
+                           ctypes.POINTER(ctypes.c_int64), ctypes.c_size_t]
+    c_sendfile.restype = ctypes.c_ssize_t
+
+    def _sendfile(out_fd, in_fd, offset, count):
+        """sendfile(2) through ctypes."""
+        off = ctypes.c_int64(offset)
+        sent = c_sendfile(out_fd, in_fd, ctypes.byref(off), count)
+        if sent < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        return sent
+    return _sendfile
+
+sendfile = _get_sendfile()
+
+
+class FileWrapper(object):
+
+    """The wsgi.file_wrapper: iterate over a file-like object in blocks.
+
+    WSGIGateway sends a FileWrapper of a regular file with sendfile(), so the
+    file content never goes through Python (see WSGIGateway.respond). Other
+    file-like objects, SSL and chunked responses fall back to iteration.
+    """
+
+    def __init__(self, filelike, blksize=8192):
+        self.filelike = filelike
+        self.blksize = blksize
+        if hasattr(filelike, 'close'):
+            self.close = filelike.close
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        data = self.filelike.read(self.blksize)
+        if data:
+            return data
+        raise StopIteration
+    __next__ = next
+
+    def fileno(self):
+        """Return the fd if filelike is a regular file, else None."""
+        try:
+            fd = self.filelike.fileno()
+            if stat.S_ISREG(os.fstat(fd).st_mode):
+                return fd
+        except (AttributeError, IOError, OSError, ValueError):
+            pass
+        return None
+
+
 class SSLAdapter(object):
 
     """Base class for SSL driver library adapters.
@@ -1904,6 +2352,37 @@ class HTTPServer(object):
     ConnectionClass = HTTPConnection
     """The class to use for handling HTTP connections."""
 
+    keep_alive_parking = False
+    """If True, idle keep-alive connections are parked in a KeepAliveParking
+    poller by the server thread instead of holding a worker thread."""
+
+    parking = None
+    """The KeepAliveParking instance, or None if parking is disabled."""
+
+    reuse_port = False
+    """If True and perfork > 1, every worker process binds its own listening
+    socket with SO_REUSEPORT so the kernel balances accepts between them."""
+
+    autoscaler = None
+    """The ThreadPoolAutoScaler instance, started when maxthreads > minthreads
+    (the pool keeps minthreads otherwise)."""
+
+    queue_delay_target = 0
+    """Target Queue delay in seconds for QueueDelayShedder (0 = no shedding)."""
+
+    queue_delay_interval = 1
+    """QueueDelayShedder interval in seconds, also the Retry-After value."""
+
+    shedder = None
+    """The QueueDelayShedder instance, or None if load shedding is disabled."""
+
+    rejected_count = 0
+    """Connections answered 503 because the Queue was full."""
+
+    _perfork = 1
+    _after_perfork = None
+    _wsgiapp_getter = None
+
     ssl_adapter = None
     """An instance of SSLAdapter (or a subclass).
 
@@ -1935,6 +2414,9 @@ class HTTPServer(object):
             'Queue': lambda s: getattr(self.requests, 'qsize', None),
             'Threads': lambda s: len(getattr(self.requests, '_threads', [])),
             'Threads Idle': lambda s: getattr(self.requests, 'idle', None),
+            'Parked': lambda s: len(self.parking) if self.parking else 0,
+            'Load Shed': lambda s: self.shedder.shed_count if self.shedder else 0,
+            'Queue Full Rejected': lambda s: self.rejected_count,
             'Socket Errors': 0,
             'Requests': lambda s: (not s['Enabled']) and -1 or sum(
                 [w['Requests'](w) for w in s['Worker Threads'].values()], 0),
@@ -2012,6 +2494,66 @@ class HTTPServer(object):
         if self.software is None:
             self.software = '%s Server' % self.version
 
+        # By meetbill
+        # ----------------------------------------Start
+        # Fork workers
+        if self._perfork > 1:
+            # With SO_REUSEPORT every worker binds its own listening socket
+            # and the kernel balances accepts; otherwise workers share the
+            # socket bound by the master.
+            if not self.reuse_port:
+                self._create_socket()
+            # Only returns in the worker processes
+            worker_index = self._fork_workers()
+            if self.reuse_port:
+                self._create_socket()
+            if self._after_perfork:
+                self._after_perfork(worker_index)
+        else:
+            self._create_socket()
+            # Single process condition
+            if self._after_perfork:
+                self._after_perfork(0)
+
+        if self._wsgiapp_getter:
+            self.wsgi_app = self._wsgiapp_getter()
+        # ----------------------------------------End
+
+        if self.queue_delay_target > 0:
+            self.shedder = QueueDelayShedder(self.queue_delay_target,
+                                             self.queue_delay_interval)
+
+        # Keep-alive parking (after fork, every process owns its poller)
+        if self.keep_alive_parking and self.ssl_adapter is None:
+            self.parking = KeepAliveParking(self)
+            self.parking.bind(self.socket)
+
+        # Create worker threads
+        self.requests.start()
+        if self.requests.max > self.requests.min:
+            self.autoscaler = ThreadPoolAutoScaler(self.requests)
+            self.autoscaler.start()
+
+        self.ready = True
+        self._start_time = time.time()
+        while self.ready:
+            try:
+                self.tick()
+            except (KeyboardInterrupt, SystemExit):
+                raise
+            except BaseException:
+                self.error_log('Error in HTTPServer.tick', level=logging.ERROR,
+                               traceback=True)
+
+            if self.interrupt:
+                while self.interrupt is True:
+                    # Wait for self.stop() to complete. See _set_interrupt.
+                    time.sleep(0.1)
+                if self.interrupt:
+                    raise self.interrupt
+
+    def _create_socket(self):
+        """Create, bind and listen the server socket (self.socket)."""
         # Select the appropriate socket
         self.socket = None
         if os.getenv('LISTEN_PID', None):
@@ -2071,49 +2613,77 @@ class HTTPServer(object):
         self.socket.settimeout(1)
         self.socket.listen(self.request_queue_size)
 
-        # By meetbill
-        # ----------------------------------------Start
-        # Fork workers
-        for i in range(1, self._perfork):
-            pid = os.fork()
-            if pid == 0:
-                # Child process here
-                if self._after_perfork:
-                    self._after_perfork(i)
-                break
-            else:
-                # Parent Process here
-                if i == 1:
-                    self._after_perfork(0)
+    def _fork_workers(self):
+        """Fork self._perfork worker processes and supervise them (master).
 
-        # Single process condition
-        if self._perfork == 1 and self._after_perfork:
-            self._after_perfork(0)
+        The master process does not serve requests: it waits for its
+        children and respawns any worker process that dies, keeping its
+        worker index. On SIGTERM/SIGINT the master forwards SIGTERM to the
+        workers, waits for them and exits.
 
-        if self._wsgiapp_getter:
-            self.wsgi_app = self._wsgiapp_getter()
-        # ----------------------------------------End
+        Returns the worker index (0 <= index < self._perfork), only in the
+        worker processes.
+        """
+        children = {}
+        for index in range(self._perfork):
+            if self._spawn_worker_process(index, children):
+                return index
 
-        # Create worker threads
-        self.requests.start()
+        state = {'stopping': False}
 
-        self.ready = True
-        self._start_time = time.time()
-        while self.ready:
+        def _stop_workers(signum, frame):
+            state['stopping'] = True
+            for pid in list(children):
+                try:
+                    os.kill(pid, signal.SIGTERM)
+                except OSError:
+                    pass
+
+        signal.signal(signal.SIGTERM, _stop_workers)
+        signal.signal(signal.SIGINT, _stop_workers)
+
+        while children:
             try:
-                self.tick()
-            except (KeyboardInterrupt, SystemExit):
+                pid, status = os.wait()
+            except OSError as e:
+                if e.errno == errno.EINTR:
+                    continue
+                if e.errno == errno.ECHILD:
+                    break
                 raise
-            except BaseException:
-                self.error_log('Error in HTTPServer.tick', level=logging.ERROR,
-                               traceback=True)
 
-            if self.interrupt:
-                while self.interrupt is True:
-                    # Wait for self.stop() to complete. See _set_interrupt.
-                    time.sleep(0.1)
-                if self.interrupt:
-                    raise self.interrupt
+            index, spawn_time = children.pop(pid, (None, None))
+            if index is None or state['stopping']:
+                continue
+
+            self.error_log('Worker process %s (pid %s) exited with status %s, respawning'
+                           % (index, pid, status), level=logging.WARNING)
+            # Don't fork in a tight loop if the worker dies at startup
+            if time.time() - spawn_time < 1:
+                time.sleep(1)
+            if state['stopping']:
+                continue
+            if self._spawn_worker_process(index, children):
+                return index
+
+        sys.exit(0)
+
+    def _spawn_worker_process(self, index, children):
+        """Fork one worker process.
+
+        Returns True in the child, False in the master (which records the
+        child in children as pid -> (index, spawn_time)).
+        """
+        pid = os.fork()
+        if pid == 0:
+            # Child process here
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.default_int_handler)
+            return True
+
+        # Parent Process here
+        children[pid] = (index, time.time())
+        return False
 
     def error_log(self, msg='', level=20, traceback=False):
         # Override this in subclasses as desired
@@ -2129,6 +2699,10 @@ class HTTPServer(object):
         self.socket = socket.socket(family, type, proto)
         prevent_socket_inheritance(self.socket)
         self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if self.reuse_port and self._perfork > 1:
+            if SO_REUSEPORT is None:
+                raise socket.error('SO_REUSEPORT is not supported on this platform')
+            self.socket.setsockopt(socket.SOL_SOCKET, SO_REUSEPORT, 1)
         if self.nodelay and not isinstance(self.bind_addr, str):
             self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
 
@@ -2153,6 +2727,57 @@ class HTTPServer(object):
         self.socket.bind(self.bind_addr)
 
     def tick(self):
+        """Accept a new connection and put it on the Queue.
+
+        With keep-alive parking enabled, also put parked connections whose
+        next request is readable back on the Queue.
+        """
+        parking = self.parking
+        if parking is None:
+            self._accept()
+            return
+
+        # Same timeout as the listening socket, so stop() is noticed quickly
+        listen_ready, conns = parking.select(1)
+        for conn in conns:
+            self._put_conn(conn)
+        if listen_ready:
+            self._accept()
+
+    def _put_conn(self, conn):
+        """Put a connection on the Queue, reject it if the Queue is full."""
+        conn.queued_at = time.time()
+        try:
+            self.requests.put(conn)
+        except queue.Full:
+            self._reject_conn(conn)
+
+    def _reject_conn(self, conn):
+        """Answer 503 with Retry-After and close the connection."""
+        self.rejected_count += 1
+        msg = ('%s 503 Service Unavailable\r\n'
+               'Retry-After: %d\r\n'
+               'Content-Length: 0\r\n'
+               'Connection: close\r\n\r\n'
+               % (self.protocol, max(int(math.ceil(self.queue_delay_interval)), 1)))
+        try:
+            conn.socket.sendall(msg.encode('ISO-8859-1'))
+        except socket.error:
+            pass
+        conn.close()
+
+    def _check_queue_delay(self, conn):
+        """Measure how long conn waited in the Queue, decide load shedding.
+
+        Called by the WorkerThread which took conn from the Queue.
+        """
+        if conn.queued_at is None:
+            return
+        conn.queue_delay = time.time() - conn.queued_at
+        if self.shedder is not None and self.shedder.should_shed(conn.queue_delay):
+            conn.load_shed = self.shedder.retry_after
+
+    def _accept(self):
         """Accept a new connection and put it on the Queue."""
         try:
             s, addr = self.socket.accept()
@@ -2213,12 +2838,7 @@ class HTTPServer(object):
 
             conn.ssl_env = ssl_env
 
-            try:
-                self.requests.put(conn)
-            except queue.Full:
-                # Just drop the conn. TODO: write 503 back?
-                conn.close()
-                return
+            self._put_conn(conn)
         except socket.timeout:
             # The only reason for the timeout in start() is so we can
             # notice keyboard interrupts on Win32, which don't interrupt
@@ -2301,8 +2921,16 @@ class HTTPServer(object):
                 sock.close()
             self.socket = None
 
+        if self.autoscaler is not None:
+            self.autoscaler.stop()
+            self.autoscaler = None
+
         self.requests.stop(self.shutdown_timeout)
 
+        if self.parking is not None:
+            self.parking.close()
+            self.parking = None
+
 
 class Gateway(object):
 
@@ -2363,7 +2991,10 @@ class CherryPyWSGIServer(HTTPServer):
     def __init__(self, bind_addr, wsgi_app, numthreads=10, server_name=None,
                  max=-1, request_queue_size=5, timeout=10, shutdown_timeout=5,
                  accepted_queue_size=-1, accepted_queue_timeout=10,
-                 perfork=0, after_perfork=None, wsgiapp_getter=None):
+                 perfork=0, after_perfork=None, wsgiapp_getter=None,
+                 keep_alive_parking=False, reuse_port=False,
+                 queue_delay_target=0, queue_delay_interval=1,
+                 max_request_body_size=0):
         self.requests = ThreadPool(self, min=numthreads or 1, max=max,
                                    accepted_queue_size=accepted_queue_size,
                                    accepted_queue_timeout=accepted_queue_timeout)
@@ -2385,6 +3016,11 @@ class CherryPyWSGIServer(HTTPServer):
 
         self.timeout = timeout
         self.shutdown_timeout = shutdown_timeout
+        self.keep_alive_parking = keep_alive_parking
+        self.reuse_port = reuse_port
+        self.queue_delay_target = queue_delay_target
+        self.queue_delay_interval = queue_delay_interval
+        self.max_request_body_size = max_request_body_size
         self.clear_stats()
 
     def _get_numthreads(self):
@@ -2399,6 +3035,9 @@ class WSGIGateway(Gateway):
 
     """A base class to interface HTTPServer with WSGI."""
 
+    sendfile_blksize = 1 << 30
+    """Max bytes per sendfile() call."""
+
     def __init__(self, req):
         self.req = req
         self.started_response = False
@@ -2425,6 +3064,9 @@ class WSGIGateway(Gateway):
 
         response = self.req.server.wsgi_app(self.env, self.start_response)
         try:
+            if isinstance(response, FileWrapper) and self._can_sendfile(response):
+                self._sendfile(response)
+                return
             for chunk in filter(None, response):
                 if not isinstance(chunk, six.binary_type):
                     raise ValueError('WSGI Applications must yield bytes')
@@ -2433,6 +3075,58 @@ class WSGIGateway(Gateway):
             if hasattr(response, 'close'):
                 response.close()
 
+    def _can_sendfile(self, response):
+        """Whether the FileWrapper response can be sent with sendfile().
+
+        The response must declare a Content-Length (a chunked body needs
+        framing) and go out through a plain socket.
+        """
+        return (sendfile is not None
+                and self.started_response
+                and self.remaining_bytes_out is not None
+                and self.req.server.ssl_adapter is None
+                and response.fileno() is not None)
+
+    def _sendfile(self, response):
+        """Send the headers, then Content-Length bytes of the file from its
+        current position with sendfile()."""
+        req = self.req
+        if not req.sent_headers:
+            req.sent_headers = True
+            req.send_headers()
+        if req.method == b'HEAD':
+            return
+
+        wfile = req.conn.wfile
+        wfile.flush()
+        sock = req.conn.socket
+        in_fd = response.fileno()
+        offset = response.filelike.tell()
+        remaining = self.remaining_bytes_out
+        timeout = sock.gettimeout()
+        while remaining > 0:
+            try:
+                sent = sendfile(sock.fileno(), in_fd, offset,
+                                min(remaining, self.sendfile_blksize))
+            except OSError as e:
+                if e.errno in socket_errors_nonblocking:
+                    # The socket has a timeout, so it is non-blocking
+                    if not select.select([], [sock], [], timeout)[1]:
+                        raise socket.timeout('timed out')
+                    continue
+                if e.errno in socket_error_eintr:
+                    continue
+                raise socket.error(*e.args)
+            if sent == 0:
+                # The file was truncated: the declared Content-Length
+                # can't be honoured anymore, close after this response.
+                req.close_connection = True
+                break
+            offset += sent
+            remaining -= sent
+            wfile.bytes_written += sent
+        self.remaining_bytes_out = remaining
+
     def start_response(self, status, headers, exc_info=None):
         """
         WSGI callable to begin the HTTP response.
@@ -2543,8 +3237,13 @@ class WSGIGateway10(WSGIGateway):
             'SERVER_PROTOCOL': bton(req.request_protocol),
             'SERVER_SOFTWARE': req.server.software,
             'wsgi.errors': sys.stderr,
+            'wsgi.file_wrapper': FileWrapper,
             'wsgi.input': req.rfile,
-            'wsgi.multiprocess': False,
+            'wsgi.multiprocess': req.server._perfork > 1,
+            # Non-standard: Queue delay of this request, and the
+            # Retry-After seconds if it should be answered 503 (else 0)
+            'cherrypy.queue_delay': req.conn.queue_delay,
+            'cherrypy.load_shed': req.conn.load_shed,
             'wsgi.multithread': True,
             'wsgi.run_once': False,
             'wsgi.url_scheme': bton(req.scheme),
@@ -4040,6 +4040,15 @@ class Database(_CallableContextManager):
     def _close(self, conn):
         conn.close()
 
+    def reset_after_fork(self):
+        """
+        fork 后在子进程中调用, 丢弃从父进程继承的连接
+        继承的 socket 与父进程共享, 所以不能关闭, 子进程使用时会重新建立连接
+        """
+        self._state.reset()
+        if self.thread_safe:
+            self._lock = threading.Lock()
+
     def is_closed(self):
         """
         返回数据库连接是否关闭
@@ -234,6 +234,14 @@ class PooledDatabase(object):
             self._in_use = in_use
         return n
 
+    def reset_after_fork(self):
+        """
+        fork 后在子进程中调用, 丢弃从父进程继承的连接池(不关闭连接)
+        """
+        super(PooledDatabase, self).reset_after_fork()
+        self._connections = []
+        self._in_use = {}
+
     def close_all(self):
         """
         # Close all connections -- available and in-use. Warning: may break any
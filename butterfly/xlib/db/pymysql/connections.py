@@ -34,6 +34,7 @@ from .protocol import (
 )
 from .util import byte2int, int2byte
 from . import err, VERSION_STRING
+from xlib import deadline
 
 try:
     import ssl
@@ -732,8 +733,16 @@ class Connection(object):
         packet.check_error()
         return packet
 
+    def _shrink_timeout(self, timeout):
+        # By meetbill: 按请求 deadline(xlib.deadline) 缩短 socket 超时, 已超过 deadline 时断开连接(协议状态未知)
+        try:
+            return deadline.shrink_timeout(timeout)
+        except deadline.DeadlineExceeded:
+            self._force_close()
+            raise
+
     def _read_bytes(self, num_bytes):
-        self._sock.settimeout(self._read_timeout)
+        self._sock.settimeout(self._shrink_timeout(self._read_timeout))
         while True:
             try:
                 data = self._rfile.read(num_bytes)
@@ -756,7 +765,7 @@ class Connection(object):
         return data
 
     def _write_bytes(self, data):
-        self._sock.settimeout(self._write_timeout)
+        self._sock.settimeout(self._shrink_timeout(self._write_timeout))
         try:
             self._sock.sendall(data)
         except IOError as e:
@@ -37,6 +37,7 @@ from xlib.db.redis.exceptions import (
     TimeoutError,
 )
 from xlib.db.redis.utils import HIREDIS_AVAILABLE
+from xlib import deadline
 
 try:
     import ssl
@@ -562,6 +563,8 @@ class Connection(object):
     """
     Manages TCP communication to and from a Redis server
     """
+    # By meetbill: socket 超时是否已按请求 deadline 缩短
+    _deadline_timeout = False
 
     def __init__(self, host='localhost', port=6379, db=0, password=None,
                  socket_timeout=None, socket_connect_timeout=None,
@@ -770,6 +773,21 @@ class Connection(object):
                     raise ConnectionError(
                         'Bad response from PING health check')
 
+    def _apply_deadline(self):
+        """
+        By meetbill: 按请求 deadline(xlib.deadline) 缩短 socket 超时
+
+        Raises:
+            deadline.DeadlineExceeded: 已超过 deadline
+        """
+        timeout = deadline.shrink_timeout(self.socket_timeout)
+        if timeout != self.socket_timeout:
+            self._sock.settimeout(timeout)
+            self._deadline_timeout = True
+        elif self._deadline_timeout:
+            self._sock.settimeout(self.socket_timeout)
+            self._deadline_timeout = False
+
     def send_packed_command(self, command, check_health=True):
         "Send an already packed command to the Redis server"
         if not self._sock:
@@ -777,6 +795,7 @@ class Connection(object):
         # guard against health check recursion
         if check_health:
             self.check_health()
+        self._apply_deadline()
         try:
             if isinstance(command, str):
                 command = [command]
@@ -813,6 +832,13 @@ class Connection(object):
 
     def read_response(self):
         "Read the response from a previously sent command"
+        if self._sock is not None:
+            try:
+                self._apply_deadline()
+            except deadline.DeadlineExceeded:
+                # 未读取的响应会留在连接中, 需断开
+                self.disconnect()
+                raise
         try:
             response = self._parser.read_response()
         except socket.timeout:
@@ -49,6 +49,7 @@ from xlib.db.redisorm.graph import Graph
 from xlib.db.redisorm.lock import Lock
 from xlib.db.redisorm.rate_limit import RateLimit
 from xlib.db.redisorm.rate_limit import RateLimitException
+from xlib.db.redisorm.script_registry import ScriptRegistry
 from xlib.db.redisorm.streams import Message
 from xlib.db.redisorm.streams import TimeSeries
 
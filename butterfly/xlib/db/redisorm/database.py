@@ -39,6 +39,7 @@ from xlib.db.redisorm.fts import Index
 from xlib.db.redisorm.graph import Graph
 from xlib.db.redisorm.lock import Lock
 from xlib.db.redisorm.rate_limit import RateLimit
+from xlib.db.redisorm.script_registry import ScriptRegistry
 from xlib.db.redisorm.streams import TimeSeries
 
 
@@ -95,6 +96,7 @@ class Database(Redis):
             b'hash': self.Hash}
         self._transaction_local = TransactionLocal()
         self._transaction_lock = threading.RLock()
+        self.script_registry = ScriptRegistry(self)
         self.init_scripts(script_dir=script_dir)
 
     def xsetid(self, name, id):
@@ -163,18 +165,25 @@ class Database(Redis):
 
     def init_scripts(self, script_dir=None):
         """
-        Init scripts
+        Init scripts, 注册到 script_registry 中(EVALSHA, NOSCRIPT 时自动重新加载)
         Args:
             script_dir: (String)
         """
-        self._scripts = {}
         if not script_dir:
             script_dir = os.path.join(os.path.dirname(__file__), 'scripts')
         for filename in glob.glob(os.path.join(script_dir, '*.lua')):
             with open(filename, 'r') as fh:
-                script_obj = self.register_script(fh.read())
                 script_name = os.path.splitext(os.path.basename(filename))[0]
-                self._scripts[script_name] = script_obj
+                self.script_registry.register(script_name, fh.read())
+
+    def load_scripts(self):
+        """
+        预加载所有 Lua 脚本(SCRIPT LOAD), 启动时调用
+
+        Returns:
+            (Dict) 脚本名称 => sha1
+        """
+        return self.script_registry.load()
 
     def run_script(self, script_name, keys=None, args=None):
         """
@@ -189,7 +198,7 @@ class Database(Redis):
             and ``args``, which are referenced in lua as ``KEYS``
             and ``ARGV``.
         """
-        return self._scripts[script_name](keys, args)
+        return self.script_registry(script_name, keys, args)
 
     def get_temp_key(self):
         """
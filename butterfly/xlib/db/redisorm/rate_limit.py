@@ -77,6 +77,16 @@ class RateLimit(object):
         counter.pexpire(int(self._per * 2000))
         return is_limited
 
+    def params(self, key):
+        """
+        供 Lua 脚本批量计数使用, 与 limit 使用相同的 List(按时间倒序保存事件时间)
+
+        :param str key: A key identifying the source of the event.
+        :returns: (list_key, limit, per), limit 为 0 时不限流(debug)
+        """
+        limit = 0 if self._debug else self._limit
+        return self.name + ':' + key, limit, self._per
+
     def rate_limited(self, key_function=None):
         """
         Function or method decorator that will prevent calls to the decorated
@@ -0,0 +1,148 @@
+# coding=utf8
+"""
+# File Name: script_registry.py
+# Description:
+    Lua 脚本注册表
+
+    (1) 脚本按名称注册, 调用时使用 EVALSHA, 只发送 40 字节的 sha1, 不再每次发送脚本源码
+    (2) 服务端没有该脚本(NOSCRIPT, 如 redis 重启/主从切换后)时自动 SCRIPT LOAD 后重试
+    (3) load() 一次往返预加载所有脚本, 启动时调用, 避免首次调用时的 NOSCRIPT
+    (4) call_many() 在一个非事务 pipeline 中多次执行同一脚本(如每个队列一次, 每次只访问同一 hashtag 的 key),
+        一次往返, 且不需要 pipeline 执行前的 SCRIPT EXISTS
+
+    define() 注册所有连接共用的脚本(如 mq 的脚本), ScriptRegistry.register() 注册单个连接的脚本
+    (如 Database 的 script_dir 中的脚本), 同名时后者优先
+
+    Examples:
+        LUA_POP = script_registry.define("mq_pop", 'return redis.call("lpop", KEYS[1])')
+        db.my_caches["baichuan"].script_registry(LUA_POP, keys=[key])
+"""
+from xlib.db.redis.exceptions import NoScriptError
+
+# 所有连接共用的脚本, 名称 => 源码
+_defined = {}
+
+
+def define(name, source):
+    """
+    注册所有连接共用的脚本
+
+    Args:
+        name  : (String) 脚本名称
+        source: (String) Lua 源码
+    Returns:
+        (String) 脚本名称
+    """
+    _defined[name] = source
+    return name
+
+
+class ScriptRegistry(object):
+    """
+    单个 redis 连接的 Lua 脚本注册表
+    """
+
+    def __init__(self, client):
+        """
+        Args:
+            client: (Redis) redis 连接
+        """
+        self._client = client
+        self._sources = {}
+        # 名称 => redis Script(EVALSHA, NOSCRIPT 时重新加载)
+        self._scripts = {}
+
+    def register(self, name, source):
+        """
+        注册当前连接的脚本
+
+        Args:
+            name  : (String) 脚本名称
+            source: (String) Lua 源码
+        """
+        self._sources[name] = source
+        self._scripts.pop(name, None)
+
+    def names(self):
+        """
+        Returns:
+            (List) 所有可用的脚本名称
+        """
+        names = set(_defined)
+        names.update(self._sources)
+        return sorted(names)
+
+    def get(self, name):
+        """
+        Returns:
+            (Script) redis Script 对象
+        Raises:
+            KeyError: 脚本未注册
+        """
+        script = self._scripts.get(name)
+        if script is None:
+            source = self._sources[name] if name in self._sources else _defined[name]
+            script = self._client.register_script(source)
+            self._scripts[name] = script
+        return script
+
+    def __call__(self, name, keys=None, args=None, client=None):
+        """
+        执行脚本
+
+        Args:
+            name  : (String) 脚本名称
+            keys  : (List) KEYS
+            args  : (List) ARGV
+            client: (Pipeline) 在 pipeline 中执行时传入
+        Returns:
+            脚本返回值
+        """
+        return self.get(name)(keys, args, client)
+
+    def call_many(self, name, calls):
+        """
+        在一个非事务 pipeline 中多次执行同一脚本(一次往返), 收到 NOSCRIPT 的调用在 SCRIPT LOAD 后重试
+
+        Args:
+            name : (String) 脚本名称
+            calls: (List) [(keys, args)]
+        Returns:
+            (List) 每次调用的返回值
+        Raises:
+            ResponseError: 脚本执行失败
+        """
+        script = self.get(name)
+        results = [None] * len(calls)
+        pending = range(len(calls))
+        for _ in range(2):
+            pipe = self._client.pipeline(transaction=False)
+            for index in pending:
+                keys, args = calls[index]
+                pipe.evalsha(script.sha, len(keys), *(list(keys) + list(args)))
+            retry = []
+            for index, result in zip(pending, pipe.execute(raise_on_error=False)):
+                if isinstance(result, NoScriptError):
+                    retry.append(index)
+                    continue
+                if isinstance(result, Exception):
+                    raise result
+                results[index] = result
+            if not retry:
+                return results
+            script.sha = self._client.script_load(script.script)
+            pending = retry
+        raise NoScriptError("script %s not loaded" % name)
+
+    def load(self):
+        """
+        预加载所有脚本(一次往返)
+
+        Returns:
+            (Dict) 脚本名称 => sha1
+        """
+        names = self.names()
+        pipe = self._client.pipeline(transaction=False)
+        for name in names:
+            pipe.script_load(self.get(name).script)
+        return dict(zip(names, pipe.execute()))
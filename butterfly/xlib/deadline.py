@@ -0,0 +1,152 @@
+# coding:utf8
+"""
+# File Name: deadline.py
+# Description:
+    请求 deadline
+
+    (1) WSGIGateway 根据请求头解析 deadline(Request.deadline), 并设置为线程内的 deadline:
+        X-Request-Timeout : 调用方愿意等待的时间(s), 从请求进入 server 队列时开始计算, eg: 1.5
+        X-Request-Deadline: 绝对时间, unix 时间戳(s), eg: 1634567890.123
+        均没有时使用 config.REQUEST_TIMEOUT(为 0 时没有 deadline)
+    (2) redis Connection / pymysql / http_util.RequestTool / nshead 在网络读写前按剩余时间缩短 socket 超时,
+        已超过 deadline 时抛出 DeadlineExceeded, 不再发送请求
+    (3) handler 因超过 deadline 失败时, acclog 中 stat 为 ERR_DEADLINE_EXCEEDED
+
+    没有设置 deadline 的线程(如百川 worker, 定时任务)不受影响
+
+    Examples:
+        from xlib import deadline
+        for item in items:
+            deadline.check()  # 长时间循环中主动检查
+            ...
+"""
+import time
+import threading
+import contextlib
+
+_local = threading.local()
+
+
+class DeadlineExceeded(Exception):
+    """
+    超过请求 deadline
+    """
+
+
+def parse_headers(wsgienv, start, default_timeout=0):
+    """
+    解析请求头中的 deadline
+
+    Args:
+        wsgienv        : (Dict) wsgi env
+        start          : (Float) 请求开始时间, X-Request-Timeout 从此时开始计算
+        default_timeout: (Float) 请求头中没有 deadline 时使用的超时时间(s), 为 0 时没有 deadline
+    Returns:
+        (Float) deadline(unix 时间戳), 没有 deadline 时返回 None
+    """
+    deadline = None
+    timeout = wsgienv.get("HTTP_X_REQUEST_TIMEOUT")
+    if timeout:
+        try:
+            deadline = start + float(timeout)
+        except ValueError:
+            pass
+    absolute = wsgienv.get("HTTP_X_REQUEST_DEADLINE")
+    if absolute:
+        try:
+            absolute = float(absolute)
+        except ValueError:
+            pass
+        else:
+            deadline = absolute if deadline is None else min(deadline, absolute)
+    if deadline is None and default_timeout:
+        deadline = start + default_timeout
+    return deadline
+
+
+def set_deadline(deadline):
+    """
+    设置当前线程的 deadline
+
+    Args:
+        deadline: (Float) unix 时间戳, 为 None 时清除
+    """
+    _local.deadline = deadline
+
+
+def get_deadline():
+    """
+    Returns:
+        (Float) 当前线程的 deadline, 没有时返回 None
+    """
+    return getattr(_local, "deadline", None)
+
+
+def remaining():
+    """
+    Returns:
+        (Float) 距 deadline 的剩余时间(s), 可能为负数; 没有 deadline 时返回 None
+    """
+    deadline = getattr(_local, "deadline", None)
+    if deadline is None:
+        return None
+    return deadline - time.time()
+
+
+def expired():
+    """
+    Returns:
+        (Bool) 是否已超过 deadline
+    """
+    deadline = getattr(_local, "deadline", None)
+    return deadline is not None and time.time() >= deadline
+
+
+def check():
+    """
+    Raises:
+        DeadlineExceeded: 已超过 deadline
+    """
+    if expired():
+        raise DeadlineExceeded("request deadline exceeded")
+
+
+def shrink_timeout(timeout):
+    """
+    按剩余时间缩短超时
+
+    Args:
+        timeout: (Float) socket 超时(s), None 表示不超时
+    Returns:
+        (Float) min(timeout, 剩余时间), 没有 deadline 时原样返回
+    Raises:
+        DeadlineExceeded: 已超过 deadline
+    """
+    deadline = getattr(_local, "deadline", None)
+    if deadline is None:
+        return timeout
+    left = deadline - time.time()
+    if left <= 0:
+        raise DeadlineExceeded("request deadline exceeded")
+    if timeout is None or left < timeout:
+        return left
+    return timeout
+
+
+@contextlib.contextmanager
+def socket_timeout(sock):
+    """
+    有 deadline 时, 在 with 内按剩余时间缩短 sock 的超时, 结束后恢复
+
+    Raises:
+        DeadlineExceeded: 已超过 deadline
+    """
+    if getattr(_local, "deadline", None) is None:
+        yield
+        return
+    old = sock.gettimeout()
+    sock.settimeout(shrink_timeout(old))
+    try:
+        yield
+    finally:
+        sock.settimeout(old)
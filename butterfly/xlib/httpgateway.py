@@ -14,10 +14,20 @@ import urlparse
 import time
 import httplib
 import inspect
+import uuid
+import mimetypes
+import email.utils
+import hashlib
+import tempfile
+import threading
+from wsgiref.util import FileWrapper
 
 import xlib
 import xlib.uuid64
 import xlib.logger
+from xlib import retstat
+from xlib import deadline
+from xlib import multipart
 
 
 def parse_cookie(cookie):
@@ -40,6 +50,381 @@ def parse_cookie(cookie):
     return r
 
 
+# 文件响应每次读取/发送的块大小
+FILE_BLOCK_SIZE = 64 * 1024
+
+
+def wrap_file(wsgienv, fileobj, blksize=FILE_BLOCK_SIZE):
+    """
+    将文件对象封装为 WSGI 响应 body, 按块发送, 不将文件内容全部读入内存
+
+    优先使用 server 提供的 wsgi.file_wrapper(CherryPyWSGIServer 会使用 sendfile 发送),
+    响应发送完成后由 server 关闭文件
+
+    Args:
+        wsgienv: (Dict) wsgi env
+        fileobj: (File) 已打开的文件对象
+        blksize: (Int) 块大小
+    Returns:
+        可迭代的 file wrapper
+    """
+    file_wrapper = wsgienv.get("wsgi.file_wrapper") or FileWrapper
+    return file_wrapper(fileobj, blksize)
+
+
+# 请求 body 不超过此大小时保存在内存中, 超过时写入临时文件(Request.body_file)
+BODY_SPOOL_SIZE = 1024 * 1024
+
+
+class StreamHasher(object):
+    """
+    增量计算数据大小及 hash, 用于流式读取请求 body 时校验
+
+    Attributes:
+        size: (Int) 数据大小
+    Examples:
+        hasher = StreamHasher(("md5", "sha1"))
+        for chunk in req.iter_body():
+            hasher.update(chunk)
+        hasher.hexdigests()  # {"md5": "...", "sha1": "..."}
+    """
+
+    def __init__(self, hash_names=("md5",)):
+        """
+        Args:
+            hash_names: (Tuple) hashlib 支持的算法名
+        """
+        self.size = 0
+        self._hashes = [(name, hashlib.new(name)) for name in hash_names]
+
+    def update(self, chunk):
+        """
+        追加数据
+        """
+        self.size += len(chunk)
+        for _, h in self._hashes:
+            h.update(chunk)
+
+    def hexdigests(self):
+        """
+        Returns:
+            (Dict) 算法名 => hex digest
+        """
+        return dict((name, h.hexdigest()) for name, h in self._hashes)
+
+
+# 单个请求中 Range 的最大个数, 超过时忽略 Range 返回完整文件
+MAX_RANGES = 32
+
+
+def parse_http_date(date_str):
+    """
+    解析 HTTP 日期(如 If-Modified-Since)
+
+    Args:
+        date_str: (String) eg.: "Sun, 06 Nov 1994 08:49:37 GMT"
+    Returns:
+        timestamp(Int), 格式不合法时返回 None
+    """
+    try:
+        return int(email.utils.mktime_tz(email.utils.parsedate_tz(date_str)))
+    except (TypeError, ValueError, OverflowError):
+        return None
+
+
+def parse_range(range_header, size):
+    """
+    解析 Range 请求头
+
+    Args:
+        range_header: (String) eg.: "bytes=0-499,-500"
+        size        : (Int) 文件大小
+    Returns:
+        None : 格式不合法或非 bytes 单位, 应忽略 Range
+        []   : 没有可满足的范围, 应返回 416
+        [(start, end), ...]: 字节范围(包含 end)
+    """
+    unit, _, specs = range_header.partition("=")
+    if unit.strip().lower() != "bytes":
+        return None
+
+    specs = [spec.strip() for spec in specs.split(",") if spec.strip()]
+    if not specs or len(specs) > MAX_RANGES:
+        return None
+
+    ranges = []
+    for spec in specs:
+        start, sep, end = spec.partition("-")
+        start, end = start.strip(), end.strip()
+        if (not sep or not (start or end)
+                or (start and not start.isdigit()) or (end and not end.isdigit())):
+            return None
+        if not start:
+            # 后缀范围: 最后 n 个字节
+            length = int(end)
+            if length and size:
+                ranges.append((max(size - length, 0), size - 1))
+            continue
+        start = int(start)
+        if end and int(end) < start:
+            return None
+        if start < size:
+            ranges.append((start, min(int(end), size - 1) if end else size - 1))
+    return ranges
+
+
+def is_not_modified(wsgienv, etag, mtime):
+    """
+    条件请求: If-None-Match 优先, 其次 If-Modified-Since
+
+    Args:
+        wsgienv: (Dict) wsgi env
+        etag   : (String) 资源当前的 ETag
+        mtime  : (Int) 资源修改时间
+    Returns:
+        True 时应返回 304
+    """
+    if_none_match = wsgienv.get("HTTP_IF_NONE_MATCH")
+    if if_none_match:
+        if if_none_match.strip() == "*":
+            return True
+        # If-None-Match 使用弱比较
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        return etag in [tag[2:] if tag.startswith("W/") else tag for tag in tags]
+
+    if_modified_since = wsgienv.get("HTTP_IF_MODIFIED_SINCE")
+    if if_modified_since:
+        since = parse_http_date(if_modified_since)
+        return since is not None and mtime <= since
+    return False
+
+
+def _if_range_matches(wsgienv, etag, mtime):
+    """
+    If-Range 不匹配时(资源已变化)忽略 Range, 返回完整文件
+    """
+    if_range = wsgienv.get("HTTP_IF_RANGE")
+    if not if_range:
+        return True
+    if_range = if_range.strip()
+    if if_range.startswith('"') or if_range.startswith("W/"):
+        # If-Range 使用强比较
+        return if_range == etag
+    return parse_http_date(if_range) == mtime
+
+
+class RangeFile(object):
+    """
+    文件的 [offset, offset + length) 区间
+
+    提供 read/fileno/tell, 封装为 wsgi.file_wrapper 后仍可以使用 sendfile 发送
+    """
+
+    def __init__(self, fileobj, offset, length):
+        fileobj.seek(offset)
+        self._file = fileobj
+        self._remaining = length
+
+    def read(self, size=-1):
+        """
+        最多读取到区间末尾
+        """
+        if size < 0 or size > self._remaining:
+            size = self._remaining
+        if size <= 0:
+            return ""
+        data = self._file.read(size)
+        self._remaining -= len(data)
+        return data
+
+    def fileno(self):
+        """
+        file fd
+        """
+        return self._file.fileno()
+
+    def tell(self):
+        """
+        当前位置
+        """
+        return self._file.tell()
+
+    def close(self):
+        """
+        关闭文件
+        """
+        self._file.close()
+
+
+class MultiRangeBody(object):
+    """
+    multipart/byteranges 响应 body, 按块读取文件
+    """
+
+    def __init__(self, fileobj, ranges, size, content_type, blksize=FILE_BLOCK_SIZE):
+        self.boundary = uuid.uuid4().hex
+        self._file = fileobj
+        self._blksize = blksize
+        self._parts = []
+        for start, end in ranges:
+            part_head = ("--{boundary}\r\nContent-Type: {content_type}\r\n"
+                         "Content-Range: bytes {start}-{end}/{size}\r\n\r\n".format(
+                             boundary=self.boundary, content_type=content_type,
+                             start=start, end=end, size=size))
+            self._parts.append((part_head, start, end - start + 1))
+        self._tail = "--{boundary}--\r\n".format(boundary=self.boundary)
+        self.content_length = sum(len(head) + length + 2 for head, _, length in self._parts) + len(self._tail)
+
+    def __iter__(self):
+        for part_head, start, length in self._parts:
+            yield part_head
+            part = RangeFile(self._file, start, length)
+            data = part.read(self._blksize)
+            while data:
+                yield data
+                data = part.read(self._blksize)
+            yield "\r\n"
+        yield self._tail
+
+    def close(self):
+        """
+        关闭文件
+        """
+        self._file.close()
+
+
+def file_validators(ino, size, mtime):
+    """
+    文件的校验信息
+
+    Args:
+        ino  : (Int) inode
+        size : (Int) 文件大小
+        mtime: (Int) 修改时间
+    Returns:
+        etag(String), headers(List): ETag/Last-Modified/Accept-Ranges
+    """
+    etag = '"%x-%x-%x"' % (ino, size, mtime)
+    return etag, [("ETag", etag),
+                  ("Last-Modified", email.utils.formatdate(mtime, usegmt=True)),
+                  ("Accept-Ranges", "bytes")]
+
+
+def accepts_gzip(wsgienv):
+    """
+    Accept-Encoding 是否允许 gzip
+
+    Args:
+        wsgienv: (Dict) wsgi env
+    Returns:
+        Bool
+    """
+    for item in wsgienv.get("HTTP_ACCEPT_ENCODING", "").split(","):
+        coding, _, params = item.partition(";")
+        if coding.strip().lower() not in ("gzip", "x-gzip", "*"):
+            continue
+        params = params.strip().replace(" ", "")
+        if params.startswith("q="):
+            try:
+                return float(params[2:]) > 0
+            except ValueError:
+                return False
+        return True
+    return False
+
+
+def cached_file_response(wsgienv, entry):
+    """
+    缓存的静态文件响应(见 xlib.static_cache), 与 file_response 返回相同的校验信息,
+    Accept-Encoding 允许时返回 gzip 压缩后的内容
+
+    Args:
+        wsgienv: (Dict) wsgi env
+        entry  : (Object) xlib.static_cache.Entry
+    Returns:
+        http_code(Int), headers(List), content
+    """
+    etag, headers = file_validators(entry.ino, entry.size, entry.mtime)
+    data = entry.data
+    if entry.gzip_data is not None:
+        headers.append(("Vary", "Accept-Encoding"))
+        if accepts_gzip(wsgienv):
+            data = entry.gzip_data
+            # 不同编码的内容使用不同的 ETag
+            etag = etag[:-1] + '-gz"'
+            headers[0] = ("ETag", etag)
+            headers.append(("Content-Encoding", "gzip"))
+
+    if wsgienv.get("REQUEST_METHOD", "GET") in ("GET", "HEAD") and is_not_modified(wsgienv, etag, entry.mtime):
+        return 304, headers, ""
+
+    if entry.content_type:
+        headers.append(("Content-Type", entry.content_type))
+    headers.append(("Content-Length", str(len(data))))
+    return 200, headers, [data]
+
+
+def file_response(wsgienv, file_path, content_type=None):
+    """
+    文件响应: 校验信息(ETag/Last-Modified), 条件请求(304)及 Range 请求(206/416)
+
+    ETag 由文件 inode, 大小及修改时间生成. 文件内容通过 wrap_file 按块(或 sendfile)发送,
+    多个 Range 时返回 multipart/byteranges
+
+    Args:
+        wsgienv     : (Dict) wsgi env
+        file_path   : (String) 文件路径
+        content_type: (String) Content-Type, 为 None 时不返回 Content-Type 头
+    Returns:
+        http_code(Int), headers(List), content
+    Raises:
+        IOError/OSError: 打开文件失败
+    """
+    f = open(file_path, "rb")
+    try:
+        stats = os.fstat(f.fileno())
+        size = stats.st_size
+        mtime = int(stats.st_mtime)
+        etag, headers = file_validators(stats.st_ino, size, mtime)
+
+        method = wsgienv.get("REQUEST_METHOD", "GET")
+        if method in ("GET", "HEAD") and is_not_modified(wsgienv, etag, mtime):
+            f.close()
+            return 304, headers, ""
+
+        ranges = None
+        range_header = wsgienv.get("HTTP_RANGE")
+        if range_header and method == "GET" and _if_range_matches(wsgienv, etag, mtime):
+            ranges = parse_range(range_header, size)
+
+        if ranges is None:
+            if content_type:
+                headers.append(("Content-Type", content_type))
+            headers.append(("Content-Length", str(size)))
+            return 200, headers, wrap_file(wsgienv, f)
+
+        if not ranges:
+            f.close()
+            headers.append(("Content-Range", "bytes */%d" % size))
+            return 416, headers, ""
+
+        if len(ranges) == 1:
+            start, end = ranges[0]
+            if content_type:
+                headers.append(("Content-Type", content_type))
+            headers.append(("Content-Range", "bytes %d-%d/%d" % (start, end, size)))
+            headers.append(("Content-Length", str(end - start + 1)))
+            return 206, headers, wrap_file(wsgienv, RangeFile(f, start, end - start + 1))
+
+        body = MultiRangeBody(f, ranges, size, content_type or "application/octet-stream")
+        headers.append(("Content-Type", "multipart/byteranges; boundary=%s" % body.boundary))
+        headers.append(("Content-Length", str(body.content_length)))
+        return 206, headers, body
+    except BaseException:
+        f.close()
+        raise
+
+
 class Request(object):
     """Request Class
 
@@ -53,12 +438,19 @@ class Request(object):
         log_talk    : (Dict)
         log_ret     : (Dict)
         funcname    : (String)
+        path_params : (Dict) 动态路由的路径参数, 静态路由时为 None
+        deadline    : (Float) 请求 deadline(unix 时间戳), 见 xlib.deadline, 没有时为 None
         error_str   : (String)
         error_detail: (String)
         init_tm     : (Float) time.time()
         _tm         : (Float)
+        body_spool_size: (Int) 请求 body 不超过此大小时 body_file 保存在内存中, 超过时写入临时文件
+        _body_consumed : (Bool) wsgi.input 是否已读取
+        _body_file     : (File) body_file 缓存的请求 body
+        _multipart     : (List) parse_multipart 的解析结果
 
     """
+    body_spool_size = BODY_SPOOL_SIZE
 
     def __init__(self, reqid, wsgienv, ip):
         """
@@ -76,11 +468,16 @@ class Request(object):
         self.log_ret_code = ""
         self.log_res = set()
         self.funcname = ""
+        self.path_params = None
+        self.deadline = None
         self.error_str = ""
         self.error_detail = ""
         self.init_tm = time.time()
         self._tm = self.init_tm
         self.username = "-"
+        self._body_consumed = False
+        self._body_file = None
+        self._multipart = None
 
     def log(self, logger, logline):
         """butterfly req log
@@ -94,6 +491,134 @@ class Request(object):
         _logline = "%s %s" % (self.reqid, logline)
         logger.log(_logline)
 
+    def content_length(self):
+        """
+        请求 body 大小
+
+        Returns:
+            (Int), 没有 Content-Length 时(如 chunked)返回 None
+        """
+        content_length = self.wsgienv.get("CONTENT_LENGTH")
+        return int(content_length) if content_length else None
+
+    def iter_body(self, chunk_size=FILE_BLOCK_SIZE):
+        """
+        流式读取请求 body, 内存占用不超过 chunk_size
+        wsgi.input 只能读取一次, 需要多次读取时使用 body_file()
+
+        Args:
+            chunk_size: (Int) 每次读取的大小
+        Yields:
+            (String) 数据块
+        Raises:
+            IOError   : 客户端发送的数据少于 Content-Length
+            ValueError: wsgi.input 已被读取
+        """
+        if self._body_file is not None:
+            self._body_file.seek(0)
+            while True:
+                chunk = self._body_file.read(chunk_size)
+                if not chunk:
+                    return
+                yield chunk
+
+        if self._body_consumed:
+            raise ValueError("request body already consumed")
+        self._body_consumed = True
+
+        stream = self.wsgienv.get("wsgi.input")
+        remaining = self.content_length()
+        if stream is None:
+            return
+        if remaining is None and "chunked" not in self.wsgienv.get("HTTP_TRANSFER_ENCODING", "").lower():
+            # 没有 body, 不能读取 wsgi.input(会一直阻塞到客户端断开)
+            return
+
+        while remaining is None or remaining > 0:
+            chunk = stream.read(chunk_size if remaining is None else min(chunk_size, remaining))
+            if not chunk:
+                if remaining:
+                    raise IOError("request body truncated, {remaining} bytes missing".format(remaining=remaining))
+                return
+            if remaining is not None:
+                remaining -= len(chunk)
+            yield chunk
+
+    def body_file(self, chunk_size=FILE_BLOCK_SIZE):
+        """
+        读取请求 body 到文件对象, 不超过 body_spool_size 时在内存中, 超过时写入临时文件(关闭后自动删除)
+
+        Returns:
+            (File) 可多次 read/seek 的文件对象, 位置为 0
+        """
+        if self._body_file is None:
+            body_file = tempfile.SpooledTemporaryFile(max_size=self.body_spool_size)
+            for chunk in self.iter_body(chunk_size):
+                body_file.write(chunk)
+            self._body_file = body_file
+        self._body_file.seek(0)
+        return self._body_file
+
+    def body_to_file(self, path, hash_names=("md5",), chunk_size=FILE_BLOCK_SIZE):
+        """
+        流式保存请求 body 到文件, 同时计算 hash, 失败时删除已写入的文件
+
+        Args:
+            path      : (String) 文件路径
+            hash_names: (Tuple) hashlib 支持的算法名
+            chunk_size: (Int) 每次读取的大小
+        Returns:
+            (Dict) {"size": 大小, "md5": hex digest, ...}
+        """
+        hasher = StreamHasher(hash_names)
+        try:
+            with open(path, "wb") as f:
+                for chunk in self.iter_body(chunk_size):
+                    hasher.update(chunk)
+                    f.write(chunk)
+        except BaseException:
+            if os.path.exists(path):
+                os.remove(path)
+            raise
+        ret = hasher.hexdigests()
+        ret["size"] = hasher.size
+        return ret
+
+    def parse_multipart(self, hash_names=("md5",), max_field_size=multipart.MAX_FIELD_SIZE, spool_dir=None):
+        """
+        流式解析 multipart/form-data 请求 body, 文件字段写入临时文件, 请求结束后(close)删除未 save 的临时文件
+
+        Args:
+            hash_names    : (Tuple) 文件字段计算的 hash(hashlib 支持的算法名)
+            max_field_size: (Int) 普通字段的最大大小
+            spool_dir     : (String) 临时文件目录, 为 None 时使用系统临时目录
+        Returns:
+            (List) [(name, value)], 普通字段的 value 为 str, 文件字段的 value 为 multipart.UploadFile;
+            不是 multipart/form-data 请求时返回 None
+        Raises:
+            multipart.MultipartError: 格式错误或超出限制
+            IOError: 客户端发送的数据少于 Content-Length
+        """
+        if self._multipart is None:
+            boundary = multipart.get_boundary(self.wsgienv.get("CONTENT_TYPE"))
+            if boundary is None:
+                return None
+            self._multipart = multipart.parse(self.iter_body(), boundary, hash_names=hash_names,
+                                              max_field_size=max_field_size, spool_dir=spool_dir)
+        return self._multipart
+
+    def close(self):
+        """
+        请求处理结束, 释放 body_file 及 parse_multipart 的临时文件
+        """
+        if self._body_file is not None:
+            self._body_file.close()
+            self._body_file = None
+        if self._multipart:
+            for _, value in self._multipart:
+                if isinstance(value, multipart.UploadFile):
+                    value.remove()
+
     def start_timming(self):
         """set _tm"""
         self._tm = time.time()
@@ -127,12 +652,17 @@ class WSGIGateway(object):
     """WSGIGateway class
     Attributes:
         _protocols: (Dict) api 字典
+        _router: (Object) xlib.urls.Router, 不为 None 时使用 Router 匹配路由(支持动态路由及 HTTP 方法限制)
         _apiname_getter: (Func)根据 URL 获取到的函数名
         _acclog: (Object) Log class
         _errlog: (Object) Log class
         _uuid64: (Object)
         _static_path: (String) static path
         _static_prefix: (String) static prefix
+        _static_cache: (Object) xlib.static_cache.StaticCache, 为 None 时不缓存静态文件
+        _body_spool_size: (Int) 请求 body 不超过此大小时 Request.body_file 保存在内存中, 为 None 时使用 BODY_SPOOL_SIZE
+        _request_timeout: (Float) 请求头中没有 deadline 时的默认超时(s), 为 0 时没有 deadline
+        load_shed_count: (Int) 因排队超时返回 503 的请求数
     """
 
     def __init__(self,
@@ -142,9 +672,16 @@ class WSGIGateway(object):
                  protocols,
                  static_path="",
                  static_prefix=None,
-                 header_username="HTTP_X_USERNAME"
+                 header_username="HTTP_X_USERNAME",
+                 static_cache=None,
+                 router=None,
+                 body_spool_size=None,
+                 request_timeout=0
                  ):
         self._protocols = protocols
+        self._router = router
+        self._body_spool_size = body_spool_size
+        self._request_timeout = request_timeout
         self._apiname_getter = funcname_getter
         self._acclog = acclog
         self._errlog = errlog
@@ -152,7 +689,31 @@ class WSGIGateway(object):
         self._static_path = static_path
         self._static_prefix = static_prefix
         self._header_username = header_username
+        self._static_cache = static_cache
         self._version = xlib.butterfly_version
+        self.load_shed_count = 0
+        # 多个工作线程同时返回 503 时计数
+        self._load_shed_lock = threading.Lock()
+
+    def reinit_after_fork(self):
+        """
+        多进程模式下, fork 后在子进程中调用
+        """
+        self._uuid64.reinit_after_fork()
+        self.load_shed_count = 0
+        self._load_shed_lock = threading.Lock()
+
+    def stats(self):
+        """
+        gateway 统计
+
+        Returns:
+            (Dict)
+        """
+        stats = {"load_shed_count": self.load_shed_count}
+        if self._static_cache is not None:
+            stats["static_cache"] = self._static_cache.stats()
+        return stats
 
     def process(self, wsgienv):
         """Process wsgienv
@@ -168,6 +729,8 @@ class WSGIGateway(object):
         xlib.logger.butterfly_local.reqid = reqid
 
         req = Request(reqid, wsgienv, ip)
+        if self._body_spool_size is not None:
+            req.body_spool_size = self._body_spool_size
         try:
             # 当使用 nginx ，可在 nginx 上配置 "proxy_set_header X-Real-IP  $remote_addr;" 获取真实源 IP
             ip = wsgienv.get("HTTP_X_REAL_IP") or wsgienv.get("REMOTE_ADDR")
@@ -178,6 +741,15 @@ class WSGIGateway(object):
             # 获取不到时，值为 "-", 用于日志统计
             req.username = wsgienv.get(self._header_username) or "-"
 
+            # 请求在 server 队列中的等待耗时, 以及过载时是否丢弃(见 cherrypy_wsgiserver.QueueDelayShedder)
+            queue_delay = wsgienv.get("cherrypy.queue_delay")
+            if queue_delay:
+                req.log_talk["queue"] = queue_delay * 1000
+            retry_after = wsgienv.get("cherrypy.load_shed")
+            if retry_after:
+                req.funcname = self._apiname_getter(wsgienv)
+                return self._mk_load_shed_ret(req, retry_after)
+
             # 如果匹配到静态文件前缀，就会返回静态文件
             file_path = self._try_to_handler_static(wsgienv)
             if file_path:
@@ -185,21 +757,56 @@ class WSGIGateway(object):
 
             funcname = self._apiname_getter(wsgienv)
             req.funcname = funcname
-            protocol = self._protocols.get(funcname)
+            if self._router is None:
+                protocol = self._protocols.get(funcname)
+            else:
+                route, path_params, allowed = self._router.match(funcname, wsgienv.get("REQUEST_METHOD"))
+                if allowed:
+                    return self._mk_method_not_allowed_ret(req, allowed)
+                protocol = route.protocol if route else None
+                if path_params:
+                    # 动态路由按注册的路径记录 acclog, 便于统计
+                    req.funcname = route.pattern
+                    req.path_params = path_params
             if not protocol:
                 return self._mk_err_ret(req, 400, "API Not Found", "")
 
+            # 请求 deadline, X-Request-Timeout 从请求进入 server 队列时开始计算
+            req.deadline = deadline.parse_headers(wsgienv, req.init_tm - (queue_delay or 0), self._request_timeout)
+
         except BaseException:
             return self._mk_err_ret(
                 req, 400, "Get API Exception", "Get API Exception %s" % traceback.format_exc())
 
+        if req.deadline is not None and time.time() >= req.deadline:
+            return self._mk_deadline_ret(req)
+
+        # 路由并发限制(funcattr.max_concurrency)
+        bulkhead = getattr(protocol, "bulkhead", None)
+        if bulkhead is not None:
+            wait_start = time.time()
+            if not bulkhead.acquire():
+                return self._mk_concurrency_limit_ret(req)
+            if bulkhead.queue_timeout:
+                req.log_talk["bulkhead"] = (time.time() - wait_start) * 1000
+
+        # handler 中访问 redis/mysql/http 时按剩余时间缩短超时
+        deadline.set_deadline(req.deadline)
         try:
             httpstatus, headers, content = protocol(req)
             # httpstatus, headers, content = "200 OK", [], ""
         except BaseException:
+            if bulkhead is not None:
+                bulkhead.release()
             return self._mk_err_ret(
                 req, 500, "API Processing Error", "API Processing Error %s" % traceback.format_exc())
+        finally:
+            deadline.set_deadline(None)
+            req.close()
 
+        if bulkhead is not None:
+            # 流式响应在发送完成(close)后释放
+            content = on_close(content, bulkhead.release)
         return self._mk_ret(req, httpstatus, headers, content)
 
     def _mk_err_ret(self, req, err_code, err_msg, log_msg):
@@ -219,6 +826,67 @@ class WSGIGateway(object):
         status_line = "%s %s" % (err_code, httplib.responses.get(err_code, ""))
         return self._mk_ret(req, status_line, [], "")
 
+    def _mk_method_not_allowed_ret(self, req, allowed):
+        """405 return
+        Args:
+            req    : (Object) req
+            allowed: (List) 允许的 HTTP 方法
+        Returns:
+            _mk_ret
+        """
+        req.log_ret_code = 405
+        req.error_str = "Method Not Allowed"
+        status_line = "405 %s" % httplib.responses[405]
+        return self._mk_ret(req, status_line, [("Allow", ", ".join(allowed))], "")
+
+    def _mk_load_shed_ret(self, req, retry_after):
+        """load shedding return
+
+        排队耗时过长的请求不再执行 handler, 直接返回 503, acclog 中 stat 为 ERR_LOAD_SHED
+        Args:
+            req        : (Object) req
+            retry_after: (Int) Retry-After 秒数
+        Returns:
+            _mk_ret
+        """
+        with self._load_shed_lock:
+            self.load_shed_count += 1
+        req.log_ret_code = retstat.ERR_LOAD_SHED
+        req.error_str = "Load Shed"
+        status_line = "%s %s" % (retstat.HTTP_SERVICE_UNAVAILABLE,
+                                 httplib.responses.get(retstat.HTTP_SERVICE_UNAVAILABLE, ""))
+        return self._mk_ret(req, status_line, [("Retry-After", str(retry_after))], "")
+
+    def _mk_concurrency_limit_ret(self, req):
+        """concurrency limit return
+
+        路由并发数已达上限(funcattr.max_concurrency), 不执行 handler, 直接返回 503, acclog 中 stat 为 ERR_CONCURRENCY_LIMIT
+        Args:
+            req: (Object) req
+        Returns:
+            _mk_ret
+        """
+        req.log_ret_code = retstat.ERR_CONCURRENCY_LIMIT
+        req.error_str = "Concurrency Limit"
+        status_line = "%s %s" % (retstat.HTTP_SERVICE_UNAVAILABLE,
+                                 httplib.responses.get(retstat.HTTP_SERVICE_UNAVAILABLE, ""))
+        return self._mk_ret(req, status_line, [("Retry-After", "1")], "")
+
+    def _mk_deadline_ret(self, req):
+        """deadline exceeded return
+
+        请求到达 handler 前已超过 deadline(如排队耗时过长), 不执行 handler, 直接返回 504, acclog 中 stat 为 ERR_DEADLINE_EXCEEDED
+        Args:
+            req: (Object) req
+        Returns:
+            _mk_ret
+        """
+        req.log_ret_code = retstat.ERR_DEADLINE_EXCEEDED
+        req.error_str = "Deadline Exceeded"
+        status_line = "%s %s" % (retstat.HTTP_GATEWAY_TIMEOUT,
+                                 httplib.responses.get(retstat.HTTP_GATEWAY_TIMEOUT, ""))
+        return self._mk_ret(req, status_line, [], "")
+
     def _mk_ret(self, req, httpstatus, headers, content):
         """normal return
         Args:
@@ -277,19 +945,25 @@ class WSGIGateway(object):
         """
         req.funcname = file_path
 
+        # Range 请求直接读文件
+        if self._static_cache is not None and not req.wsgienv.get("HTTP_RANGE"):
+            entry = self._static_cache.get(file_path)
+            if entry is not None:
+                code, headers, content = cached_file_response(req.wsgienv, entry)
+                req.log_ret_code = code
+                req.log_res.add("static_cache=hit")
+                httpstatus = "%s %s" % (code, httplib.responses.get(code, ""))
+                return self._mk_ret(req, httpstatus, headers, content)
+
         if not os.path.exists(file_path):
             return self._mk_err_ret(
                 req, 404, "File Not Found", "File Not Found,path:{file_path}".format(file_path=file_path))
 
-        httpstatus = "200 OK"
-        headers = []
-        req.log_ret_code = 200
         try:
-            with open(file_path, "r") as f:
-                data = f.read()
-                headers.append(("Content-Length", str(len(data))))
-                data = [data]
-                return self._mk_ret(req, httpstatus, headers, data)
+            code, headers, content = file_response(req.wsgienv, file_path, mimetypes.guess_type(file_path)[0])
+            req.log_ret_code = code
+            httpstatus = "%s %s" % (code, httplib.responses.get(code, ""))
+            return self._mk_ret(req, httpstatus, headers, content)
         except BaseException:
             return self._mk_err_ret(
                 req, 500, "Read File Error", "Read File Error %s" % traceback.format_exc())
@@ -381,6 +1055,122 @@ def check_param(func, params):
     return True
 
 
+class ParamTypeError(ValueError):
+    """
+    请求参数无法转换为 handler 指定的类型
+    """
+    pass
+
+
+def _to_bool(value):
+    """
+    "true"/"1"/"yes"/"on" => True, "false"/"0"/"no"/"off"/"" => False
+    """
+    lower = value.lower()
+    if lower in ("true", "1", "yes", "on"):
+        return True
+    if lower in ("false", "0", "no", "off", ""):
+        return False
+    raise ValueError("invalid bool value: %r" % value)
+
+
+def _to_list(value):
+    """
+    单个参数值 => [value], 同名参数多次出现时 httpget2dict 已返回 list
+    """
+    return [value]
+
+
+# 类型提示 => 转换函数
+_COERCERS = {
+    int: int,
+    float: float,
+    bool: _to_bool,
+    list: _to_list,
+}
+
+
+class ParamSchema(object):
+    """
+    handler 参数描述, 注册路由时生成一次, 请求时不再对 handler 进行 inspect
+
+    Attributes:
+        args     : (Tuple) handler 参数名(有序, 包含 req)
+        arg_set  : (frozenset) handler 参数名
+        required : (frozenset) 没有默认值的参数名
+        defaults : (Dict) 参数默认值
+        coercers : (Tuple) ((参数名, 类型, 转换函数), ...)
+                 : (1) 默认值为 int/float 的参数, 按默认值类型转换
+                 : (2) funcattr.params 中指定的类型(int/float/bool/list 或任意 callable)
+    """
+    __slots__ = ("args", "arg_set", "required", "defaults", "coercers")
+
+    def __init__(self, func):
+        """
+        Args:
+            func: hander 方法
+        """
+        args_count = func.func_code.co_argcount - \
+            1 if inspect.ismethod(func) else func.func_code.co_argcount
+        args = func.func_code.co_varnames[:args_count]
+        func_defaults = func.func_defaults or ()
+        if func_defaults:
+            defaults = dict(zip(args[-len(func_defaults):], func_defaults))
+        else:
+            defaults = {}
+
+        hints = {}
+        for name, default in defaults.iteritems():
+            # bool 是 int 的子类, 默认值为 bool 时不自动转换(需通过 funcattr.params 指定)
+            if type(default) in (int, float):
+                hints[name] = type(default)
+        hints.update(getattr(func, "paramattr", {}))
+
+        coercers = []
+        for name in args:
+            if name in hints:
+                hint = hints[name]
+                coercers.append((name, hint, _COERCERS.get(hint, hint)))
+
+        self.args = args
+        self.arg_set = frozenset(args)
+        self.required = frozenset(args[:len(args) - len(func_defaults)])
+        self.defaults = defaults
+        self.coercers = tuple(coercers)
+
+    def check(self, params):
+        """
+        检查请求参数与 handler 参数是否一致
+
+        Args:
+            params: (Dict) 请求参数
+        Returns:
+            True/False
+        """
+        keys = params.viewkeys()
+        return self.required <= keys and keys <= self.arg_set
+
+    def coerce(self, params):
+        """
+        按类型提示转换请求参数, 仅转换字符串类型的参数值(query string),
+        JSON body 中的参数已带有类型, 不做转换
+
+        Args:
+            params: (Dict) 请求参数, 原地修改
+        Raises:
+            ParamTypeError: 参数值无法转换
+        """
+        for name, hint, coercer in self.coercers:
+            value = params.get(name)
+            if not isinstance(value, basestring):
+                continue
+            try:
+                params[name] = coercer(value)
+            except (TypeError, ValueError):
+                raise ParamTypeError("param {name} is not {type}: {value!r}".format(
+                    name=name, type=getattr(hint, "__name__", hint), value=value))
+
+
 def get_uri_tail_sec(uri):
     """
     获取 uri 最后一段 section
@@ -414,6 +1204,54 @@ def get_uri_head_sec(uri):
     return uri[i: j].encode("ascii")
 
 
+class _ClosingIterable(object):
+    """
+    为不能设置 close 属性的响应(如 generator)添加 close 回调
+    """
+
+    def __init__(self, iterable, close):
+        self._iterable = iterable
+        self.close = close
+
+    def __iter__(self):
+        return iter(self._iterable)
+
+
+def on_close(content, callback):
+    """
+    响应发送完成(server 调用 close)后执行 callback, 仅执行一次
+
+    已在内存中的响应(str/list/tuple)立即执行; wsgi.file_wrapper 对象保持原类型, 仍可使用 sendfile 发送
+    Args:
+        content : (Iterable) 响应 body
+        callback: (Function) 无参数
+    Returns:
+        响应 body
+    """
+    if content is None or isinstance(content, (basestring, list, tuple)):
+        callback()
+        return content
+
+    close = getattr(content, "close", None)
+    called = []
+
+    def _close():
+        if called:
+            return
+        called.append(True)
+        try:
+            if close is not None:
+                close()
+        finally:
+            callback()
+
+    try:
+        content.close = _close
+        return content
+    except (AttributeError, TypeError):
+        return _ClosingIterable(content, _close)
+
+
 def read_wsgi_post(wsgienv):
     """
     获取 post 数据
@@ -432,6 +1270,33 @@ def read_wsgi_post(wsgienv):
 def parse_multipart_raw(s):
     """
     获取 multipart/form-data 的raw data
+
+    已读取到内存中的 body 使用, 文件字段的内容同样返回为 str(不写入临时文件);
+    需要流式处理(大文件上传)时使用 Request.parse_multipart
+
+    字段值为两个 boundary 之间的原始数据, 不去掉首尾的空格;
+    换行不是 \r\n(仅 \n)或格式错误时, 按行解析(只支持单行的值, 去掉首尾的空格及换行), 返回可以解析的字段
+    Returns:
+        (Dict) name => value, 忽略空值
+    """
+    boundary = s[2:s.find("\n")].rstrip("\r") if s.startswith("--") else None
+    if not boundary or not s.startswith("--" + boundary + "\r\n"):
+        return _parse_multipart_lines(s)
+    try:
+        parts = multipart.parse((s[i: i + FILE_BLOCK_SIZE] for i in xrange(0, len(s), FILE_BLOCK_SIZE)), boundary,
+                                max_field_size=len(s), spool=False)
+    except multipart.MultipartError:
+        return _parse_multipart_lines(s)
+    ret = {}
+    for name, value in parts:
+        if value:
+            ret[name] = value
+    return ret
+
+
+def _parse_multipart_lines(s):
+    """
+    按行解析 multipart/form-data, 每个字段为 4 行(boundary, Content-Disposition, 空行, 值)
     """
     ret = {}
     lines = s.split("\n")
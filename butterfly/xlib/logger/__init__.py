@@ -3,15 +3,21 @@
 Log manage module
 """
 
+import sys
 import time
-import inspect
 import os
 import logging
 import logging.handlers
 import threading
+import weakref
+import atexit
+import collections
 
 DEBUG_VERBOSE = False
 
+# All LoggerBase instances, used by reinit_after_fork()
+_logger_instances = weakref.WeakSet()
+
 
 def set_debug_verbose(v=True):
     """
@@ -21,6 +27,198 @@ def set_debug_verbose(v=True):
     DEBUG_VERBOSE = v
 
 
+# writev 单次最多的 buffer 数
+IOV_MAX = 1024
+
+
+def _write_all(fd, data):
+    """
+    写入全部数据(处理部分写入)
+    """
+    while data:
+        written = os.write(fd, data)
+        data = data[written:]
+
+
+def _writev(fd, buffers):
+    """
+    一次系统调用写入多个 buffer, 没有 os.writev(Python 2)时合并后 write
+    """
+    if not hasattr(os, "writev"):
+        _write_all(fd, "".join(buffers))
+        return
+    for i in range(0, len(buffers), IOV_MAX):
+        chunk = buffers[i:i + IOV_MAX]
+        written = os.writev(fd, chunk)
+        if written < sum(len(buf) for buf in chunk):
+            _write_all(fd, "".join(chunk)[written:])
+
+
+class AsyncWriter(threading.Thread):
+    """
+    LoggerBase 后台写线程
+
+    请求线程仅将日志行放入有界的环形缓冲区, 由后台线程批量写入文件:
+    (1) 缓冲区中达到 flush_lines 行, 或距上次写入超过 flush_interval 秒时写入
+    (2) 缓冲区满时, block 为 False 则丢弃新日志(计入 dropped), 为 True 则等待
+    (3) fsync 为 None 时不调用 fsync, 为 0 时每次写入后 fsync, 为 N 时最多每 N 秒 fsync 一次
+    (4) 写入失败(如磁盘满)时不影响后续日志, 失败的日志行计入 failed, 第一次失败时记录到 failure_log
+
+    Attributes:
+        dropped : (Int) 缓冲区满时丢弃的日志行数
+        failed  : (Int) 写入失败的日志行数
+        written : (Int) 已写入的日志行数
+    """
+
+    def __init__(self, logger, queue_size=65536, flush_lines=512, flush_interval=0.5, fsync=None, block=False,
+                 failure_log=None):
+        """
+        Args:
+            logger        : (Object) LoggerBase
+            queue_size    : (Int) 缓冲区最多的日志行数
+            flush_lines   : (Int) 缓冲区达到此行数时写入
+            flush_interval: (Float) 最长写入间隔(s)
+            fsync         : (None/Float) fsync 策略
+            block         : (Bool) 缓冲区满时是否等待
+            failure_log   : (Object) 同步写入的 LoggerBase(如 critlog), 记录第一次写入失败
+        """
+        threading.Thread.__init__(self, name="LoggerWriter-%s" % os.path.basename(logger._path))
+        self.setDaemon(True)
+        self._logger = logger
+        self.queue_size = queue_size
+        self.flush_lines = flush_lines
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.block = block
+        self.failure_log = failure_log
+
+        self.dropped = 0
+        self.failed = 0
+        self.written = 0
+        self._buf = collections.deque()
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+        self._flushed = threading.Condition(self._lock)
+        self._put_seq = 0
+        self._written_seq = 0
+        self._flush_requested = False
+        self._stopped = False
+        self._last_fsync = time.time()
+
+    def put(self, line):
+        """
+        放入一行日志
+
+        Returns:
+            False: 缓冲区满, 日志被丢弃
+        """
+        with self._lock:
+            if self._stopped:
+                self.dropped += 1
+                return False
+            while len(self._buf) >= self.queue_size:
+                if not self.block or not self.is_alive():
+                    self.dropped += 1
+                    return False
+                self._not_full.wait(self.flush_interval)
+            self._buf.append(line)
+            self._put_seq += 1
+            if len(self._buf) == self.flush_lines:
+                self._not_empty.notify()
+        return True
+
+    def flush(self, timeout=None):
+        """
+        等待当前已放入的日志写入文件
+
+        Returns:
+            True: 已全部写入
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._lock:
+            seq = self._put_seq
+            self._flush_requested = True
+            self._not_empty.notify()
+            while self._written_seq < seq and self.is_alive():
+                remaining = 1 if deadline is None else deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self._flushed.wait(remaining)
+            return self._written_seq >= seq
+
+    def stop(self, timeout=5):
+        """
+        写入剩余日志后退出
+        """
+        with self._lock:
+            self._stopped = True
+            self._not_empty.notify()
+        if self.is_alive() and self is not threading.current_thread():
+            self.join(timeout)
+
+    def run(self):
+        last_flush = time.time()
+        while True:
+            with self._lock:
+                deadline = last_flush + self.flush_interval
+                while (len(self._buf) < self.flush_lines
+                       and not self._flush_requested and not self._stopped):
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        break
+                    self._not_empty.wait(remaining)
+                lines = list(self._buf)
+                self._buf.clear()
+                seq = self._put_seq
+                self._flush_requested = False
+                stopped = self._stopped
+                self._not_full.notify_all()
+
+            error = None
+            if lines:
+                try:
+                    self._logger._write_lines(lines)
+                    self._sync()
+                except BaseException as e:
+                    # 写日志失败(如磁盘满)不能影响后续日志
+                    error = e
+            last_flush = time.time()
+
+            with self._lock:
+                if error is None:
+                    self.written += len(lines)
+                else:
+                    self.failed += len(lines)
+                    report = self.failed == len(lines)
+                self._written_seq = seq
+                self._flushed.notify_all()
+            if error is not None and report:
+                self._report_failure(error, len(lines))
+            if stopped:
+                return
+
+    def _report_failure(self, error, lines):
+        """
+        第一次写入失败时记录到 failure_log, 之后的失败只计入 failed
+        """
+        if self.failure_log is None:
+            return
+        try:
+            self.failure_log.log("async_log_write_failed",
+                                 "path=%s lines=%s error=%r" % (self._logger._path, lines, error))
+        except BaseException:
+            pass
+
+    def _sync(self):
+        if self.fsync is None:
+            return
+        now = time.time()
+        if now - self._last_fsync >= self.fsync:
+            os.fsync(self._logger._fd)
+            self._last_fsync = now
+
+
 class LoggerBase(object):
     """Logger Class
     Attributes:
@@ -36,12 +234,30 @@ class LoggerBase(object):
         _writed_lines           : Record the number of log lines written. When the file is cleared by butterfly,
                                   the number of lines is cleared
         _fd                     : Log file fd
+        _writer                 : AsyncWriter, None when writing in the caller thread
+        _capture_caller         : Record the caller filename:lineno or not ("-")
+        _tm_cache               : (second, time.localtime(), "%Y-%m-%d %H:%M:%S\t{pid}"), refreshed once per second
+        _next_size_check        : _writed_lines at which the file size is checked next
 
     """
     # One line record about 200 bytes. 10000 records, about 2MB
     FILE_SIZE_CHECK_LINES = 10000
+    # After FILE_SIZE_CHECK_LINES, the file size is checked every SIZE_CHECK_EVERY_LINES lines
+    SIZE_CHECK_EVERY_LINES = 1000
 
-    def __init__(self, path, is_day_rolling, size_limit, batch_write):
+    def __init__(self, path, is_day_rolling, size_limit, batch_write, async_write=False, async_options=None,
+                 capture_caller=True, failure_log=None):
+        """
+        Args:
+            path            : Log file path
+            is_day_rolling  : Rotate log or not
+            size_limit      : How the size of the file reaches, the log file can be emptied
+            batch_write     : Write every batch_write lines (< 2: write every line), ignored when async_write
+            async_write     : Write in a background thread (AsyncWriter)
+            async_options   : AsyncWriter kwargs (queue_size/flush_lines/flush_interval/fsync/block)
+            capture_caller  : Record the caller filename:lineno, "-" if False (eg: acclog, always the same caller)
+            failure_log     : Synchronous LoggerBase (eg: critlog) for the first AsyncWriter write failure
+        """
         file_dir = os.path.dirname(path)
         if not os.path.isdir(file_dir):
             os.makedirs(file_dir)
@@ -56,8 +272,64 @@ class LoggerBase(object):
         self._curpath = ""
         self._tm = None
         self._writed_lines = 0
+        self._next_size_check = self.FILE_SIZE_CHECK_LINES
         self._fd = None
         self._lock = threading.Lock()
+        self._capture_caller = capture_caller
+        self._tm_cache = (None, None, None)
+        self._async_options = dict(async_options or {}, failure_log=failure_log)
+        self._writer = None
+        if async_write:
+            self._writer = AsyncWriter(self, **self._async_options)
+            self._writer.start()
+        _logger_instances.add(self)
+
+    def reinit_after_fork(self):
+        """
+        fork 后在子进程中调用: 更新 pid, 重新打开日志文件
+        """
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._batches = []
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+        self._tm = None
+        self._tm_cache = (None, None, None)
+        # 父进程缓冲区中的日志由父进程写入, 子进程使用新的写线程
+        if self._writer is not None:
+            self._writer = AsyncWriter(self, **self._async_options)
+            self._writer.start()
+
+    def flush(self, timeout=None):
+        """
+        写入缓冲中的日志(batch_write 或 AsyncWriter)
+        """
+        if self._writer is not None:
+            return self._writer.flush(timeout)
+        with self._lock:
+            lines, self._batches = self._batches, []
+            if lines and self._fd is not None:
+                _write_all(self._fd, "\n".join(lines) + "\n")
+                self._writed_lines += len(lines)
+        return True
+
+    def stats(self):
+        """
+        AsyncWriter 统计, 同步写入时返回 None
+        """
+        if self._writer is None:
+            return None
+        return {"written": self._writer.written, "dropped": self._writer.dropped, "failed": self._writer.failed,
+                "buffered": len(self._writer._buf)}
+
+    def _write_lines(self, lines):
+        """
+        AsyncWriter 线程中写入日志
+        """
+        self._checkfile(time.localtime())
+        _writev(self._fd, [line + "\n" for line in lines])
+        self._writed_lines += len(lines)
 
     def _reopen_file(self, mode):
         """
@@ -93,16 +365,36 @@ class LoggerBase(object):
                 self._curpath = self._path
                 self._reopen_file(os.O_CREAT | os.O_APPEND | os.O_WRONLY)
 
-        if self._size_limit and self._writed_lines > self.FILE_SIZE_CHECK_LINES:
+        # fstat 每 SIZE_CHECK_EVERY_LINES 行一次, 而不是超过 FILE_SIZE_CHECK_LINES 后每行一次
+        if self._size_limit and self._writed_lines > self._next_size_check:
             self._lock.acquire()
             try:
                 if os.fstat(self._fd).st_size > self._size_limit:
                     self._reopen_file(os.O_CREAT | os.O_APPEND |
                                       os.O_WRONLY | os.O_TRUNC)
                     self._writed_lines = 0
+                    self._next_size_check = self.FILE_SIZE_CHECK_LINES
+                else:
+                    self._next_size_check = self._writed_lines + self.SIZE_CHECK_EVERY_LINES
             finally:
                 self._lock.release()
 
+    def _time_prefix(self):
+        """
+        日志行的时间及 pid 前缀, 每秒只格式化一次
+
+        Returns:
+            now(time.struct_time), prefix(eg: "2019-12-21 17:38:29\t12345")
+        """
+        sec = int(time.time())
+        # 整体替换 tuple, 多线程读写无需加锁
+        tm_cache = self._tm_cache
+        if tm_cache[0] != sec:
+            now = time.localtime(sec)
+            tm_cache = (sec, now, "%s\t%s" % (time.strftime("%Y-%m-%d %H:%M:%S", now), self._pid))
+            self._tm_cache = tm_cache
+        return tm_cache[1], tm_cache[2]
+
     def log(self, logtype, info=""):
         """
         Write log to log file
@@ -110,40 +402,66 @@ class LoggerBase(object):
         Args:
             logtype     : (str) log msg
         """
-        func = inspect.currentframe().f_back
-        filename = func.f_code.co_filename
-        #filename = os.path.basename(func.f_code.co_filename)
-        lineno = func.f_lineno
-        cur_info = "{filename}:{lineno}".format(
-            filename=filename, lineno=lineno)
-
-        now = time.localtime()
-        self._checkfile(now)
+        if self._capture_caller:
+            func = sys._getframe(1)
+            cur_info = "%s:%s" % (func.f_code.co_filename, func.f_lineno)
+        else:
+            cur_info = "-"
+
+        now, prefix = self._time_prefix()
         if info:
-            logline = "%s\t%s\t%s\t%s\t%s" % (
-                time.strftime("%Y-%m-%d %H:%M:%S", now),
-                self._pid,
-                cur_info,
-                logtype,
-                info)
+            logline = "%s\t%s\t%s\t%s" % (prefix, cur_info, logtype, info)
         else:
-            logline = "%s\t%s\t%s\t%s" % (
-                time.strftime("%Y-%m-%d %H:%M:%S", now),
-                self._pid,
-                cur_info,
-                logtype)
+            logline = "%s\t%s\t%s" % (prefix, cur_info, logtype)
         if DEBUG_VERBOSE:
             print logline
 
+        if self._writer is not None:
+            self._writer.put(logline)
+            return
+
+        self._checkfile(now)
         if self._batch_write < 2:
             os.write(self._fd, logline + "\n")
             self._writed_lines += 1
         else:
-            self._batches.append(logline)
-            if len(self._batches) >= self._batch_write:
-                os.write(self._fd, "\n".join(self._batches) + "\n")
-                self._writed_lines += len(self._batches)
-                self._batches = []
+            with self._lock:
+                self._batches.append(logline)
+                if len(self._batches) >= self._batch_write:
+                    _write_all(self._fd, "\n".join(self._batches) + "\n")
+                    self._writed_lines += len(self._batches)
+                    self._batches = []
+
+
+def reinit_after_fork():
+    """
+    多进程模式下, fork 后在子进程中调用
+    (1) LoggerBase 日志: 更新 pid, 重新打开日志文件
+    (2) logging 日志: fork 时其他线程可能持有 logging 的锁, 在子进程中重建这些锁
+    """
+    for logger_instance in list(_logger_instances):
+        logger_instance.reinit_after_fork()
+
+    logging._lock = threading.RLock()
+    for handler_ref in logging._handlerList:
+        handler = handler_ref()
+        if handler is not None:
+            handler.createLock()
+
+
+@atexit.register
+def flush_all():
+    """
+    进程退出时写入所有 LoggerBase 缓冲中的日志, 并结束后台写线程
+    """
+    for logger_instance in list(_logger_instances):
+        try:
+            logger_instance.flush(timeout=5)
+            # 在解释器退出前结束写线程
+            if logger_instance._writer is not None:
+                logger_instance._writer.stop()
+        except BaseException:
+            pass
 
 
 # -------------------------------------------------------------------------------------------------------------
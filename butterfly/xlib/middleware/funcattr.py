@@ -13,6 +13,10 @@
                    如果请求是请求的参数的话，则需要设置为 True
     is_encode_response: 是否将响应包转为 json
                    目前如果返回数据为 dict 的话，则自动转为 json
+    paramattr:     请求参数类型提示, 注册路由时编译为 httpgateway.ParamSchema
+    routeattr:     额外的路由(支持路径参数)及 HTTP 方法限制
+    cacheattr:     响应缓存(ttl/vary), 由 protocol_json.Protocol 缓存序列化后的响应
+    concurrencyattr: 路由并发限制(limit/queue_timeout), 由 httpgateway.WSGIGateway 执行
 
 """
 def api(func):
@@ -60,3 +64,105 @@ def api_upload(func):
     """
     func.apiattr = {"is_parse_post": False, "is_encode_response": True}
     return func
+
+
+def params(**hints):
+    """
+    指定请求参数类型, query string 中的参数值会在调用 handler 前转换为对应类型,
+    转换失败时返回参数错误(ERR_BAD_PARAMS)
+
+    默认值为 int/float 的参数无需指定, 会按默认值类型自动转换
+
+    Args:
+        hints: 参数名 => int/float/bool/list 或任意接收字符串的 callable
+    Returns:
+        decorator
+    Examples:
+        @funcattr.api
+        @funcattr.params(is_detail=bool, tags=list)
+        def hosts(req, page_index=1, page_size=10, is_detail=False, tags=None):
+            pass
+    """
+    def decorator(func):
+        func.paramattr = hints
+        return func
+    return decorator
+
+
+def route(path=None, methods=None):
+    """
+    添加路由或限制 HTTP 方法, 可多次使用
+
+    路径参数会作为参数传递给 handler, 需为 handler 的参数, 支持的类型见 xlib.urls.CONVERTERS
+    请求路径匹配但 HTTP 方法不匹配时返回 405
+
+    Args:
+        path   : (String) 路由, eg: /wuxing/instance/{name}, /wuxing/instance/{id:int}
+               : 为 None 时表示对默认路由(/{package}/{func})限制 HTTP 方法
+        methods: (List) 允许的 HTTP 方法, 为 None 时不限制
+    Returns:
+        decorator
+    Examples:
+        @funcattr.api
+        @funcattr.route("/wuxing/instance/{name}", methods=["GET"])
+        def get_instance(req, name):
+            pass
+    """
+    def decorator(func):
+        routeattr = list(getattr(func, "routeattr", []))
+        routeattr.append({"path": path, "methods": methods})
+        func.routeattr = routeattr
+        return func
+    return decorator
+
+
+def cached(ttl, vary=None, max_bytes=None):
+    """
+    缓存 handler 的响应(序列化后的 JSON 及 headers), 仅对 funcattr.api 等需要编码响应的 handler 生效
+
+    (1) 按路由及参数缓存, 仅缓存 stat 为 OK 的响应; handler 返回 Cache-Control/Content-Type 以外的 headers
+        (如 Set-Cookie)时不缓存, 缓存 key 不包含 cookie/认证信息
+    (2) 响应带有强 ETag, 请求 If-None-Match 匹配时返回 304
+    (3) 缓存为进程内 LRU, 命中/未命中/淘汰数见 /serverstat/serverstat
+
+    Args:
+        ttl      : (Float) 缓存有效期(s)
+        vary     : (List) 作为缓存 key 的参数名, 为 None 时使用所有参数
+        max_bytes: (Int) 此路由缓存总大小上限, 为 None 时使用 config.RESPONSE_CACHE_SIZE
+    Returns:
+        decorator
+    Examples:
+        @funcattr.api
+        @funcattr.cached(ttl=10, vary=["page_index", "page_size"])
+        def hosts(req, page_index=1, page_size=10):
+            pass
+    """
+    def decorator(func):
+        func.cacheattr = {"ttl": ttl, "vary": vary, "max_bytes": max_bytes}
+        return func
+    return decorator
+
+
+def max_concurrency(limit, queue_timeout=0):
+    """
+    限制路由同时处理的请求数(bulkhead), 避免慢接口占满 server 线程
+
+    (1) 达到上限时最多等待 queue_timeout 秒, 仍无空闲时返回 503 + Retry-After, acclog 中 stat 为 ERR_CONCURRENCY_LIMIT
+    (2) 流式响应(下载等)在响应发送完成后才释放
+    (3) 各路由当前并发数/上限/拒绝数见 /serverstat/serverstat
+
+    Args:
+        limit        : (Int) 最大并发数(每个进程)
+        queue_timeout: (Float) 达到上限时的最长等待时间(s), 为 0 时不等待
+    Returns:
+        decorator
+    Examples:
+        @funcattr.api
+        @funcattr.max_concurrency(4, queue_timeout=0.1)
+        def instance_list(req, extra_items=None):
+            pass
+    """
+    def decorator(func):
+        func.concurrencyattr = {"limit": limit, "queue_timeout": queue_timeout}
+        return func
+    return decorator
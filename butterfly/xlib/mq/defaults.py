@@ -12,6 +12,26 @@ REDIS_MSG_NAMESPACE_PREFIX = 'mq:msg:'
 REDIS_QUEUES_KEYS = 'mq:queues'
 # Redis 中队列 name 的 key 前缀
 REDIS_QUEUE_NAMESPACE_PREFIX = 'mq:queue:'
+# Redis 中队列唤醒通知 list 的 key 前缀, 入队时 push, 空闲的 worker BLPOP 等待
+REDIS_NOTIFY_NAMESPACE_PREFIX = 'mq:notify:'
+# 通知 list 的最大长度(worker 被唤醒后会持续出队直到队列为空, 不需要每条消息一个通知)
+NOTIFY_MAX_LEN = 16
+# 所有队列为空时 worker 单次 BLPOP 等待通知的最长时间(s), 需小于 redis 连接的 socket_timeout
+WORKER_WAIT_TIMEOUT = 5
+# 所有队列为空且没有收到通知时, worker 重新检查队列的间隔(s), 防止通知丢失(如未发送通知的入队方式)
+WORKER_IDLE_POLL_INTERVAL = 60
+# Redis 中队列限流 list 的 key 前缀, 与队列使用相同的 hashtag, 如 mq:rate_limit:{name}:worker
+REDIS_RATE_LIMIT_NAMESPACE_PREFIX = 'mq:rate_limit:'
+# socket_timeout 过小无法 BLPOP 时, worker 空闲时轮询队列的间隔(s)
+WORKER_POLL_INTERVAL = 1
+# worker 单次批量出队的最大消息数(同时受线程池空闲线程数限制)
+DEQUEUE_BATCH_SIZE = 20
+# Redis 中延迟消息 ZSET 的 key 前缀, score 为执行时间(unix 时间戳)
+REDIS_SCHEDULED_NAMESPACE_PREFIX = 'mq:scheduled:'
+# worker 忙碌时检查到期延迟消息的间隔(s), 空闲时每次等待通知前检查
+SCHEDULE_CHECK_INTERVAL = 1
+# 每个队列单次移动的到期延迟消息数
+SCHEDULE_BATCH_SIZE = 100
 DEFAULT_WORKER_TTL = 420
 DEFAULT_RESULT_TTL = 31536000   # 1 year in seconds
 DEFAULT_FAILURE_TTL = 31536000  # 1 year in seconds
@@ -29,6 +29,7 @@ MsgStatus = enum(
     FINISHED='finished',
     FAILED='failed',
     STARTED='started',
+    SCHEDULED='scheduled',
 )
 
 # Sentinel value to mark that some of our lazily evaluated properties have not
@@ -103,24 +104,27 @@ class Msg(object):
 
         return self._status
 
-    def set_status(self, status, save=True):
+    def set_status(self, status, save=True, pipeline=None):
         self._status = status
         if save:
-            self.connection.hset(self.key, 'status', self._status)
+            connection = pipeline if pipeline is not None else self.connection
+            connection.hset(self.key, 'status', self._status)
 
-    def set_handle_worker(self, worker_name):
+    def set_handle_worker(self, worker_name, pipeline=None):
         """
         set handle_worker
         """
         self.handle_worker = worker_name
-        self.connection.hset(self.key, 'handle_worker', self.handle_worker)
+        connection = pipeline if pipeline is not None else self.connection
+        connection.hset(self.key, 'handle_worker', self.handle_worker)
 
-    def set_cost(self, cost):
+    def set_cost(self, cost, pipeline=None):
         """
         set cost
         """
         self.cost = cost
-        self.connection.hset(self.key, 'cost', self.cost)
+        connection = pipeline if pipeline is not None else self.connection
+        connection.hset(self.key, 'cost', self.cost)
 
     @property
     def is_finished(self):
@@ -346,7 +350,7 @@ class Msg(object):
 
         return obj
 
-    def save(self, include_meta=True):
+    def save(self, include_meta=True, pipeline=None):
         """
         Dumps the current msg instance to its corresponding Redis key.
 
@@ -355,9 +359,12 @@ class Msg(object):
         user metadata without an expensive `refresh()` call first.
 
         Redis key persistence may be altered by `cleanup()` method.
+
+        pipeline 不为 None 时在 pipeline 中执行, 由调用方 execute
         """
         key = self.key
-        self.connection.hmset(key, self.to_dict(include_meta=include_meta))
+        connection = pipeline if pipeline is not None else self.connection
+        connection.hmset(key, self.to_dict(include_meta=include_meta))
 
     def save_meta(self):
         """Stores msg meta from the msg instance to the corresponding Redis key."""
@@ -419,7 +426,7 @@ class Msg(object):
         """
         return default_ttl if self.result_ttl is None else self.result_ttl
 
-    def cleanup(self, ttl=None, remove_from_queue=True):
+    def cleanup(self, ttl=None, remove_from_queue=True, pipeline=None):
         """Prepare msg for eventual deletion (if needed). This method is usually
         called after successful execution. How long we persist the msg and its
         result depends on the value of ttl:
@@ -430,7 +437,8 @@ class Msg(object):
         if not ttl:
             return
         elif ttl > 0:
-            self.connection.expire(self.key, ttl)
+            connection = pipeline if pipeline is not None else self.connection
+            connection.expire(self.key, ttl)
 
     @property
     def failed_msg_registry(self):
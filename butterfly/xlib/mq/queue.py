@@ -8,16 +8,20 @@
 from __future__ import (absolute_import, division, print_function,
                         unicode_literals)
 
+import time
 import uuid
 import random
+import calendar
+import datetime
 
 from xlib.mq.compat import as_text, string_types, total_ordering
 from xlib.mq.exceptions import NoSuchMsgError, UnpickleError
 from xlib.mq.msg import Msg, MsgStatus
 from xlib.mq.utils import backend_class, import_attribute, parse_timeout, utcnow
-from xlib.mq.utils import current_timestamp
+from xlib.mq.utils import current_timestamp, utcformat
 from xlib.mq import defaults
 from xlib.util import retry
+from xlib.db.redisorm import script_registry
 
 
 def compact(lst):
@@ -27,6 +31,131 @@ def compact(lst):
     return [item for item in lst if item is not None]
 
 
+# 清空队列, 删除队列中的消息及延迟消息
+# KEYS: queue list, scheduled zset(可选)
+LUA_EMPTY = script_registry.define('mq_empty', '''
+    local prefix = ARGV[1]
+    local q = KEYS[1]
+    local count = 0
+    while true do
+        local msg_id = redis.call("lpop", q)
+        if msg_id == false then
+            break
+        end
+
+        -- Delete the relevant keys
+        redis.call("del", prefix..msg_id)
+        count = count + 1
+    end
+    if KEYS[2] then
+        for _, msg_id in ipairs(redis.call("zrange", KEYS[2], 0, -1)) do
+            redis.call("del", prefix..msg_id)
+            count = count + 1
+        end
+        redis.call("del", KEYS[2])
+    end
+    return count
+''')
+
+# 出队一个消息并移动到 mq:wip 中, 见 Queue.lpop
+LUA_LPOP = script_registry.define('mq_lpop', '''
+    local v = redis.call("lpop", KEYS[1])
+    if v then
+        redis.call('zadd',KEYS[2],ARGV[1],v)
+    end
+    return v
+''')
+
+# 出队, 见 Queue.dequeue_many; 每个队列一次调用, 只访问该队列 {name} hashtag 下的 key(兼容集群/代理)
+# KEYS: queue list, wip zset, 限流 list
+# ARGV: 最多出队的消息数, wip score, 当前时间, 限流次数(为 0 时不限流), 限流时间窗口
+# 每出队一个消息记录一次限流事件, 队列为空时不记录; 返回 {队列非空但被限流时为 1, {msg_id}, 队列剩余长度}
+LUA_DEQUEUE = script_registry.define('mq_dequeue', '''
+    local n = tonumber(ARGV[1])
+    local now = tonumber(ARGV[3])
+    local limit = tonumber(ARGV[4])
+    local per = tonumber(ARGV[5])
+    local limited = 0
+    if limit > 0 and redis.call("llen", KEYS[1]) > 0 then
+        local recent = 0
+        for _, ts in ipairs(redis.call("lrange", KEYS[3], 0, limit - 1)) do
+            if now - tonumber(ts) < per then
+                recent = recent + 1
+            end
+        end
+        if limit - recent < n then
+            n = limit - recent
+        end
+        if n <= 0 then
+            limited = 1
+        end
+    end
+    local msg_ids = {}
+    while #msg_ids < n do
+        local msg_id = redis.call("lpop", KEYS[1])
+        if not msg_id then
+            break
+        end
+        redis.call("zadd", KEYS[2], ARGV[2], msg_id)
+        msg_ids[#msg_ids + 1] = msg_id
+        if limit > 0 then
+            redis.call("lpush", KEYS[3], ARGV[3])
+        end
+    end
+    if #msg_ids > 0 and limit > 0 then
+        redis.call("ltrim", KEYS[3], 0, limit - 1)
+        redis.call("pexpire", KEYS[3], math.floor(per * 2000))
+    end
+    return {limited, msg_ids, redis.call("llen", KEYS[1])}
+''')
+
+# 设置出队消息的状态并返回消息 hash, 见 Queue.dequeue_many; 每个消息一次调用, 只访问消息 key
+# KEYS: msg key
+# ARGV: started 状态, started_at, handle_worker(为空时不设置)
+# 消息已不存在(已删除/过期)时返回 false
+LUA_START_MSG = script_registry.define('mq_start_msg', '''
+    if redis.call("exists", KEYS[1]) == 0 then
+        return false
+    end
+    redis.call("hmset", KEYS[1], "status", ARGV[1], "started_at", ARGV[2])
+    if ARGV[3] ~= "" then
+        redis.call("hset", KEYS[1], "handle_worker", ARGV[3])
+    end
+    return redis.call("hgetall", KEYS[1])
+''')
+
+# 移动到期的延迟消息到队列中, 见 Queue.enqueue_scheduled; 每个队列一次调用, 只访问该队列 {name} hashtag 下的 key
+# KEYS: scheduled zset, queue list, notify list
+# ARGV: 当前时间, 最多移动的消息数, 通知 list 最大长度
+# 返回 {{移动的 msg_id}, 下一个延迟消息的执行时间(没有时为 false)}
+LUA_ENQUEUE_SCHEDULED = script_registry.define('mq_enqueue_scheduled', '''
+    local msg_ids = redis.call("zrangebyscore", KEYS[1], "-inf", ARGV[1], "LIMIT", 0, ARGV[2])
+    for _, msg_id in ipairs(msg_ids) do
+        redis.call("zrem", KEYS[1], msg_id)
+        redis.call("rpush", KEYS[2], msg_id)
+    end
+    if #msg_ids > 0 then
+        redis.call("rpush", KEYS[3], 1)
+        redis.call("ltrim", KEYS[3], -tonumber(ARGV[3]), -1)
+    end
+    -- Lua number 转换为 redis 整数时会截断小数, 返回字符串
+    local first = redis.call("zrange", KEYS[1], 0, 0, "WITHSCORES")
+    return {msg_ids, first[2] or false}
+''')
+
+# 设置移动到队列中的延迟消息的状态, 见 Queue.enqueue_scheduled; 每个消息一次调用, 只访问消息 key
+# KEYS: msg key
+# ARGV: scheduled 状态, queued 状态, enqueued_at
+# 只更新仍为 scheduled 的消息, 不覆盖已被 worker 出队(started)的消息, 消息已不存在时不创建
+LUA_SET_QUEUED = script_registry.define('mq_set_queued', '''
+    if redis.call("hget", KEYS[1], "status") == ARGV[1] then
+        redis.call("hmset", KEYS[1], "status", ARGV[2], "enqueued_at", ARGV[3])
+        return 1
+    end
+    return 0
+''')
+
+
 @total_ordering
 class Queue(object):
     """
@@ -36,6 +165,9 @@ class Queue(object):
     DEFAULT_TIMEOUT = 180  # Default timeout seconds.
     redis_queue_namespace_prefix = defaults.REDIS_QUEUE_NAMESPACE_PREFIX
     redis_queues_keys = defaults.REDIS_QUEUES_KEYS
+    redis_notify_namespace_prefix = defaults.REDIS_NOTIFY_NAMESPACE_PREFIX
+    redis_scheduled_namespace_prefix = defaults.REDIS_SCHEDULED_NAMESPACE_PREFIX
+    redis_rate_limit_namespace_prefix = defaults.REDIS_RATE_LIMIT_NAMESPACE_PREFIX
 
     @classmethod
     def all(cls, connection=None, msg_class=None):
@@ -74,7 +206,12 @@ class Queue(object):
         prefix = self.redis_queue_namespace_prefix
         self.name = name
         # 将 key 进行添加 hashtag, 两个左花括号输出左花括号本身，两个右花括号输出右花括号本身。
+        # 同一队列的 key 在同一个 slot 中, 可在同一个 Lua 脚本中访问; msg key(mq:msg:<id>)没有 hashtag,
+        # 不与队列的 key 在同一个 Lua 脚本中访问(见 LUA_START_MSG/LUA_SET_QUEUED, 每次只访问一个 msg key);
+        # 不同队列的 key 不在同一个 slot 中, wait_any 的多队列 BLPOP 只能用于单个 redis 实例
         self._key = '{prefix}{{{name}}}'.format(prefix=prefix, name=name)
+        self._notify_key = '{prefix}{{{name}}}'.format(prefix=self.redis_notify_namespace_prefix, name=name)
+        self._scheduled_key = '{prefix}{{{name}}}'.format(prefix=self.redis_scheduled_namespace_prefix, name=name)
         self._default_timeout = parse_timeout(default_timeout) or self.DEFAULT_TIMEOUT
 
         # override class attribute msg_class if one was passed
@@ -84,7 +221,9 @@ class Queue(object):
             self.msg_class = msg_class
 
         # allows 30 events every 1 seconds
-        self.rate_limit = self.connection.rate_limit(name, limit=30, per=1)
+        # 限流 list 与队列使用相同的 hashtag, 可在同一个 Lua 脚本中访问
+        rate_limit_name = '{prefix}{{{name}}}'.format(prefix=self.redis_rate_limit_namespace_prefix, name=name)
+        self.rate_limit = self.connection.rate_limit(rate_limit_name, limit=30, per=1)
 
     def __len__(self):
         return self.count
@@ -103,6 +242,21 @@ class Queue(object):
         """Returns the Redis key for this Queue."""
         return self._key
 
+    @property
+    def notify_key(self):
+        """Returns the Redis key of this Queue's wake-up notify list."""
+        return self._notify_key
+
+    @property
+    def scheduled_key(self):
+        """Returns the Redis key of this Queue's scheduled msgs ZSET."""
+        return self._scheduled_key
+
+    @property
+    def scheduled_count(self):
+        """Returns a count of all scheduled messages of the queue."""
+        return self.connection.zcard(self._scheduled_key)
+
     @property
     def registry_cleaning_key(self):
         """Redis key used to indicate this queue has been cleaned."""
@@ -115,25 +269,9 @@ class Queue(object):
         return self.connection.set(self.registry_cleaning_key, 1, nx=1, ex=899)
 
     def empty(self):
-        """Removes all messages on the queue."""
-        script = """
-            local prefix = "{0}"
-            local q = KEYS[1]
-            local count = 0
-            while true do
-                local msg_id = redis.call("lpop", q)
-                if msg_id == false then
-                    break
-                end
-
-                -- Delete the relevant keys
-                redis.call("del", prefix..msg_id)
-                count = count + 1
-            end
-            return count
-        """.format(self.msg_class.redis_msg_namespace_prefix).encode("utf-8")
-        script = self.connection.register_script(script)
-        return script(keys=[self.key])
+        """Removes all messages on the queue, including scheduled messages."""
+        return self.connection.script_registry(
+            LUA_EMPTY, keys=[self.key, self._scheduled_key], args=[self.msg_class.redis_msg_namespace_prefix])
 
     def delete(self, delete_msgs=True):
         """Deletes the queue. If delete_msgs is true it removes all the associated messages on the queue first."""
@@ -141,10 +279,10 @@ class Queue(object):
             self.empty()
 
         self.connection.srem(self.redis_queues_keys, self._key)
-        self.connection.delete(self._key)
+        self.connection.delete(self._key, self._notify_key, self._scheduled_key)
 
     def is_empty(self):
-        """Returns whether the current queue is empty."""
+        """Returns whether the current queue is empty (scheduled messages are not counted)."""
         return self.count == 0
 
     def fetch_msg(self, msg_id):
@@ -164,7 +302,7 @@ class Queue(object):
                 return msg
 
     def get_msg_ids(self, offset=0, length=-1):
-        """Returns a slice of msg IDs in the queue."""
+        """Returns a slice of msg IDs in the queue (scheduled messages are not included)."""
         start = offset
         if length >= 0:
             end = offset + (length - 1)
@@ -189,7 +327,7 @@ class Queue(object):
 
     @property
     def count(self):
-        """Returns a count of all messages in the queue."""
+        """Returns a count of all messages in the queue (scheduled messages are not counted, see scheduled_count)."""
         return self.connection.llen(self.key)
 
     @property
@@ -232,11 +370,18 @@ class Queue(object):
 
     def push_msg_id(self, msg_id, at_front=False):
         """Pushes a msg ID on the corresponding Redis queue.
-        'at_front' allows you to push the msg onto the front instead of the back of the queue"""
+        'at_front' allows you to push the msg onto the front instead of the back of the queue
+
+        同时向通知 list push 一个标记, 唤醒 BLPOP 等待中的 worker(见 wait_any), 一次往返
+        """
+        pipe = self.connection.pipeline()
         if at_front:
-            self.connection.lpush(self.key, msg_id)
+            pipe.lpush(self.key, msg_id)
         else:
-            self.connection.rpush(self.key, msg_id)
+            pipe.rpush(self.key, msg_id)
+        pipe.rpush(self._notify_key, 1)
+        pipe.ltrim(self._notify_key, -defaults.NOTIFY_MAX_LEN, -1)
+        pipe.execute()
 
     def create_msg(self, data, timeout=None,
                    result_ttl=None, ttl=None, failure_ttl=None,
@@ -336,6 +481,103 @@ class Queue(object):
             at_front=result_data["at_front"], meta=result_data["meta"]
         )
 
+    def enqueue_at(self, scheduled_time, data, *args, **kwargs):
+        """
+        延迟入队, 在 scheduled_time 后由 worker 移动到队列中执行(精度约 1 秒)
+
+        Args:
+            scheduled_time: (datetime/Float) 执行时间, datetime 为 UTC 时间(与 utcnow 一致), Float 为 unix 时间戳
+            data          : (String) 消息数据, 其他参数同 enqueue(不支持 at_front)
+        Returns:
+            msg, 状态为 scheduled
+        """
+        result_data = Queue.parse_args(data, *args, **kwargs)
+        msg = self.create_msg(
+            result_data["data"], result_ttl=result_data["result_ttl"], ttl=result_data["ttl"],
+            failure_ttl=result_data["failure_ttl"], description=result_data["description"],
+            msg_id=result_data["msg_id"], meta=result_data["meta"], status=MsgStatus.SCHEDULED,
+            timeout=result_data["timeout"],
+        )
+        return self.schedule_msg(msg, scheduled_time)
+
+    def enqueue_in(self, delay, data, *args, **kwargs):
+        """
+        延迟 delay 后执行, 见 enqueue_at
+
+        Args:
+            delay: (Float/timedelta) 延迟时间(s)
+        """
+        if isinstance(delay, datetime.timedelta):
+            delay = delay.total_seconds()
+        return self.enqueue_at(time.time() + delay, data, *args, **kwargs)
+
+    @retry.retry(interval=1, max_retries=5)
+    def schedule_msg(self, msg, scheduled_time):
+        """
+        将 msg 写入延迟消息 ZSET(一次往返), 同时通知 worker 重新计算下次检查时间
+
+        +-----------------------------------------------------------------------
+        |       zset                      Lua(到期后)        list
+        |mq:scheduled:{queue_name}  ==>  Queue.enqueue_scheduled  ==> mq:queue:{queue_name}
+        +-----------------------------------------------------------------------
+        """
+        if isinstance(scheduled_time, datetime.datetime):
+            timestamp = calendar.timegm(scheduled_time.utctimetuple()) + scheduled_time.microsecond / 1e6
+        else:
+            timestamp = float(scheduled_time)
+
+        msg.set_status(MsgStatus.SCHEDULED, save=False)
+        msg.origin = self.name
+        if msg.timeout is None:
+            msg.timeout = self._default_timeout
+
+        pipe = self.connection.pipeline()
+        pipe.sadd(self.redis_queues_keys, self.key)
+        msg.save(pipeline=pipe)
+        msg.cleanup(ttl=msg.ttl, pipeline=pipe)
+        pipe.zadd(self._scheduled_key, {msg.id: timestamp})
+        pipe.rpush(self._notify_key, 1)
+        pipe.ltrim(self._notify_key, -defaults.NOTIFY_MAX_LEN, -1)
+        pipe.execute()
+        return msg
+
+    @classmethod
+    def enqueue_scheduled(cls, queues, connection=None, msg_class=None):
+        """
+        将到期的延迟消息移动到队列中, 由 worker 循环调用
+
+        每个队列执行一次 LUA_ENQUEUE_SCHEDULED(只访问该队列 hashtag 下的 key, 兼容集群/代理), 所有队列的调用
+        在一个非事务 pipeline 中发送; 有消息移动时再一次往返执行 LUA_SET_QUEUED(每个消息一次, 只访问消息 key)
+        设置为 queued. 两次往返之间消息已在队列中但状态仍为 scheduled, 期间被出队的消息不会再被改回 queued;
+        已过期(ttl)或已删除的消息同样移动到队列中, 出队时跳过
+
+        Args:
+            queues    : (List) Queue 列表
+        Returns:
+            (Float) 下一个延迟消息的执行时间(unix 时间戳), 没有延迟消息时返回 None;
+                    小于等于当前时间时表示还有到期消息未移动(超过 SCHEDULE_BATCH_SIZE)
+        """
+        if not queues:
+            return None
+        msg_class = backend_class(cls, 'msg_class', override=msg_class)
+        args = ["%.6f" % time.time(), defaults.SCHEDULE_BATCH_SIZE, defaults.NOTIFY_MAX_LEN]
+        calls = [([queue.scheduled_key, queue.key, queue.notify_key], args) for queue in queues]
+        results = connection.script_registry.call_many(LUA_ENQUEUE_SCHEDULED, calls)
+
+        msg_ids = []
+        next_times = []
+        for queue_msg_ids, next_time in results:
+            msg_ids.extend(queue_msg_ids)
+            if next_time is not None:
+                next_times.append(float(next_time))
+        if msg_ids:
+            args = [MsgStatus.SCHEDULED, MsgStatus.QUEUED, utcformat(utcnow())]
+            connection.script_registry.call_many(
+                LUA_SET_QUEUED, [([msg_class.key_for(as_text(msg_id))], args) for msg_id in msg_ids])
+        if not next_times:
+            return None
+        return min(next_times)
+
     @retry.retry(interval=1, max_retries=5)
     def enqueue_msg(self, msg, at_front=False):
         """Enqueues a msg for delayed execution.
@@ -379,13 +621,6 @@ class Queue(object):
             'RATE_LIMITED': rate limit
             queue_key, blob: queue key and  msg_id
         """
-        lua = '''
-            local v = redis.call("lpop", KEYS[1])
-            if v then
-                redis.call('zadd',KEYS[2],ARGV[1],v)
-            end
-            return v
-        '''
         # 设置 ttl 为 1 小时，即在正在处理队列中的时间
         ttl = 3600
         rate_limit_count = 0
@@ -407,8 +642,7 @@ class Queue(object):
             queue_wip_key = key_template.format(queue_name)
             score = current_timestamp() + ttl
 
-            keys_args_list = [queue_key, queue_wip_key, score]
-            blob = connection.eval(lua, 2, *keys_args_list)
+            blob = connection.script_registry(LUA_LPOP, keys=[queue_key, queue_wip_key], args=[score])
             if blob is not None:
                 return queue_key, blob
         if rate_limit_count > 0:
@@ -416,6 +650,33 @@ class Queue(object):
         else:
             return None
 
+    @classmethod
+    def wait_any(cls, queues, timeout=defaults.WORKER_WAIT_TIMEOUT, connection=None):
+        """
+        所有队列为空时, 阻塞等待任一队列的入队通知
+
+        通知仅用于唤醒, 消息仍由 dequeue_any 原子地移动到 mq:wip 中; 通知可能多于消息(被唤醒后队列已被
+        其他 worker 取空), 调用方需重新 dequeue
+
+        注意: 各队列的通知 key 使用各自的 hashtag, 不在同一个 slot 中, 多个队列时的 BLPOP 只能用于单个
+        redis 实例(集群/代理会返回 CROSSSLOT); 使用集群/代理时每个 worker 只消费一个队列
+
+        Args:
+            queues    : (List) Queue 列表
+            timeout   : (Int) 最长等待时间(s), 需小于 redis 连接的 socket_timeout
+        Returns:
+            (String) 收到通知的队列名, 超时返回 None
+        """
+        if not queues:
+            return None
+        notify_keys = [queue.notify_key for queue in queues]
+        result = connection.blpop(notify_keys, timeout=timeout)
+        if result is None:
+            return None
+        notify_key = as_text(result[0])
+        # 需要去掉 hashtab {}
+        return notify_key[len(cls.redis_notify_namespace_prefix):][1:-1]
+
     @classmethod
     def dequeue_any(cls, queues, connection=None, msg_class=None):
         """Class method returning the msg_class instance at the front of the given
@@ -456,6 +717,89 @@ class Queue(object):
             return msg, queue
         return None, None
 
+    @classmethod
+    def dequeue_many(cls, queues, n, connection=None, msg_class=None, handle_worker=None):
+        """
+        批量出队, 从多个队列中最多取出 n 个消息
+
+        +-----------------------------------------------
+        |       list                     set
+        |mq:queue:{queue_name} ==> mq:wip:{queue_name}
+        +-----------------------------------------------
+
+        每个队列执行一次 LUA_DEQUEUE(只访问该队列 hashtag 下的 key, 兼容集群/代理), 所有队列的调用在一个
+        非事务 pipeline 中发送; n 平均分配到各队列, 有队列未取满分配的数量且其他队列还有消息时, 再对这些队列出队
+
+        出队后在一个 pipeline 中执行 LUA_START_MSG(每个消息一次, 只访问消息 key), 与 fetch + set_status +
+        hset started_at + set_handle_worker 逐个执行相同, 消息 hash 设置为 started 并返回, 不需要再 HGETALL;
+        已不存在的消息(已删除)与 dequeue_any 相同, 跳过
+
+        限流按出队的消息数计算(与 rate_limit.limit 使用相同的 List), 每个队列出队的消息数不超过剩余的限流次数,
+        空队列不消耗限流次数
+
+        Args:
+            queues    : (List) Queue 列表
+            n         : (Int) 最多出队的消息数, 如线程池的空闲线程数
+            handle_worker: (String) 处理消息的 worker 名称, 为 None 时不设置
+        Returns:
+            (List) [(msg, queue)], 队列均为空时返回 []
+            'RATE_LIMITED': 没有取到消息且有非空队列被限流
+        """
+        msg_class = backend_class(cls, 'msg_class', override=msg_class)
+        # 设置 ttl 为 1 小时，即在正在处理队列中的时间
+        ttl = 3600
+        key_template = 'mq:wip:{{{0}}}'
+
+        if not queues:
+            return []
+
+        # 将列表随机打乱, 以免一直在处理单个队列
+        pending = list(queues)
+        random.shuffle(pending)
+        score = current_timestamp() + ttl
+        limited = False
+        dequeued = []
+        while pending and len(dequeued) < n:
+            # 分配的数量为 0 的队列留到下一轮
+            budget = n - len(dequeued)
+            count = min(budget, len(pending))
+            shares = [budget // count + (1 if index < budget % count else 0) for index in range(count)]
+            calls = []
+            for queue, share in zip(pending, shares):
+                rate_limit_key, limit, per = queue.rate_limit.params('worker')
+                calls.append(([queue.key, key_template.format(queue.name), rate_limit_key],
+                              [share, score, repr(time.time()), limit, per]))
+            results = connection.script_registry.call_many(LUA_DEQUEUE, calls)
+
+            backlog = pending[count:]
+            for queue, share, (queue_limited, msg_ids, remaining) in zip(pending, shares, results):
+                limited = limited or bool(queue_limited)
+                dequeued.extend((queue, as_text(msg_id)) for msg_id in msg_ids)
+                if len(msg_ids) == share and remaining:
+                    backlog.append(queue)
+            pending = backlog
+
+        if not dequeued:
+            return defaults.RATE_LIMITED if limited else []
+
+        args = [MsgStatus.STARTED, utcformat(utcnow()), handle_worker or '']
+        calls = [([msg_class.key_for(msg_id)], args) for _, msg_id in dequeued]
+        rows = connection.script_registry.call_many(LUA_START_MSG, calls)
+
+        result = []
+        for (queue, msg_id), raw_data in zip(dequeued, rows):
+            if raw_data is None:
+                continue
+            msg = msg_class(msg_id, connection=connection)
+            it = iter(raw_data)
+            try:
+                msg.restore(dict(zip(it, it)))
+            except UnpickleError:
+                # 同一批次中的其他消息已移动到 mq:wip 中, 不能抛出异常; 该消息由 clean_registries 处理
+                continue
+            result.append((msg, queue))
+        return result
+
     # Total ordering defition (the rest of the required Python methods are
     # auto-generated by the @total_ordering decorator)
     def __eq__(self, other):  # noqa
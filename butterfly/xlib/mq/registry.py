@@ -62,17 +62,19 @@ class BaseRegistry(object):
         self.cleanup()
         return self.connection.zcard(self.key)
 
-    def add(self, msg, ttl=0):
+    def add(self, msg, ttl=0, pipeline=None):
         """Adds a msg to a registry with expiry time of now + ttl, unless it's -1 which is set to +inf"""
         score = ttl if ttl < 0 else current_timestamp() + ttl
         if score == -1:
             score = '+inf'
-        return self.connection.zadd(self.key, {msg.id: score})
+        connection = pipeline if pipeline is not None else self.connection
+        return connection.zadd(self.key, {msg.id: score})
 
-    def remove(self, msg, delete_msg=False):
+    def remove(self, msg, delete_msg=False, pipeline=None):
         """Removes msg from registry and deletes it if `delete_msg == True`"""
         msg_id = msg.id if isinstance(msg, self.msg_class) else msg
-        result = self.connection.zrem(self.key, msg_id)
+        connection = pipeline if pipeline is not None else self.connection
+        result = connection.zrem(self.key, msg_id)
         if delete_msg:
             if isinstance(msg, self.msg_class):
                 msg_instance = msg
@@ -180,7 +182,7 @@ class FailedMsgRegistry(BaseRegistry):
         score = timestamp if timestamp is not None else current_timestamp()
         self.connection.zremrangebyscore(self.key, 0, score)
 
-    def add(self, msg, ttl=None, exc_string=''):
+    def add(self, msg, ttl=None, exc_string='', pipeline=None):
         """
         Adds a msg to a registry with expiry time of now + ttl.
         `ttl` defaults to DEFAULT_FAILURE_TTL if not specified.
@@ -190,9 +192,10 @@ class FailedMsgRegistry(BaseRegistry):
         score = ttl if ttl < 0 else current_timestamp() + ttl
 
         msg.exc_info = exc_string
-        msg.save(include_meta=False)
-        msg.cleanup(ttl=ttl)
-        self.connection.zadd(self.key, {msg.id: score})
+        msg.save(include_meta=False, pipeline=pipeline)
+        msg.cleanup(ttl=ttl, pipeline=pipeline)
+        connection = pipeline if pipeline is not None else self.connection
+        connection.zadd(self.key, {msg.id: score})
 
     def requeue(self, msg_or_id):
         """Requeues the msg with the given msg ID."""
@@ -8,10 +8,12 @@ from __future__ import (absolute_import, division, print_function,
                         unicode_literals)
 
 import logging
+import math
 import os
 import signal
 import socket
 import sys
+import threading
 import traceback
 import warnings
 import time
@@ -185,6 +187,113 @@ class Worker(object):
         self._errlog = errlog
         self.pool = pool
         self.apicube = apicube
+        # 已提交到线程池未执行完的消息数(出队时已设置为 started), 在线程池线程中减少
+        self._in_flight = 0
+        self._in_flight_lock = threading.Lock()
+        self.wait_timeout = self._get_wait_timeout()
+        # 下次检查到期延迟消息的时间, 及下一个延迟消息的执行时间
+        self._next_schedule_check = 0
+        self._next_scheduled_time = None
+
+    def _get_wait_timeout(self):
+        """
+        队列为空时 BLPOP 等待通知的时间, 需小于连接的 socket_timeout(预留 0.5s), 否则会读取超时
+
+        Returns:
+            (Int) 秒, redis 的 BLPOP 超时为整数;
+            None: socket_timeout 小于 1.5s, 不能 BLPOP, 空闲时每 WORKER_POLL_INTERVAL 秒轮询队列
+        """
+        wait_timeout = defaults.WORKER_WAIT_TIMEOUT
+        pool = getattr(self.connection, 'connection_pool', None)
+        socket_timeout = pool.connection_kwargs.get('socket_timeout') if pool is not None else None
+        if socket_timeout:
+            wait_timeout = min(wait_timeout, int(float(socket_timeout) - 0.5))
+            if wait_timeout < 1:
+                self.log.warning('Worker %s: socket_timeout %s is too small to wait for notify, '
+                                 'poll queues every %ss', self.name, socket_timeout,
+                                 defaults.WORKER_POLL_INTERVAL)
+                return None
+        return wait_timeout
+
+    def _get_dequeue_batch_size(self):
+        """
+        批量出队的消息数, 不超过线程池的空闲线程数
+
+        消息出队时即设置为 started, 只出队可以立即执行的消息, 不在线程池的任务队列中等待
+
+        Returns:
+            (Int) 为 0 时没有空闲线程
+        """
+        max_workers = getattr(self.pool, '_max_workers', None)
+        if not max_workers:
+            return defaults.DEQUEUE_BATCH_SIZE
+        with self._in_flight_lock:
+            in_flight = self._in_flight
+        return min(defaults.DEQUEUE_BATCH_SIZE, max_workers - in_flight)
+
+    def _submit_msg(self, msg, queue):
+        """
+        提交消息到线程池, 执行完后(executor_callback)释放占用的线程数
+        """
+        with self._in_flight_lock:
+            self._in_flight += 1
+        try:
+            task = self.pool.submit(self.perform_msg, msg=msg, queue=queue)
+        except BaseException:
+            with self._in_flight_lock:
+                self._in_flight -= 1
+            raise
+        task.add_done_callback(self.executor_callback)
+
+    def enqueue_scheduled_msgs(self):
+        """
+        将到期的延迟消息移动到队列中, 并计算下次检查时间:
+        SCHEDULE_CHECK_INTERVAL 秒后, 或下一个延迟消息的执行时间(更早时)
+        """
+        next_time = self.queue_class.enqueue_scheduled(self.queues, connection=self.connection,
+                                                       msg_class=self.msg_class)
+        self._next_scheduled_time = next_time
+        self._next_schedule_check = time.time() + defaults.SCHEDULE_CHECK_INTERVAL
+        if next_time is not None and next_time < self._next_schedule_check:
+            self._next_schedule_check = next_time
+
+    def _get_idle_wait_timeout(self):
+        """
+        空闲时等待通知的时间, 不晚于下一个延迟消息的执行时间
+
+        Returns:
+            (Int) 秒, 最小为 1
+        """
+        wait_timeout = self.wait_timeout or defaults.WORKER_POLL_INTERVAL
+        if self._next_scheduled_time is not None:
+            to_next_time = int(math.ceil(self._next_scheduled_time - time.time()))
+            wait_timeout = min(wait_timeout, max(to_next_time, 1))
+        return wait_timeout
+
+    def wait_for_msgs(self):
+        """
+        所有队列为空时等待, 直到收到入队通知, 下一个延迟消息到期, 或超过 WORKER_IDLE_POLL_INTERVAL 秒
+
+        BLPOP 超时后不重新出队(空闲时只有 BLPOP 一个请求), 继续等待通知;
+        入队时会 push 通知, 延迟消息入队时也会通知, 返回后重新检查到期的延迟消息
+        """
+        if self.wait_timeout is None:
+            time.sleep(self._get_idle_wait_timeout())
+            self._next_schedule_check = 0
+            return
+
+        deadline = time.time() + defaults.WORKER_IDLE_POLL_INTERVAL
+        while not self._stop_requested:
+            queue_name = self.queue_class.wait_any(self.queues, timeout=self._get_idle_wait_timeout(),
+                                                   connection=self.connection)
+            if queue_name is not None:
+                break
+            now = time.time()
+            if now >= deadline:
+                break
+            if self._next_scheduled_time is not None and now >= self._next_scheduled_time:
+                break
+        self._next_schedule_check = 0
 
     def validate_queues(self):
         """Sanity check for the given queues."""
@@ -382,30 +491,35 @@ class Worker(object):
             for queue in queues.split(','):
                 self.queues.append(self.queue_class(queue, connection=self.connection, msg_class=self.msg_class))
 
-    def increment_failed_msg_count(self):
+    def increment_failed_msg_count(self, pipeline=None):
         """
         Incr failed msg count
         """
-        self.connection.hincrby(self.key, 'failed_msg_count', 1)
+        connection = pipeline if pipeline is not None else self.connection
+        connection.hincrby(self.key, 'failed_msg_count', 1)
 
-    def increment_successful_msg_count(self):
+    def increment_successful_msg_count(self, pipeline=None):
         """
         Incr successful msg count
         """
-        self.connection.hincrby(self.key, 'successful_msg_count', 1)
+        connection = pipeline if pipeline is not None else self.connection
+        connection.hincrby(self.key, 'successful_msg_count', 1)
 
-    def increment_total_working_time(self, msg_execution_time):
+    def increment_total_working_time(self, msg_execution_time, pipeline=None):
         """
         incr total working time
         """
-        self.connection.hincrbyfloat(self.key, 'total_working_time', msg_execution_time.total_seconds())
+        connection = pipeline if pipeline is not None else self.connection
+        connection.hincrbyfloat(self.key, 'total_working_time', msg_execution_time.total_seconds())
 
     def handle_msg_failure(self, msg, started_msg_registry=None,
-                           exc_string=''):
+                           exc_string='', pipeline=None):
         """Handles the failure or an executing msg by:
             1. Setting the msg status to failed
             2. Removing the msg from StartedMsgRegistry
             3. Add the msg to FailedMsgRegistry
+
+        所有操作在一个 MULTI/EXEC 中执行(一次往返); pipeline 不为 None 时追加到调用方的 pipeline 中, 由调用方 execute
         """
         if started_msg_registry is None:
             started_msg_registry = StartedMsgRegistry(
@@ -413,39 +527,47 @@ class Worker(object):
                 self.connection,
                 msg_class=self.msg_class
             )
+        pipe = pipeline if pipeline is not None else self.connection.pipeline()
 
         # 1. Setting the msg status to failed
-        msg.set_status(MsgStatus.FAILED)
+        msg.set_status(MsgStatus.FAILED, pipeline=pipe)
 
         # 2. Removing the msg from StartedMsgRegistry
-        started_msg_registry.remove(msg)
+        started_msg_registry.remove(msg, pipeline=pipe)
 
         # 3. Add the msg to FailedMsgRegistry
         failed_msg_registry = FailedMsgRegistry(msg.origin, msg.connection, msg_class=self.msg_class)
-        failed_msg_registry.add(msg, ttl=msg.failure_ttl, exc_string=exc_string)
+        failed_msg_registry.add(msg, ttl=msg.failure_ttl, exc_string=exc_string, pipeline=pipe)
 
-        self.increment_failed_msg_count()
+        self.increment_failed_msg_count(pipeline=pipe)
         if msg.started_at and msg.ended_at:
-            self.increment_total_working_time(msg.ended_at - msg.started_at)
+            self.increment_total_working_time(msg.ended_at - msg.started_at, pipeline=pipe)
+        if pipeline is None:
+            pipe.execute()
 
-    def handle_msg_success(self, msg, queue, started_msg_registry):
+    def handle_msg_success(self, msg, queue, started_msg_registry, pipeline=None):
         """
         Handle msg success
+
+        所有操作在一个 MULTI/EXEC 中执行(一次往返); pipeline 不为 None 时追加到调用方的 pipeline 中, 由调用方 execute
         """
         self.log.debug('Handling successful execution of msg %s', msg.id)
-        self.increment_successful_msg_count()
-        self.increment_total_working_time(msg.ended_at - msg.started_at)
+        pipe = pipeline if pipeline is not None else self.connection.pipeline()
+        self.increment_successful_msg_count(pipeline=pipe)
+        self.increment_total_working_time(msg.ended_at - msg.started_at, pipeline=pipe)
         result_ttl = msg.get_result_ttl(self.default_result_ttl)
         if result_ttl != 0:
-            msg.set_status(MsgStatus.FINISHED)
+            msg.set_status(MsgStatus.FINISHED, pipeline=pipe)
             # Don't clobber the user's meta dictionary!
-            msg.save(include_meta=False)
+            msg.save(include_meta=False, pipeline=pipe)
 
             finished_msg_registry = queue.finished_msg_registry
-            finished_msg_registry.add(msg, result_ttl)
+            finished_msg_registry.add(msg, result_ttl, pipeline=pipe)
 
-        msg.cleanup(result_ttl, remove_from_queue=False)
-        started_msg_registry.remove(msg)
+        msg.cleanup(result_ttl, remove_from_queue=False, pipeline=pipe)
+        started_msg_registry.remove(msg, pipeline=pipe)
+        if pipeline is None:
+            pipe.execute()
 
     @staticmethod
     def _get_safe_exception_string(exc_strings):
@@ -533,9 +655,8 @@ class Worker(object):
 
         started_msg_registry = queue.started_msg_registry
         try:
+            # status/started_at/handle_worker 已在出队时(Queue.dequeue_many)写入
             msg.started_at = utcnow()
-            msg.set_status(MsgStatus.STARTED)
-            msg.set_handle_worker(self.name)
 
             # gen req
             ip = msg.ip
@@ -557,24 +678,28 @@ class Worker(object):
             self._mk_ret(req, httpstatus, headers, content)
             msg.ended_at = utcnow()
 
-            # content is a set
-            msg._result = content[0]
+            # content is a tuple, or a generator for streaming responses
+            msg._result = "".join(content)
 
-            # set cost
+            # set cost, 与结束状态在同一个 MULTI/EXEC 中写入
             cost = time.time() - req.init_tm
             cost_str = "%.6f" % cost
-            msg.set_cost(cost_str)
+            pipe = self.connection.pipeline()
+            msg.set_cost(cost_str, pipeline=pipe)
 
             # Client or server error
             if req.log_ret_code == "ERR_BAD_PARAMS" or req.log_ret_code == "ERR_SERVER_EXCEPTION":
                 self.log.error('module=msg_exe topic={topic} status={status} msg_id={msg_id}'.format(
                     topic=msg.origin, status=req.log_ret_code, msg_id=msg.id))
                 exc_string = self._get_safe_exception_string(req.error_detail)
-                self.handle_msg_failure(msg=msg, exc_string=exc_string, started_msg_registry=started_msg_registry)
+                self.handle_msg_failure(msg=msg, exc_string=exc_string, started_msg_registry=started_msg_registry,
+                                        pipeline=pipe)
             else:
                 self.log.info('module=msg_exe topic={topic} status={status} msg_id={msg_id}'.format(
                     topic=msg.origin, status=req.log_ret_code, msg_id=msg.id))
-                self.handle_msg_success(msg=msg, queue=queue, started_msg_registry=started_msg_registry)
+                self.handle_msg_success(msg=msg, queue=queue, started_msg_registry=started_msg_registry,
+                                        pipeline=pipe)
+            pipe.execute()
 
         except BaseException:
             self.log.error('worker exe msg exception {exception_info}'.format(exception_info=traceback.format_exc()))
@@ -585,6 +710,8 @@ class Worker(object):
         """
         Record task execution exception
         """
+        with self._in_flight_lock:
+            self._in_flight -= 1
         logging.info("called worker callback function")
         task_exception = task.exception()
         if task_exception:
@@ -595,7 +722,7 @@ class Worker(object):
 
         Pops and performs all msgs on the current list of queues.  When all
         queues are empty, block and wait for new msgs to arrive on any of the
-        queues
+        queues (BLPOP on the queues' notify lists, see Queue.wait_any)
 
         The return value indicates whether any msgs were processed.
         """
@@ -605,23 +732,31 @@ class Worker(object):
                     self.log.info('Worker %s: stopping on request', self.key)
                     break
 
-                result = self.queue_class.dequeue_any(
-                    self.queues, connection=self.connection, msg_class=self.msg_class)
+                # 延迟消息: 忙碌时每 SCHEDULE_CHECK_INTERVAL 秒, 空闲时每次被唤醒后检查
+                if time.time() >= self._next_schedule_check:
+                    self.enqueue_scheduled_msgs()
 
-                if result is None:
-                    time.sleep(5)
+                batch_size = self._get_dequeue_batch_size()
+                if batch_size <= 0:
+                    time.sleep(0.02)
+                    continue
+
+                # 消息已设置为 started 并记录 started_at/handle_worker
+                result = self.queue_class.dequeue_many(
+                    self.queues, batch_size, connection=self.connection, msg_class=self.msg_class,
+                    handle_worker=self.name)
+
+                if not result:
+                    # 消息入队后立即被唤醒
+                    self.wait_for_msgs()
                     continue
 
                 if result == defaults.RATE_LIMITED:
                     time.sleep(0.02)
                     continue
 
-                msg, queue = result
-                msg.set_status(MsgStatus.STARTED)
-                self.connection.hset(msg.key, 'started_at', utcformat(utcnow()))
-
-                task = self.pool.submit(self.perform_msg, msg=msg, queue=queue)
-                task.add_done_callback(self.executor_callback)
+                for msg, queue in result:
+                    self._submit_msg(msg, queue)
             except BaseException:
                 self.log.error(
                     'worker get msg exception {exception_info}'.format(
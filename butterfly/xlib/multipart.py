@@ -0,0 +1,368 @@
+# coding:utf8
+"""
+# File Name: multipart.py
+# Description:
+    multipart/form-data 流式解析
+
+    (1) 按块读取请求 body, 增量查找 boundary, 内存占用与请求大小无关
+    (2) 普通字段保存为 str(不超过 max_field_size), 文件字段(带 filename)写入临时文件, 同时计算大小及 hash
+    (3) 解析失败时删除已写入的临时文件
+
+    由 httpgateway.Request.parse_multipart 使用, protocol_json 将解析结果合并到 handler 参数中
+
+    Examples:
+        parser = MultipartParser(get_boundary(wsgienv["CONTENT_TYPE"]))
+        for chunk in req.iter_body():
+            parser.feed(chunk)
+        for name, value in parser.close():
+            if isinstance(value, UploadFile):
+                value.save("/data/upload/" + value.filename)
+"""
+import os
+import shutil
+import hashlib
+import tempfile
+
+# 普通字段的最大大小
+MAX_FIELD_SIZE = 1024 * 1024
+# 单个 part 的 headers 最大大小
+MAX_HEADER_SIZE = 16 * 1024
+# 临时文件名前缀
+TEMP_PREFIX = "butterfly_upload_"
+
+# 解析状态
+_PREAMBLE = 0
+_DELIMITER = 1
+_HEADERS = 2
+_BODY = 3
+_DONE = 4
+_ABORTED = 5
+
+
+class MultipartError(ValueError):
+    """
+    multipart 格式错误或超出限制
+    """
+
+
+def get_boundary(content_type):
+    """
+    获取 multipart/form-data 的 boundary
+
+    Args:
+        content_type: (String) Content-Type 请求头
+    Returns:
+        (String) boundary, 不是 multipart/form-data 时返回 None
+    """
+    if not content_type or not content_type.lower().startswith("multipart/form-data"):
+        return None
+    _, params = parse_header(content_type)
+    return params.get("boundary") or None
+
+
+def parse_header(line):
+    """
+    解析带参数的 header 值
+
+    Args:
+        line: (String) eg: 'form-data; name="file"; filename="a.txt"'
+    Returns:
+        (Tuple) ("form-data", {"name": "file", "filename": "a.txt"}), 参数名为小写
+    """
+    value, _, rest = line.partition(";")
+    params = {}
+    while rest:
+        rest = rest.lstrip(" \t;")
+        name, eq, rest = rest.partition("=")
+        if not eq:
+            break
+        rest = rest.lstrip()
+        if rest.startswith('"'):
+            # 带引号的值, 支持 \" 转义(IE 的 filename 为未转义的 Windows 路径, 其他 \ 保留)
+            i = 1
+            chars = []
+            while i < len(rest) and rest[i] != '"':
+                if rest[i] == "\\" and rest[i + 1: i + 2] in ('"', "\\"):
+                    i += 1
+                chars.append(rest[i])
+                i += 1
+            param_value = "".join(chars)
+            rest = rest[i + 1:]
+        else:
+            param_value, _, rest = rest.partition(";")
+            param_value = param_value.strip()
+        params[name.strip().lower()] = param_value
+    return value.strip().lower(), params
+
+
+class UploadFile(object):
+    """
+    上传的文件, 内容保存在临时文件中
+
+    Attributes:
+        name        : (String) 字段名
+        filename    : (String) 客户端提供的文件名(已去掉目录部分)
+        content_type: (String) part 的 Content-Type
+        path        : (String) 临时文件路径
+        size        : (Int) 文件大小
+        hashes      : (Dict) 算法名 => hex digest
+    """
+    __slots__ = ("name", "filename", "content_type", "path", "size", "hashes", "_is_temp")
+
+    def __init__(self, name, filename, content_type, path):
+        self.name = name
+        # IE 等客户端会提供完整路径
+        self.filename = filename.replace("\\", "/").rsplit("/", 1)[-1]
+        self.content_type = content_type
+        self.path = path
+        self.size = 0
+        self.hashes = {}
+        self._is_temp = True
+
+    def __repr__(self):
+        return "<UploadFile %s %r %s>" % (self.name, self.filename, self.size)
+
+    def open(self):
+        """
+        Returns:
+            (File) 以二进制只读方式打开的临时文件
+        """
+        return open(self.path, "rb")
+
+    def save(self, path):
+        """
+        移动临时文件到 path (同一文件系统时为 rename)
+        """
+        shutil.move(self.path, path)
+        self.path = path
+        self._is_temp = False
+
+    def remove(self):
+        """
+        删除临时文件(已 save 的文件不删除)
+        """
+        if not self._is_temp:
+            return
+        self._is_temp = False
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+class MultipartParser(object):
+    """
+    multipart/form-data 增量解析
+
+    Attributes:
+        parts: (List) 已解析完成的 part, [(name, value)], 文件字段的 value 为 UploadFile
+    """
+
+    def __init__(self, boundary, hash_names=("md5",), max_field_size=MAX_FIELD_SIZE,
+                 spool_dir=None, spool=True):
+        """
+        Args:
+            boundary      : (String) Content-Type 中的 boundary
+            hash_names    : (Tuple) 文件字段计算的 hash(hashlib 支持的算法名)
+            max_field_size: (Int) 普通字段的最大大小
+            spool_dir     : (String) 临时文件目录, 为 None 时使用系统临时目录
+            spool         : (Bool) 文件字段是否写入临时文件, 为 False 时与普通字段相同, 保存为 str
+                            (body 已在内存中时使用, 同样受 max_field_size 限制)
+        """
+        if not boundary:
+            raise MultipartError("missing boundary")
+        self._delimiter = "\r\n--" + boundary
+        # 未确定是否为 delimiter 一部分的数据需要保留
+        self._keep = len(self._delimiter) + 1
+        self._hash_names = hash_names
+        self._max_field_size = max_field_size
+        self._spool_dir = spool_dir
+        self._spool = spool
+
+        # 第一个 boundary 前没有 \r\n
+        self._buf = "\r\n"
+        self._state = _PREAMBLE
+        self._part_name = None
+        self._field = None
+        self._field_size = 0
+        self._file = None
+        self._upload = None
+        self._hashes = None
+        self.parts = []
+
+    def feed(self, data):
+        """
+        解析一块数据
+
+        Raises:
+            MultipartError: 格式错误或超出限制
+        """
+        if self._state == _DONE:
+            # epilogue
+            return
+        if self._state == _ABORTED:
+            raise MultipartError("multipart parser aborted")
+        self._buf = self._buf + data if self._buf else data
+        try:
+            self._parse()
+        except BaseException:
+            self.abort()
+            raise
+
+    def close(self):
+        """
+        数据读取完成
+
+        Returns:
+            (List) [(name, value)]
+        Raises:
+            MultipartError: 数据不完整
+        """
+        if self._state != _DONE:
+            self.abort()
+            raise MultipartError("multipart body truncated")
+        return self.parts
+
+    def abort(self):
+        """
+        放弃解析, 删除已写入的临时文件
+        """
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            os.remove(self._upload.path)
+        for _, value in self.parts:
+            if isinstance(value, UploadFile):
+                value.remove()
+        self.parts = []
+        self._state = _ABORTED
+
+    def _parse(self):
+        buf = self._buf
+        delimiter = self._delimiter
+        while True:
+            if self._state == _BODY:
+                idx = buf.find(delimiter)
+                if idx < 0:
+                    # 保留可能是 delimiter 开头的数据
+                    if len(buf) > self._keep:
+                        self._write(buf[:-self._keep])
+                        buf = buf[-self._keep:]
+                    break
+                self._write(buf[:idx])
+                self._end_part()
+                buf = buf[idx + len(delimiter):]
+                self._state = _DELIMITER
+
+            elif self._state == _DELIMITER:
+                # delimiter 后为 "--"(结束) 或 空白 + "\r\n"
+                if buf.startswith("--"):
+                    self._state = _DONE
+                    buf = ""
+                    break
+                idx = buf.find("\r\n")
+                if idx < 0:
+                    if len(buf) > MAX_HEADER_SIZE:
+                        raise MultipartError("invalid boundary line")
+                    break
+                if buf[:idx].strip(" \t"):
+                    raise MultipartError("invalid boundary line")
+                buf = buf[idx + 2:]
+                self._state = _HEADERS
+
+            elif self._state == _HEADERS:
+                if buf.startswith("\r\n"):
+                    # part 没有 headers
+                    raise MultipartError("invalid Content-Disposition")
+                idx = buf.find("\r\n\r\n")
+                if idx < 0:
+                    if len(buf) > MAX_HEADER_SIZE:
+                        raise MultipartError("part headers too large")
+                    break
+                self._start_part(buf[:idx])
+                buf = buf[idx + 4:]
+                self._state = _BODY
+
+            elif self._state == _PREAMBLE:
+                idx = buf.find(delimiter)
+                if idx < 0:
+                    buf = buf[-self._keep:]
+                    break
+                buf = buf[idx + len(delimiter):]
+                self._state = _DELIMITER
+
+            else:
+                buf = ""
+                break
+        self._buf = buf
+
+    def _start_part(self, header_data):
+        headers = {}
+        for line in header_data.split("\r\n"):
+            name, sep, value = line.partition(":")
+            if sep:
+                headers[name.strip().lower()] = value.strip()
+
+        disposition, params = parse_header(headers.get("content-disposition", ""))
+        if disposition != "form-data" or "name" not in params:
+            raise MultipartError("invalid Content-Disposition")
+        self._part_name = params["name"]
+
+        if "filename" in params and self._spool:
+            fd, path = tempfile.mkstemp(prefix=TEMP_PREFIX, dir=self._spool_dir)
+            self._file = os.fdopen(fd, "wb")
+            self._upload = UploadFile(self._part_name, params["filename"],
+                                      headers.get("content-type", "application/octet-stream"), path)
+            self._hashes = [hashlib.new(name) for name in self._hash_names]
+        else:
+            self._field = []
+            self._field_size = 0
+
+    def _write(self, data):
+        if not data:
+            return
+        if self._file is not None:
+            self._file.write(data)
+            self._upload.size += len(data)
+            for h in self._hashes:
+                h.update(data)
+        else:
+            self._field_size += len(data)
+            if self._field_size > self._max_field_size:
+                raise MultipartError("field %s too large" % self._part_name)
+            self._field.append(data)
+
+    def _end_part(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            upload = self._upload
+            upload.hashes = dict(zip(self._hash_names, [h.hexdigest() for h in self._hashes]))
+            self._upload = None
+            self.parts.append((self._part_name, upload))
+        else:
+            self.parts.append((self._part_name, "".join(self._field)))
+            self._field = None
+
+
+def parse(chunks, boundary, **kwargs):
+    """
+    解析 multipart/form-data
+
+    Args:
+        chunks: (Iterable) 请求 body 数据块, eg: req.iter_body()
+        boundary: (String) boundary
+        kwargs: MultipartParser 参数
+    Returns:
+        (List) [(name, value)], 文件字段的 value 为 UploadFile
+    Raises:
+        MultipartError: 格式错误或超出限制
+    """
+    parser = MultipartParser(boundary, **kwargs)
+    try:
+        for chunk in chunks:
+            parser.feed(chunk)
+    except BaseException:
+        parser.abort()
+        raise
+    return parser.close()
@@ -24,6 +24,8 @@
             文件没读权限时，HTTP 状态码为 403
             检查参数错误时，HTTP 状态码为 400
             程序执行异常时，HTTP 状态码为 500
+            文件未修改时(If-None-Match/If-Modified-Since)，HTTP 状态码为 304
+            Range 请求时，HTTP 状态码为 206(多个范围时为 multipart/byteranges)，范围无法满足时为 416
         HTTP 响应 Content-Type:
             文件 is_download 为 True 时，会根据文件后缀名进行识别文件类型
             文件 is_download 为 False 时，响应内容类型均为 ("Content-Type", "text/html")
@@ -35,6 +37,8 @@ import httplib
 import mimetypes
 
 
+from xlib import bulkhead
+from xlib import deadline
 from xlib import httpgateway
 from xlib import retstat
 
@@ -43,15 +47,17 @@ class Protocol(object):
     """HTTP Response
     Attributes:
         _func               : (Object) func
+        _schema             : (httpgateway.ParamSchema) handler 参数描述
         _errlog             : (Object) err log logger
         _code_err           : (String) retstat.ERR_SERVER_EXCEPTION (500)
         _code_badparam      : (String) retstat.ERR_BAD_PARAMS (400)
         _is_parse_post      : (Bool) Whether to convert the data in body in post request to dict
         _is_encode_response : (Bool) Whether to return handler results as JSON to HTTP content
+        bulkhead            : (Object) xlib.bulkhead.Bulkhead, handler 未使用 funcattr.max_concurrency 时为 None
     """
 
     def __init__(self, func, code_err, code_badparam,
-                 is_parse_post, is_encode_response, errlog):
+                 is_parse_post, is_encode_response, errlog, schema=None):
         """
         Args:
             func               : (Object) func
@@ -61,14 +67,19 @@ class Protocol(object):
             is_encode_response : (Bool) Whether to return handler results as JSON to HTTP content
                                : 此处用于处理静态文件，所以不是序列化为 JSON
             errlog             : (Object) err log logger
+            schema             : (httpgateway.ParamSchema) handler 参数描述, 为 None 时根据 func 生成
         """
         self._func = func
+        self._schema = schema or httpgateway.ParamSchema(func)
         self._errlog = errlog
         self._code_err = code_err
         self._code_badparam = code_badparam
         self._is_parse_post = is_parse_post
         self._is_encode_response = False
 
+        concurrencyattr = getattr(func, "concurrencyattr", None)
+        self.bulkhead = bulkhead.Bulkhead(**concurrencyattr) if concurrencyattr else None
+
     def _mk_ret(self, req, stat, data, headers):
         """
         将 handler 结果进行封装, 封装为 JSON 后进行返回
@@ -101,23 +112,21 @@ class Protocol(object):
             mimetype, encoding = mimetypes.guess_type(filename)
             if (mimetype[:5] == 'text/' or mimetype == 'application/javascript') and 'charset' not in mimetype:
                 mimetype += '; charset=UTF-8'
-            headers.append(("Content-Type", mimetype))
         else:
-            headers.append(("Content-Type", "text/html; charset=UTF-8"))
+            mimetype = "text/html; charset=UTF-8"
 
         try:
-            with open(filename) as f:
-                filecontent = f.read()
-
+            # 支持条件请求(304)及 Range 请求(206), 文件内容由 server 按块(或 sendfile)发送
+            code, file_headers, content = httpgateway.file_response(req.wsgienv, filename, mimetype)
         except BaseException:
             req.log(self._errlog, "Open file failed\n%s" % traceback.format_exc())
             req.error_str = "Open file Failed"
             status_line = "%s %s" % (500, httplib.responses.get(500, ""))
             return status_line, [], ""
 
-        stats = os.stat(filename)
-        headers.append(("Content-Length", str(stats.st_size)))
-        return "200 OK", headers, filecontent
+        headers.extend(file_headers)
+        status_line = "%s %s" % (code, httplib.responses.get(code, ""))
+        return status_line, headers, content
 
     def _mk_err_ret(self, req, err_code, err_msg, log_msg):
         """make err return
@@ -143,13 +152,19 @@ class Protocol(object):
         # 请求参数获取和检查
         try:
             params = httpgateway.httpget2dict(req.wsgienv.get("QUERY_STRING"))
+            if req.path_params:
+                params.update(req.path_params)
             req.log_params.update(params)
 
             params["req"] = req
 
-            if not httpgateway.check_param(self._func, params):
+            if not self._schema.check(params):
                 return self._mk_err_ret(req, retstat.HTTP_BAD_PARAM, "Param check failed",
                                         "%s Param check failed" % req.ip)
+            self._schema.coerce(params)
+        except httpgateway.ParamTypeError as e:
+            return self._mk_err_ret(req, retstat.HTTP_BAD_PARAM, "Param type error",
+                                    "%s Param type error %s" % (req.ip, e))
         except BaseException:
             return self._mk_err_ret(req, retstat.HTTP_BAD_PARAM, "Param check exception",
                                     "%s Param check failed\n%s" % (req.ip, traceback.format_exc()))
@@ -176,5 +191,8 @@ class Protocol(object):
             return self._mk_ret(req, code, data, headers)
 
         except BaseException:
+            if deadline.expired():
+                return self._mk_err_ret(req, retstat.HTTP_GATEWAY_TIMEOUT, "Deadline Exceeded",
+                                        "Deadline exceeded\n%s" % traceback.format_exc())
             return self._mk_err_ret(req, retstat.HTTP_SERVER_ERROR, "API Processing Exception",
                                     "Server exception\n%s" % traceback.format_exc())
@@ -17,6 +17,22 @@
 
     HTTP 请求方法
 
+    流式响应:
+        handler 返回的 data 中的值为迭代器(如 generator)时, 该字段以 JSON 数组的形式逐个序列化输出,
+        不设置 Content-Length (HTTP/1.1 使用 Transfer-Encoding: chunked), 其他字段及 stat 正常输出
+        eg: return retstat.OK, {"total": total, "list": (row.to_dict() for row in query.iterator())}
+        迭代过程中出现异常时, 响应已开始发送, 记录 err 日志后断开连接
+
+    二进制编码:
+        请求头 Accept 为 application/x-mcpack 或 application/x-msgpack(需安装 msgpack) 时, 响应使用对应编码,
+        响应头 Content-Type 为对应类型, 并带有 Vary: Accept; 数据无法编码时回退为 JSON
+        POST 请求的 Content-Type 为上述类型时, 按对应编码解析请求 body
+
+    文件上传:
+        POST 请求的 Content-Type 为 multipart/form-data 时流式解析请求 body(见 xlib/multipart.py),
+        普通字段为 str, 文件字段写入临时文件, 参数值为 multipart.UploadFile(含 size 及 md5), 请求结束后删除未 save 的临时文件
+        eg: def upload(req, title, file): file.save("/data/" + file.filename); return retstat.OK, {"md5": file.hashes["md5"]}
+
     HTTP 响应状态码及 Content-Type:
         当需要序列化为 JSON 时, HTTP 状态码均为 200, 响应内容类型均为 ("Content-Type", "application/json"):
             检查参数错误时，返回 {"stat": "ERR_BAD_PARAMS"}
@@ -27,20 +43,30 @@
 """
 
 import traceback
-import json
 import httplib
 import logging
 import collections
 
+from xlib import bulkhead
+from xlib import deadline
 from xlib import httpgateway
+from xlib import retstat
+from xlib import response_cache
 from xlib.util import json_util
+from xlib.util import pack_util
 from conf import config
 
+# 流式响应时, 累积到此大小后写出一个 chunk
+STREAM_BUFFER_SIZE = 64 * 1024
+# 响应缓存(funcattr.cached)时允许 handler 返回的 headers(小写), 返回其他 headers 时不缓存
+CACHEABLE_HEADERS = ("cache-control", "content-type")
+
 
 class Protocol(object):
     """HTTP Response
     Attributes:
         _func               : (Object) func
+        _schema             : (httpgateway.ParamSchema) handler 参数描述
         _errlog             : (Object) err log logger
         _code_err           : (String) retstat.ERR_SERVER_EXCEPTION
                             : 需要序列化为 JSON 时使用
@@ -48,10 +74,13 @@ class Protocol(object):
                             : 需要序列化为 JSON 时使用
         _is_parse_post      : (Bool) Whether to convert the data in body in post request to dict
         _is_encode_response : (Bool) Whether to return handler results as JSON to HTTP content
+        _cache              : (Object) xlib.response_cache.ResponseCache, handler 未使用 funcattr.cached 时为 None
+        _cache_vary         : (List) 作为缓存 key 的参数名, 为 None 时使用所有参数
+        bulkhead            : (Object) xlib.bulkhead.Bulkhead, handler 未使用 funcattr.max_concurrency 时为 None
     """
 
     def __init__(self, func, code_err, code_badparam,
-                 is_parse_post, is_encode_response, errlog):
+                 is_parse_post, is_encode_response, errlog, schema=None):
         """
         Args:
             func               : (Object) func
@@ -60,8 +89,10 @@ class Protocol(object):
             is_parse_post      : (Bool) Whether to convert the data in body in post request to dict
             is_encode_response : (Bool) Whether to return handler results as JSON to HTTP content
             errlog             : (Object) err log logger
+            schema             : (httpgateway.ParamSchema) handler 参数描述, 为 None 时根据 func 生成
         """
         self._func = func
+        self._schema = schema or httpgateway.ParamSchema(func)
         self._errlog = errlog
         self._code_err = code_err
         self._code_badparam = code_badparam
@@ -69,6 +100,61 @@ class Protocol(object):
         self._is_encode_response = is_encode_response
         self._stat_adaptor = config.STAT_ADAPTOR
 
+        concurrencyattr = getattr(func, "concurrencyattr", None)
+        self.bulkhead = bulkhead.Bulkhead(**concurrencyattr) if concurrencyattr else None
+
+        self._cache = None
+        self._cache_vary = None
+        cacheattr = getattr(func, "cacheattr", None)
+        if cacheattr and is_encode_response:
+            self._cache = response_cache.ResponseCache(cacheattr["ttl"],
+                                                       cacheattr["max_bytes"] or config.RESPONSE_CACHE_SIZE)
+            self._cache_vary = cacheattr["vary"]
+
+    def stats(self):
+        """
+        响应缓存统计
+
+        Returns:
+            (Dict), 未开启缓存时返回 None
+        """
+        if self._cache is None:
+            return None
+        return self._cache.stats()
+
+    def _cache_key(self, params):
+        """
+        根据参数生成缓存 key, 参数已经过类型转换, 如 page_index=1 与 page_index=01 为同一个 key
+
+        Returns:
+            (String), 参数无法序列化时返回 None(不缓存)
+        """
+        if self._cache_vary is None:
+            values = sorted((k, v) for k, v in params.iteritems() if k != "req")
+        else:
+            values = [params.get(name) for name in self._cache_vary]
+        try:
+            return json_util.dumps(values, sort_keys=True)
+        except (TypeError, ValueError):
+            return None
+
+    def _mk_cached_ret(self, req, entry):
+        """
+        返回缓存的响应, If-None-Match 匹配时返回 304
+
+        Args:
+            req     : (Object) Request instance
+            entry   : (Object) xlib.response_cache.Entry
+        Returns:
+            status, headders, content
+        """
+        req.log_ret_code = entry.stat
+        if req.wsgienv.get("HTTP_IF_NONE_MATCH") and httpgateway.is_not_modified(req.wsgienv, entry.etag, 0):
+            return "304 Not Modified", [("ETag", entry.etag)], ""
+        headers = list(entry.headers)
+        headers.append(("ETag", entry.etag))
+        return "200 OK", headers, (entry.body,)
+
     def _mk_ret(self, req, stat, data, headers):
         """
         将 handler 结果进行封装, 封装为 JSON 后进行返回
@@ -85,6 +171,23 @@ class Protocol(object):
             data = {}
         if headers is None:
             headers = []
+        stream_keys = [k for k, v in data.iteritems() if isinstance(v, collections.Iterator)]
+        if stream_keys:
+            self._fill_stat(data, stat)
+            return "200 OK", headers, self._iter_json_content(req, data, stream_keys)
+        content_type = pack_util.negotiate(req.wsgienv.get("HTTP_ACCEPT"))
+        if content_type:
+            self._fill_stat(data, stat)
+            try:
+                content = pack_util.dumps(content_type, data)
+            except (TypeError, ValueError):
+                req.log(self._errlog, "Pack {content_type} failed, fallback to json\n{exc}".format(
+                    content_type=content_type, exc=traceback.format_exc()))
+            else:
+                headers.append(("Content-Type", content_type))
+                headers.append(("Vary", "Accept"))
+                headers.append(("Content-Length", str(len(content))))
+                return "200 OK", headers, (content,)
         try:
             jsoncontent = self._mk_json_content(data, stat)
         except BaseException:
@@ -104,6 +207,17 @@ class Protocol(object):
         Returns:
             ret : (json)
         """
+        self._fill_stat(data, stat)
+        return self._dumps(data)
+
+    def _fill_stat(self, data, stat=None):
+        """
+        设置 stat 字段, 并按 STAT_ADAPTOR 进行状态字段转换
+
+        Args:
+            data: (Dict) return content
+            stat: (string) Value with the name stat in the return value
+        """
         if stat is not None:
             data["stat"] = stat
 
@@ -120,10 +234,76 @@ class Protocol(object):
 
             data[message_name] = stat_msg
 
-        ret = json.dumps(data, default=json_util.json_default)
-        if isinstance(ret, unicode):
-            ret = ret.encode("utf8")
-        return ret
+    @staticmethod
+    def _dumps(obj):
+        """
+        序列化为 JSON(utf8 编码的 str)
+        """
+        return json_util.dumps(obj)
+
+    def _iter_json_content(self, req, data, stream_keys):
+        """
+        流式生成 JSON, stream_keys 中的字段为迭代器, 逐个序列化为 JSON 数组
+
+        Args:
+            req         : (Object) Request instance
+            data        : (Dict) return content, 已设置 stat
+            stream_keys : (List) 值为迭代器的字段
+        Yields:
+            JSON 片段, 每段不小于 STREAM_BUFFER_SIZE(最后一段除外)
+        """
+        try:
+            head = dict((k, v) for k, v in data.iteritems() if k not in stream_keys)
+            # 去掉末尾的 "}", 后面追加流式字段
+            buf = [self._dumps(head)[:-1]]
+            size = 0
+            for index, key in enumerate(stream_keys):
+                if head or index:
+                    buf.append(", ")
+                buf.append(self._dumps(key) + ": [")
+                for count, item in enumerate(data[key]):
+                    item = self._dumps(item)
+                    if count:
+                        buf.append(", ")
+                    buf.append(item)
+                    size += len(item)
+                    if size >= STREAM_BUFFER_SIZE:
+                        yield "".join(buf)
+                        buf = []
+                        size = 0
+                buf.append("]")
+            buf.append("}")
+            yield "".join(buf)
+        except GeneratorExit:
+            # 客户端断开连接
+            raise
+        except BaseException:
+            req.log(self._errlog, "Stream json failed\n%s" % traceback.format_exc())
+            raise
+        finally:
+            for key in stream_keys:
+                close = getattr(data[key], "close", None)
+                if close is not None:
+                    close()
+
+    def _mk_deadline_ret(self, req):
+        """
+        handler 因超过请求 deadline 失败(redis/mysql/http 超时或 deadline.DeadlineExceeded)
+
+        Returns:
+            status, headders, content
+        """
+        req.error_str = "Deadline Exceeded"
+        req.log(self._errlog, "client_ip={client_ip} err_info=Deadline_exceeded deadline={deadline:.3f} exc={exc}".format(
+            client_ip=req.ip, deadline=req.deadline, exc=traceback.format_exc().strip().splitlines()[-1]))
+
+        if self._is_encode_response:
+            req.log_ret_code = retstat.ERR_DEADLINE_EXCEEDED
+            return self._mk_ret(req, retstat.ERR_DEADLINE_EXCEEDED, None, [])
+        else:
+            req.log_ret_code = retstat.HTTP_GATEWAY_TIMEOUT
+            status_line = "%s %s" % (retstat.HTTP_GATEWAY_TIMEOUT, httplib.responses[retstat.HTTP_GATEWAY_TIMEOUT])
+            return status_line, [], ""
 
     def _mk_err_ret(self, req, is_bad_param, err_msg, log_msg):
         """make err return
@@ -157,26 +337,53 @@ class Protocol(object):
         try:
             params = httpgateway.httpget2dict(req.wsgienv.get("QUERY_STRING"))
             if self._is_parse_post and req.wsgienv.get("REQUEST_METHOD") == "POST":
-                post_data = httpgateway.read_wsgi_post(req.wsgienv)
-                if post_data:
-                    post_params = json.loads(post_data)
+                # multipart/form-data: 流式解析, 文件字段为 multipart.UploadFile
+                multipart_parts = req.parse_multipart()
+                post_data = httpgateway.read_wsgi_post(req.wsgienv) if multipart_parts is None else None
+                if multipart_parts:
+                    for k, v in multipart_parts:
+                        params[k] = v
+                elif post_data:
+                    body_type = pack_util.content_type_of(req.wsgienv)
+                    if body_type:
+                        post_params = pack_util.loads(body_type, post_data)
+                    else:
+                        post_params = json_util.loads(post_data)
                     for k, v in post_params.iteritems():
                         params[str(k)] = v
             elif req.wsgienv.get("REQUEST_METHOD") == "QUEUE":
                 # 表明此请求是百川拼装的请求
                 msg_data = req.wsgienv.get("MSG_DATA")
-                msg_params = json.loads(msg_data)
+                msg_params = json_util.loads(msg_data)
                 for k, v in msg_params.iteritems():
                     params[str(k)] = v
 
+            if req.path_params:
+                params.update(req.path_params)
             req.log_params.update(params)
 
             params["req"] = req
 
-            if not httpgateway.check_param(self._func, params):
+            if not self._schema.check(params):
                 return self._mk_err_ret(req, True, "Param check failed",
                                         "client_ip={client_ip} err_info=Param_check_failed params={params}".format(
                                             client_ip=req.ip, params=str(params)))
+            self._schema.coerce(params)
+
+            cache_key = None
+            if self._cache is not None:
+                cache_key = self._cache_key(params)
+                content_type = pack_util.negotiate(req.wsgienv.get("HTTP_ACCEPT"))
+                if cache_key is not None and content_type:
+                    cache_key = "%s|%s" % (cache_key, content_type)
+                entry = self._cache.get(cache_key) if cache_key is not None else None
+                if entry is not None:
+                    req.log_res.add("cache=hit")
+                    return self._mk_cached_ret(req, entry)
+        except httpgateway.ParamTypeError as e:
+            return self._mk_err_ret(req, True, "Param type error",
+                                    "client_ip={client_ip} err_info=Param_type_error msg={msg}".format(
+                                        client_ip=req.ip, msg=str(e)))
         except BaseException:
             return self._mk_err_ret(req, True, "Param check exception",
                                     "%s Param check failed\n%s" % (req.ip, traceback.format_exc()))
@@ -203,8 +410,15 @@ class Protocol(object):
                     return self._mk_err_ret(req, False, "Invalid ret format", "Invalid ret format %s" % type(ret))
 
                 req.log_ret_code = code
+                # handler 返回的 headers 只有 CACHEABLE_HEADERS 时才缓存, 如 Set-Cookie 不能返回给其他请求
+                cacheable = cache_key is not None and code == retstat.OK and all(
+                    name.lower() in CACHEABLE_HEADERS for name, _ in headers or [])
                 # 如果执行到这里，说明函数处理逻辑正常，此处会返回 200 状态码
-                return self._mk_ret(req, code, data, headers)
+                status, headers, content = self._mk_ret(req, code, data, headers)
+                if cacheable and isinstance(content, tuple) and content:
+                    entry = self._cache.put(cache_key, code, content[0], headers)
+                    return self._mk_cached_ret(req, entry)
+                return status, headers, content
             else:
                 status = 500
                 data = ""
@@ -235,5 +449,7 @@ class Protocol(object):
                 status_line = "%s %s" % (status, httplib.responses.get(status, ""))
                 return status_line, headers, data
         except BaseException:
+            if deadline.expired():
+                return self._mk_deadline_ret(req)
             return self._mk_err_ret(req, False, "API Processing Exception",
                                     "Server exception\n%s" % traceback.format_exc())
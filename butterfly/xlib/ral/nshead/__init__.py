@@ -8,6 +8,9 @@
     nshead 包
 """
 import struct
+
+from xlib import deadline
+
 nsead_body_len = 36
 
 
@@ -67,12 +70,14 @@ def nshead_write(sock, info, custom=None):
     msglen = len(send_nshead_info + info)
     totalsent = 0
     infosent = 0
-    while totalsent < msglen:
-        sent = sock.send(send_nshead_info + info[infosent:])
-        if sent == 0:
-            raise RuntimeError("socket connection broken")
-        totalsent = totalsent + sent
-        infosent = totalsent - nsead_body_len
+    # 有请求 deadline 时按剩余时间缩短超时
+    with deadline.socket_timeout(sock):
+        while totalsent < msglen:
+            sent = sock.send(send_nshead_info + info[infosent:])
+            if sent == 0:
+                raise RuntimeError("socket connection broken")
+            totalsent = totalsent + sent
+            infosent = totalsent - nsead_body_len
     return totalsent
 
 
@@ -82,14 +87,16 @@ def nshead_read(sock):
     # sock 发送的套接字
     """
     msg = ''
-    info = sock.recv(nsead_body_len)
-    if info == '':
-        raise RuntimeError("socket connection broken")
-    receive_nshead = Nshead()
-    receive_nshead.load(info)
-    while(len(msg) < receive_nshead.head['body_len']):
-        recever_buf = sock.recv(receive_nshead.head['body_len'])
-        if recever_buf == '':
+    # 有请求 deadline 时按剩余时间缩短超时
+    with deadline.socket_timeout(sock):
+        info = sock.recv(nsead_body_len)
+        if info == '':
             raise RuntimeError("socket connection broken")
-        msg = msg + recever_buf
+        receive_nshead = Nshead()
+        receive_nshead.load(info)
+        while(len(msg) < receive_nshead.head['body_len']):
+            recever_buf = sock.recv(receive_nshead.head['body_len'])
+            if recever_buf == '':
+                raise RuntimeError("socket connection broken")
+            msg = msg + recever_buf
     return msg
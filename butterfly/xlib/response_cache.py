@@ -0,0 +1,162 @@
+# coding:utf8
+"""
+# File Name: response_cache.py
+# Description:
+    handler 响应内存缓存
+
+    (1) 缓存序列化后的响应 body 及 headers, 命中时不再执行 handler 及序列化 JSON
+    (2) 每条缓存 ttl 秒后过期, LRU 淘汰, 总大小不超过 max_bytes
+    (3) 每条缓存带有强 ETag(body 的 md5), 用于 If-None-Match 条件请求
+
+    由 protocol_json.Protocol 对使用 funcattr.cached 的 handler 使用, 每个路由一个实例
+"""
+import time
+import hashlib
+import threading
+import collections
+
+
+class Entry(object):
+    """
+    缓存的响应
+
+    Attributes:
+        stat    : (String) handler 返回的状态
+        body    : (String) 序列化后的响应 body
+        headers : (Tuple) 响应头
+        etag    : (String) 强 ETag
+        expires : (Float) 过期时间
+    """
+    __slots__ = ("stat", "body", "headers", "etag", "expires")
+
+    def __init__(self, stat, body, headers, expires):
+        self.stat = stat
+        self.body = body
+        self.headers = tuple(headers)
+        self.etag = make_etag(body)
+        self.expires = expires
+
+    @property
+    def nbytes(self):
+        """
+        占用的内存大小(仅计算 body)
+        """
+        return len(self.body)
+
+
+def make_etag(body):
+    """
+    强 ETag
+
+    Args:
+        body: (String) 响应 body
+    Returns:
+        (String) eg: "5d41402abc4b2a76b9719d911017c592"
+    """
+    return '"%s"' % hashlib.md5(body).hexdigest()
+
+
+class ResponseCache(object):
+    """
+    响应 LRU 缓存
+
+    Attributes:
+        ttl        : (Float) 缓存有效期(s)
+        max_bytes  : (Int) 缓存总大小上限
+        hits/misses/evictions/expired: (Int) 统计
+    """
+
+    def __init__(self, ttl, max_bytes):
+        """
+        Args:
+            ttl      : (Float) 缓存有效期(s)
+            max_bytes: (Int) 缓存总大小上限
+        """
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expired = 0
+        self._nbytes = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        获取未过期的缓存
+
+        Args:
+            key: (String) 缓存 key
+        Returns:
+            Entry, 不存在或已过期时返回 None
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry.expires <= time.time():
+                self._nbytes -= entry.nbytes
+                self.expired += 1
+                self.misses += 1
+                return None
+            # LRU: 移动到末尾
+            self._entries[key] = entry
+            self.hits += 1
+            return entry
+
+    def put(self, key, stat, body, headers):
+        """
+        加入缓存, 超出 max_bytes 时淘汰最久未使用的响应
+
+        Args:
+            key     : (String) 缓存 key
+            stat    : (String) handler 返回的状态
+            body    : (String) 序列化后的响应 body
+            headers : (List) 响应头
+        Returns:
+            Entry
+        """
+        entry = Entry(stat, body, headers, time.time() + self.ttl)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._nbytes -= old.nbytes
+            if entry.nbytes > self.max_bytes:
+                return entry
+            self._entries[key] = entry
+            self._nbytes += entry.nbytes
+            while self._nbytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._nbytes -= evicted.nbytes
+                self.evictions += 1
+        return entry
+
+    def clear(self):
+        """
+        清空缓存
+        """
+        with self._lock:
+            self._entries.clear()
+            self._nbytes = 0
+
+    def stats(self):
+        """
+        缓存统计
+
+        Returns:
+            (Dict)
+        """
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._nbytes,
+                "max_bytes": self.max_bytes,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expired": self.expired,
+            }
@@ -7,6 +7,12 @@ OK = "OK"
 ERR = "ERR"
 ERR_BAD_PARAMS = "ERR_BAD_PARAMS"
 ERR_SERVER_EXCEPTION = "ERR_SERVER_EXCEPTION"
+# 排队超时, 请求被丢弃(load shedding)
+ERR_LOAD_SHED = "ERR_LOAD_SHED"
+# 路由并发数已达上限(funcattr.max_concurrency), 请求被拒绝
+ERR_CONCURRENCY_LIMIT = "ERR_CONCURRENCY_LIMIT"
+# 超过请求 deadline(X-Request-Timeout/X-Request-Deadline)
+ERR_DEADLINE_EXCEEDED = "ERR_DEADLINE_EXCEEDED"
 
 HTTP_OK = 200
 # 重定向
@@ -21,3 +27,7 @@ HTTP_NOT_FOUND = 404
 HTTP_PART_NOT_FOUND = 406
 # 服务端异常
 HTTP_SERVER_ERROR = 500
+# 服务过载
+HTTP_SERVICE_UNAVAILABLE = 503
+# 超过请求 deadline
+HTTP_GATEWAY_TIMEOUT = 504
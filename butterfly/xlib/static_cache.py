@@ -0,0 +1,212 @@
+# coding:utf8
+"""
+# File Name: static_cache.py
+# Description:
+    静态文件内存缓存
+
+    (1) 按路径缓存文件内容, LRU 淘汰, 总大小不超过 max_bytes
+    (2) 每个文件最多每 check_interval 秒 stat 一次, mtime/大小/inode 变化时重新加载
+    (3) 可压缩类型(text/*, js, json ...)同时缓存 gzip 压缩后的内容
+
+    由 httpgateway.WSGIGateway 在处理静态文件请求时使用
+"""
+import os
+import stat
+import gzip
+import time
+import threading
+import mimetypes
+import collections
+from cStringIO import StringIO
+
+# 可压缩的 Content-Type(text/* 之外)
+COMPRESSIBLE_TYPES = set([
+    "application/javascript",
+    "application/x-javascript",
+    "application/json",
+    "application/xml",
+    "image/svg+xml",
+])
+
+
+class Entry(object):
+    """
+    缓存的静态文件
+
+    Attributes:
+        data        : (String) 文件内容
+        gzip_data   : (String) gzip 压缩后的内容, 不可压缩时为 None
+        content_type: (String) 根据后缀名识别的 Content-Type, 无法识别时为 None
+        size        : (Int) 文件大小
+        mtime       : (Int) 修改时间
+        ino         : (Int) inode
+        checked     : (Float) 上次检查文件是否变化的时间
+    """
+    __slots__ = ("data", "gzip_data", "content_type", "size", "mtime", "ino", "checked")
+
+    def __init__(self, data, gzip_data, content_type, stats, checked):
+        self.data = data
+        self.gzip_data = gzip_data
+        self.content_type = content_type
+        self.size = stats.st_size
+        self.mtime = int(stats.st_mtime)
+        self.ino = stats.st_ino
+        self.checked = checked
+
+    @property
+    def nbytes(self):
+        """
+        占用的内存大小
+        """
+        return len(self.data) + len(self.gzip_data or "")
+
+    def is_stale(self, stats):
+        """
+        文件是否已变化
+        """
+        return (self.size, self.mtime, self.ino) != (stats.st_size, int(stats.st_mtime), stats.st_ino)
+
+
+class StaticCache(object):
+    """
+    静态文件 LRU 缓存
+
+    Attributes:
+        max_bytes      : (Int) 缓存总大小上限
+        max_file_size  : (Int) 超过此大小的文件不缓存
+        check_interval : (Float) 同一文件两次 stat 的最小间隔(s)
+        hits/misses/evictions: (Int) 统计
+    """
+
+    def __init__(self, max_bytes, max_file_size=1024 * 1024, check_interval=2, gzip_min_size=256):
+        """
+        Args:
+            max_bytes      : (Int) 缓存总大小上限
+            max_file_size  : (Int) 超过此大小的文件不缓存
+            check_interval : (Float) 同一文件两次 stat 的最小间隔(s)
+            gzip_min_size  : (Int) 小于此大小的文件不压缩
+        """
+        self.max_bytes = max_bytes
+        self.max_file_size = max_file_size
+        self.check_interval = check_interval
+        self.gzip_min_size = gzip_min_size
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._nbytes = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        """
+        获取缓存的文件, 必要时加载或重新加载
+
+        Args:
+            path: (String) 文件路径
+        Returns:
+            Entry, 文件不存在/不是普通文件/太大时返回 None (由调用方直接读文件)
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.pop(path, None)
+            if entry is not None:
+                # LRU: 移动到末尾
+                self._entries[path] = entry
+                if now - entry.checked < self.check_interval:
+                    self.hits += 1
+                    return entry
+
+        try:
+            stats = os.stat(path)
+        except OSError:
+            self._remove(path)
+            return None
+
+        if not stat.S_ISREG(stats.st_mode) or stats.st_size > self.max_file_size:
+            self._remove(path)
+            return None
+
+        if entry is not None and not entry.is_stale(stats):
+            entry.checked = now
+            with self._lock:
+                self.hits += 1
+            return entry
+
+        entry = self._load(path, now)
+        with self._lock:
+            self.misses += 1
+            if entry is not None:
+                self._put(path, entry)
+        return entry
+
+    def _load(self, path, now):
+        """
+        读取文件, 可压缩时生成 gzip 内容
+        """
+        try:
+            with open(path, "rb") as f:
+                stats = os.fstat(f.fileno())
+                if stats.st_size > self.max_file_size:
+                    return None
+                data = f.read()
+        except (IOError, OSError):
+            return None
+
+        content_type = mimetypes.guess_type(path)[0]
+        gzip_data = None
+        if len(data) >= self.gzip_min_size and self._is_compressible(content_type):
+            buf = StringIO()
+            gz = gzip.GzipFile(fileobj=buf, mode="wb", compresslevel=6, mtime=int(stats.st_mtime))
+            gz.write(data)
+            gz.close()
+            # 压缩效果不明显时不保存
+            if buf.tell() < len(data) * 0.9:
+                gzip_data = buf.getvalue()
+
+        return Entry(data, gzip_data, content_type, stats, now)
+
+    @staticmethod
+    def _is_compressible(content_type):
+        if not content_type:
+            return False
+        return content_type.startswith("text/") or content_type in COMPRESSIBLE_TYPES
+
+    def _put(self, path, entry):
+        """
+        加入缓存, 超出 max_bytes 时淘汰最久未使用的文件(需持有锁)
+        """
+        old = self._entries.pop(path, None)
+        if old is not None:
+            self._nbytes -= old.nbytes
+        if entry.nbytes > self.max_bytes:
+            return
+        self._entries[path] = entry
+        self._nbytes += entry.nbytes
+        while self._nbytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._nbytes -= evicted.nbytes
+            self.evictions += 1
+
+    def _remove(self, path):
+        with self._lock:
+            entry = self._entries.pop(path, None)
+            if entry is not None:
+                self._nbytes -= entry.nbytes
+
+    def stats(self):
+        """
+        缓存统计
+
+        Returns:
+            (Dict)
+        """
+        with self._lock:
+            return {
+                "files": len(self._entries),
+                "bytes": self._nbytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
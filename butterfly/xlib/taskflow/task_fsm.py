@@ -8,7 +8,6 @@
 # Description:
 
 """
-import json
 import logging
 import traceback
 
@@ -21,6 +20,7 @@ from xlib import db
 from xlib.mq import Queue
 from xlib.mq import msg
 from xlib.mq import exceptions as mq_exceptions
+from xlib.util import json_util
 
 log = logging.getLogger("butterfly")
 baichuan_connection = db.my_caches["baichuan"]
@@ -109,7 +109,7 @@ class TaskMachine(StateMachine):
 
         # 检查是否已设置 params, 若有，则直接跳过
         if self.model.task_params is not None:
-            params_dict = json.loads(self.model.task_params)
+            params_dict = json_util.loads(self.model.task_params)
             self.task_requires_dict = params_dict
             return
 
@@ -131,7 +131,7 @@ class TaskMachine(StateMachine):
             )
             for record in record_list:
                 record_dict = shortcuts.model_to_dict(record)
-                ret_data = json.loads(record_dict["ret_data"])
+                ret_data = json_util.loads(record_dict["ret_data"])
                 all_taskdata_list.append(ret_data)
                 for key in ret_data.keys():
                     if key in task_requires_list:
@@ -141,14 +141,14 @@ class TaskMachine(StateMachine):
         # 在 job_extra 中获取参数数据
         job_obj = job_model.select().where(job_model.job_id == job_id).get()
         job_extra_json = job_obj.job_extra
-        job_extra = json.loads(job_extra_json)
+        job_extra = json_util.loads(job_extra_json)
         for key in job_extra.keys():
             if key in task_requires_list:
                 self.task_requires_dict[key] = job_extra[key]
 
         # 在 task_extra 中获取参数数据
         task_extra_json = self.model.task_extra
-        task_extra = json.loads(task_extra_json)
+        task_extra = json_util.loads(task_extra_json)
         for key in task_extra.keys():
             if key in task_requires_list:
                 self.task_requires_dict[key] = task_extra[key]
@@ -209,7 +209,7 @@ class TaskMachine(StateMachine):
 
         # ERR_BAD_PARAMS or ERR_SERVER_EXCEPTION
         if msg_status == "failed":
-            msg_result = json.loads(msg_obj.result)
+            msg_result = json_util.loads(msg_obj.result)
             self.model.ret_stat = msg_result["stat"]
             log_msg = "task_id={task_id} task_reqid={task_reqid} msg_status={msg_status} err_info={err_info}".format(
                 task_id=self.model.task_id, task_reqid=msg_id, msg_status=msg_status, err_info="msg exe failed")
@@ -217,7 +217,7 @@ class TaskMachine(StateMachine):
 
         # OK or other ERR
         if msg_status == "finished":
-            msg_result = json.loads(msg_obj.result)
+            msg_result = json_util.loads(msg_obj.result)
             self.model.ret_stat = msg_result["stat"]
             # 检查状态
             if msg_result["stat"] != "OK":
@@ -288,7 +288,7 @@ class TaskMachine(StateMachine):
         """
         # 发起请求
         mq_queue = Queue(self.model.task_cmd, connection=baichuan_connection)
-        msg_data = json.dumps(self.task_requires_dict)
+        msg_data = json_util.dumps(self.task_requires_dict)
         # 消息队列中结果保留 1 天
         msg_obj = mq_queue.enqueue(msg_data, result_ttl=86400)
         self.model.task_reqid = msg_obj.id
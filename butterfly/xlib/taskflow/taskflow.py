@@ -8,7 +8,6 @@
 # Description:
 
 """
-import json
 import logging
 import traceback
 from datetime import datetime
@@ -17,6 +16,7 @@ from xlib.taskflow import model
 from xlib.db import shortcuts
 from xlib.taskflow import task_fsm
 from xlib.taskflow import exceptions
+from xlib.util import json_util
 
 
 class WorkflowRunner(object):
@@ -40,7 +40,7 @@ class WorkflowRunner(object):
 
         self.job_extra = job_extra
         self.params_check()
-        job_extra_json = json.dumps(job_extra)
+        job_extra_json = json_util.dumps(job_extra)
 
         # 创建 job 记录
         job_id = model.Job.insert(
@@ -107,7 +107,7 @@ class WorkflowRunner(object):
         """
         if params is not None:
             assert isinstance(params, dict)
-            params = json.dumps(params)
+            params = json_util.dumps(params)
 
         if requires is None:
             requires_str = ""
@@ -132,7 +132,7 @@ class WorkflowRunner(object):
 
         if extra is None:
             extra = {}
-        extra_str = json.dumps(extra)
+        extra_str = json_util.dumps(extra)
 
         self._task_id = model.Task.insert(
             job_id=self._job_id,
@@ -212,12 +212,12 @@ def is_job_end(req, job_id, new_exe_id):
                 # 检查是否需要保存数据到 job
                 if record_dict["task_is_save"]:
                     ret_data = record_dict["ret_data"]
-                    ret_data_dict = json.loads(ret_data)
+                    ret_data_dict = json_util.loads(ret_data)
                     if "data" in ret_data_dict.keys():
-                        job_obj.ret_data = json.dumps(ret_data_dict["data"])
+                        job_obj.ret_data = json_util.dumps(ret_data_dict["data"])
                     else:
                         ret_data_dict.pop("stat", None)
-                        job_obj.ret_data = json.dumps(ret_data_dict)
+                        job_obj.ret_data = json_util.dumps(ret_data_dict)
 
             if record_dict["task_status"] == "failed":
                 task_status_dict["failed_count"] = task_status_dict["failed_count"] + 1
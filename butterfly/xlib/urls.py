@@ -7,6 +7,15 @@
 # File Name: urls.py
 # Description:
     Managing Routing and Automatically register the handler to route
+
+    Router 路由匹配:
+        (1) 静态路由: dict 查找, O(1)
+        (2) 动态路由: 按 "/" 分段的前缀树(trie), 支持路径参数及类型转换
+            /wuxing/instance/{name}         ==> name 为 str, 匹配一段
+            /wuxing/instance/{id:int}       ==> id 为 int
+            /static_file/{file_path:path}   ==> file_path 匹配剩余的所有段, 仅可为最后一段
+        (3) 同一路径可按 HTTP 方法注册不同 handler, 路径匹配但方法不匹配时返回 405
+        匹配优先级: 静态路由 > 静态段 > 路径参数(按注册顺序) > path 参数
 """
 
 import importlib
@@ -14,10 +23,286 @@ import pkgutil
 import inspect
 
 from xlib import retstat
+from xlib import httpgateway
 from xlib import protocol_json
 from xlib import protocol_file
 
 
+def _to_str(value):
+    """
+    str converter: 非空的一段
+    """
+    if not value:
+        raise ValueError("empty segment")
+    return value
+
+
+# 路径参数转换函数, 转换失败时抛出 ValueError, 视为不匹配
+CONVERTERS = {
+    "str": _to_str,
+    "int": int,
+    "float": float,
+}
+
+
+class RouteInfo(object):
+    """
+    路由信息
+
+    Attributes:
+        pattern : (String) 注册的路径, eg: /wuxing/instance/{name}
+        protocol: (Object) protocol_json.Protocol / protocol_file.Protocol
+        methods : (frozenset) 允许的 HTTP 方法, 为 None 时不限制
+    """
+    __slots__ = ("pattern", "protocol", "methods")
+
+    def __init__(self, pattern, protocol, methods):
+        self.pattern = pattern
+        self.protocol = protocol
+        self.methods = methods
+
+
+class _Node(object):
+    """
+    前缀树节点
+
+    Attributes:
+        children: (Dict) 静态段 => _Node
+        params  : (List) [(参数名, converter, _Node), ...]
+        tail    : (Tuple) path 参数 (参数名, routes), 匹配剩余的所有段
+        routes  : (Dict) HTTP 方法(None 表示不限制) => RouteInfo
+    """
+    __slots__ = ("children", "params", "tail", "routes")
+
+    def __init__(self):
+        self.children = {}
+        self.params = []
+        self.tail = None
+        self.routes = None
+
+
+def _select(routes, method):
+    """
+    按 HTTP 方法选择路由
+
+    Returns:
+        RouteInfo, 方法不匹配时为 None
+    """
+    route = routes.get(method)
+    if route is None:
+        route = routes.get(None)
+    return route
+
+
+def _add_route(routes, route):
+    """
+    向 routes 中添加路由, 重复注册时抛出 ValueError
+    """
+    for method in route.methods or (None,):
+        if method in routes:
+            raise ValueError("route {pattern} {method} conflicts with {exists}".format(
+                pattern=route.pattern, method=method or "*", exists=routes[method].pattern))
+        routes[method] = route
+
+
+class Router(object):
+    """
+    路由表
+
+    Attributes:
+        _static : (Dict) 静态路由 path => {HTTP 方法: RouteInfo}
+        _root   : (_Node) 动态路由前缀树
+    """
+
+    def __init__(self):
+        self._static = {}
+        self._root = _Node()
+
+    @staticmethod
+    def is_dynamic(pattern):
+        """
+        是否为包含路径参数的路由
+        """
+        return "{" in pattern
+
+    @staticmethod
+    def parse_pattern(pattern):
+        """
+        解析路由
+
+        Args:
+            pattern: (String) eg: /wuxing/instance/{id:int}
+        Returns:
+            (List) [(段, 参数名, converter 名), ...], 静态段的参数名为 None
+        Raises:
+            ValueError: 路由格式错误
+        """
+        segments = []
+        parts = pattern.strip("/").split("/")
+        for index, part in enumerate(parts):
+            if not (part.startswith("{") and part.endswith("}")):
+                if "{" in part or "}" in part:
+                    raise ValueError("invalid route segment: %s" % part)
+                segments.append((part, None, None))
+                continue
+            name, _, converter = part[1:-1].partition(":")
+            converter = converter or "str"
+            if not name or (converter not in CONVERTERS and converter != "path"):
+                raise ValueError("invalid route segment: %s" % part)
+            if converter == "path" and index != len(parts) - 1:
+                raise ValueError("path converter must be the last segment: %s" % pattern)
+            segments.append((part, name, converter))
+        return segments
+
+    def add(self, pattern, protocol, methods=None):
+        """
+        注册路由
+
+        Args:
+            pattern : (String) 路径
+            protocol: (Object) protocol
+            methods : (List) 允许的 HTTP 方法, 为 None 时不限制
+        Returns:
+            RouteInfo
+        """
+        if methods is not None:
+            methods = frozenset(method.upper() for method in methods)
+        route = RouteInfo(pattern, protocol, methods)
+
+        if not self.is_dynamic(pattern):
+            _add_route(self._static.setdefault(pattern, {}), route)
+            return route
+
+        node = self._root
+        for part, name, converter in self.parse_pattern(pattern):
+            if name is None:
+                node = node.children.setdefault(part, _Node())
+            elif converter == "path":
+                if node.tail is None:
+                    node.tail = (name, {})
+                elif node.tail[0] != name:
+                    raise ValueError("route {pattern} conflicts with path param {name}".format(
+                        pattern=pattern, name=node.tail[0]))
+                _add_route(node.tail[1], route)
+                return route
+            else:
+                for param_name, param_converter, child in node.params:
+                    if param_converter is CONVERTERS[converter]:
+                        if param_name != name:
+                            raise ValueError("route {pattern} conflicts with param {name}".format(
+                                pattern=pattern, name=param_name))
+                        node = child
+                        break
+                else:
+                    child = _Node()
+                    node.params.append((name, CONVERTERS[converter], child))
+                    node = child
+        if node.routes is None:
+            node.routes = {}
+        _add_route(node.routes, route)
+        return route
+
+    def match(self, path, method=None):
+        """
+        匹配路由
+
+        Args:
+            path  : (String) 请求路径(不带末尾的 "/")
+            method: (String) HTTP 方法
+        Returns:
+            (route, path_params, allowed)
+            route      : RouteInfo, 未匹配时为 None
+            path_params: (Dict) 路径参数, 静态路由时为 None
+            allowed    : (List) 路径匹配但方法不匹配时, 所有路径匹配的路由允许的 HTTP 方法(用于 405), 否则为 None
+        """
+        # 路径匹配但方法不匹配的路由, 继续匹配其他路由(如静态路由 GET /api/item 与 POST /api/{name})
+        misses = []
+        routes = self._static.get(path)
+        if routes is not None:
+            route = _select(routes, method)
+            if route is not None:
+                return route, None, None
+            misses.append(routes)
+
+        path_params = {}
+        route = self._match_node(self._root, path.strip("/").split("/"), 0, path_params, method, misses)
+        if route is not None:
+            return route, path_params, None
+        if misses:
+            return None, None, sorted(set(m for routes in misses for r in routes.itervalues() for m in r.methods))
+        return None, None, None
+
+    def _match_node(self, node, segments, index, path_params, method, misses):
+        """
+        匹配前缀树, 路径或方法不匹配时回溯
+
+        Args:
+            misses: (List) 路径匹配但方法不匹配的 routes
+        Returns:
+            RouteInfo, 未匹配时为 None
+        """
+        if index == len(segments):
+            return self._select(node.routes, method, misses)
+
+        segment = segments[index]
+        child = node.children.get(segment)
+        if child is not None:
+            route = self._match_node(child, segments, index + 1, path_params, method, misses)
+            if route is not None:
+                return route
+
+        for name, converter, child in node.params:
+            try:
+                value = converter(segment)
+            except ValueError:
+                continue
+            route = self._match_node(child, segments, index + 1, path_params, method, misses)
+            if route is not None:
+                path_params[name] = value
+                return route
+
+        if node.tail is not None and segment:
+            name, routes = node.tail
+            route = self._select(routes, method, misses)
+            if route is not None:
+                path_params[name] = "/".join(segments[index:])
+            return route
+        return None
+
+    @staticmethod
+    def _select(routes, method, misses):
+        """
+        按 HTTP 方法选择路由, 方法不匹配时记录到 misses
+        """
+        if routes is None:
+            return None
+        route = _select(routes, method)
+        if route is None:
+            misses.append(routes)
+        return route
+
+    def routes(self):
+        """
+        所有路由
+
+        Returns:
+            (List) [RouteInfo, ...]
+        """
+        result = []
+        for routes in self._static.itervalues():
+            result.extend(routes.itervalues())
+        stack = [self._root]
+        while stack:
+            node = stack.pop()
+            if node.routes:
+                result.extend(node.routes.itervalues())
+            if node.tail is not None:
+                result.extend(node.tail[1].itervalues())
+            stack.extend(node.children.itervalues())
+            stack.extend(child for _, _, child in node.params)
+        return sorted(set(result), key=lambda route: route.pattern)
+
+
 def import_submodules(package):
     """
     Import all submodules of a module
@@ -59,40 +344,63 @@ class Route(object):
         initlog:(logger.LoggerBase) record init log
         errlog:(logger.LoggerBase) record error log
         apicube:(Dict) route info
+        router:(Router) 路由表, 包含动态路由及 HTTP 方法限制
     """
 
     def __init__(self, initlog, errlog):
         self._initlog = initlog
         self._errlog = errlog
         self.apicube = {}
+        self.router = Router()
 
-    def addapi(self, name, func, is_serialize_response, is_parse_post, is_encode_response):
+    def addapi(self, name, func, is_serialize_response, is_parse_post, is_encode_response, schema=None,
+               methods=None):
         """注册函数
         Args:
             name                    : (String)函数的注册名，默认为包中函数的全小写方法名
+                                    : 可包含路径参数, 如 /wuxing/instance/{name}, 路径参数需为 handler 的参数
             func                    : (Object) 函数
             is_serialize_response   : (Bool) 是否进行将 handler 返回结果进行封装为 json 还是 file Protocol
                                     : True 时，handler return 为: (stat_str, data_dict, headers_list)
                                     : False 时，handler, return 为: (httpcode_int, data_str, headers_list)
             is_parse_post           : (Bool) 是否将请求 Body 中的内容解析为参数，传递给后端 handler
             is_encode_response      : (Bool) 是否进行序列化为 JSON
+            schema                  : (httpgateway.ParamSchema) handler 参数描述, 为 None 时根据 func 生成
+            methods                 : (List) 允许的 HTTP 方法, 为 None 时不限制
         Returns:
             response_type
                 json/file/none
         """
+        if schema is None:
+            schema = httpgateway.ParamSchema(func)
+        is_dynamic = Router.is_dynamic(name)
+        if is_dynamic:
+            for _, param_name, _ in Router.parse_pattern(name):
+                if param_name is not None and param_name not in schema.arg_set:
+                    raise ValueError("route {name}: {param_name} is not an argument of {func}".format(
+                        name=name, param_name=param_name, func=func.__name__))
+
         if not is_serialize_response:
-            self.apicube[name] = protocol_json.Protocol(func, retstat.ERR_SERVER_EXCEPTION, retstat.ERR_BAD_PARAMS,
-                                                        is_parse_post, is_encode_response, self._errlog)
-            return "none"
-
-        if is_encode_response:
-            self.apicube[name] = protocol_json.Protocol(func, retstat.ERR_SERVER_EXCEPTION, retstat.ERR_BAD_PARAMS,
-                                                        is_parse_post, is_encode_response, self._errlog)
-            return "json"
+            protocol = protocol_json.Protocol(func, retstat.ERR_SERVER_EXCEPTION, retstat.ERR_BAD_PARAMS,
+                                              is_parse_post, is_encode_response, self._errlog,
+                                              schema=schema)
+            response_type = "none"
+        elif is_encode_response:
+            protocol = protocol_json.Protocol(func, retstat.ERR_SERVER_EXCEPTION, retstat.ERR_BAD_PARAMS,
+                                              is_parse_post, is_encode_response, self._errlog,
+                                              schema=schema)
+            response_type = "json"
         else:
-            self.apicube[name] = protocol_file.Protocol(func, retstat.ERR_SERVER_EXCEPTION, retstat.ERR_BAD_PARAMS,
-                                                        is_parse_post, is_encode_response, self._errlog)
-            return "file"
+            protocol = protocol_file.Protocol(func, retstat.ERR_SERVER_EXCEPTION, retstat.ERR_BAD_PARAMS,
+                                              is_parse_post, is_encode_response, self._errlog,
+                                              schema=schema)
+            response_type = "file"
+
+        # apicube 仅包含静态路由(百川 worker 以此作为队列名)
+        if not is_dynamic:
+            self.apicube[name] = protocol
+        self.router.add(name, protocol, methods)
+        return response_type
 
     def add_apis(self, py_module, package_name=""):
         """将某个 module 文件中函数注册到路由中
@@ -125,18 +433,33 @@ class Route(object):
                 is_parse_post = apiattr['is_parse_post']
                 is_encode_response = apiattr['is_encode_response']
                 adder_args = [is_parse_post, is_encode_response]
-            response_type = self.addapi(path_name.lower(), func, is_serialize_response, *adder_args)
-
-            args_count = func.func_code.co_argcount - 1 if inspect.ismethod(func) else func.func_code.co_argcount
-            func_args = func.func_code.co_varnames[:args_count]
-            self._initlog.log(
-                "[module=init_handler path={path:20} args={func_args:30} response_type={response_type} is_parse_post={is_parse_post}"
-                " is_encode_response={is_encode_response}]".format(
-                    path=path_name,
-                    func_args=func_args,
-                    response_type=response_type,
-                    is_parse_post=adder_args[0],
-                    is_encode_response=adder_args[1]))
+            # 参数描述在注册时生成一次, 请求时直接使用
+            schema = httpgateway.ParamSchema(func)
+
+            # funcattr.route: 默认路径的 HTTP 方法限制及额外的(动态)路由
+            routes = [[path_name.lower(), None]]
+            for routeattr in getattr(func, "routeattr", []):
+                if routeattr["path"] is None:
+                    routes[0][1] = routeattr["methods"]
+                else:
+                    routes.append([routeattr["path"], routeattr["methods"]])
+
+            for path, methods in routes:
+                response_type = self.addapi(path, func, is_serialize_response, *adder_args,
+                                            schema=schema, methods=methods)
+
+                self._initlog.log(
+                    "[module=init_handler path={path:20} args={func_args:30} param_types={param_types}"
+                    " methods={methods} response_type={response_type} is_parse_post={is_parse_post}"
+                    " is_encode_response={is_encode_response}]".format(
+                        path=path,
+                        func_args=str(schema.args),
+                        param_types=",".join("%s:%s" % (name, getattr(hint, "__name__", hint))
+                                             for name, hint, _ in schema.coercers) or "-",
+                        methods=",".join(methods) if methods else "*",
+                        response_type=response_type,
+                        is_parse_post=adder_args[0],
+                        is_encode_response=adder_args[1]))
 
     def autoload_handler(self, package_dir):
         """自动加载指定目录下的所有 package
@@ -157,3 +480,9 @@ class Route(object):
         获取路由 dict
         """
         return self.apicube
+
+    def get_router(self):
+        """
+        获取路由表(Router)
+        """
+        return self.router
@@ -39,6 +39,8 @@ import logging
 import time
 import json
 
+from xlib import deadline
+
 
 log = logging.getLogger("butterfly")
 reload(sys)
@@ -227,6 +229,12 @@ class RequestTool(object):
         timeout = kwargs.get('timeout')
         if not isinstance(timeout, int):
             timeout = _DEFAULT_TIMEOUT
+        # 有请求 deadline 时按剩余时间缩短超时, 已超过 deadline 时抛出 deadline.DeadlineExceeded
+        timeout = deadline.shrink_timeout(timeout)
+        request_deadline = deadline.get_deadline()
+        if request_deadline is not None:
+            # 将 deadline 传递给下游服务
+            self.request.add_header('X-Request-Deadline', '{:.3f}'.format(request_deadline))
 
         t_beginning = time.time()
         try:
@@ -304,6 +312,8 @@ class RequestTool(object):
             log.info(log_msg)
         else:
             log.error(log_msg)
+            if deadline.expired():
+                raise deadline.DeadlineExceeded("request deadline exceeded: {}".format(self.reason))
 
     def _get_backframe_info(self, f):
         """
@@ -0,0 +1,173 @@
+#!/usr/bin/python
+# coding=utf8
+"""
+# File Name: pack_util.py
+# Description:
+    二进制编解码(mcpack/msgpack), 用于 protocol_json 的内容协商
+
+    (1) 请求头 Accept 中明确包含 application/x-mcpack 或 application/x-msgpack(需安装 msgpack) 时,
+        响应使用对应编码; 其他情况(包括 */*)仍为 JSON
+    (2) POST 请求的 Content-Type 为上述类型时, 按对应编码解析请求 body
+    (3) datetime/date/Decimal 与 JSON 一致, 由 json_util.json_default 处理;
+        mcpack 不支持的值(如超过 int64 的整数, 元素类型不一致的数组)抛出异常, 由调用方回退为 JSON
+
+    Examples:
+        content_type = pack_util.negotiate(wsgienv.get("HTTP_ACCEPT"))
+        if content_type:
+            body = pack_util.dumps(content_type, data)
+"""
+import datetime
+import decimal
+
+from xlib.ral import mcpack
+from xlib.util import json_util
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+MCPACK = "application/x-mcpack"
+MSGPACK = "application/x-msgpack"
+
+_INT64_MIN = -2 ** 63
+_INT64_MAX = 2 ** 63 - 1
+
+
+def _to_mcpack(obj):
+    """
+    转换为 xlib.ral.mcpack 支持的类型
+
+    Raises:
+        TypeError: 不支持的类型
+    """
+    if isinstance(obj, dict):
+        return dict((_to_mcpack_key(k), _to_mcpack(v)) for k, v in obj.iteritems())
+    if isinstance(obj, (list, tuple)):
+        return [_to_mcpack(v) for v in obj]
+    if isinstance(obj, str):
+        # mcpack 编码 str 时按 unicode_escape 解析, 非 ASCII 的 str 需先转为 unicode
+        return obj.decode("utf8")
+    if isinstance(obj, (unicode, bool, float)) or obj is None:
+        return obj
+    if isinstance(obj, (int, long)):
+        if not _INT64_MIN <= obj <= _INT64_MAX:
+            raise TypeError("integer out of int64 range: %s" % obj)
+        return int(obj)
+    if isinstance(obj, (datetime.date, decimal.Decimal)):
+        return json_util.json_default(obj)
+    raise TypeError("%r is not mcpack serializable" % obj)
+
+
+def _to_mcpack_key(key):
+    if isinstance(key, unicode):
+        return key
+    if isinstance(key, str):
+        return key.decode("utf8")
+    raise TypeError("mcpack key must be string: %r" % key)
+
+
+def _mcpack_dumps(obj):
+    return str(mcpack.dumps(_to_mcpack(obj)))
+
+
+def _msgpack_default(obj):
+    return json_util.json_default(obj)
+
+
+def _msgpack_dumps(obj):
+    # use_bin_type=False: str 按字符串类型编码, 解码为 unicode, 与 JSON 一致
+    return msgpack.packb(obj, default=_msgpack_default, use_bin_type=False)
+
+
+def _msgpack_loads(body):
+    try:
+        return msgpack.unpackb(body, raw=False)
+    except TypeError:
+        # msgpack < 0.5.2
+        return msgpack.unpackb(body, encoding="utf8")
+
+
+# Content-Type => (dumps, loads)
+CODECS = {MCPACK: (_mcpack_dumps, mcpack.loads)}
+if msgpack is not None:
+    CODECS[MSGPACK] = (_msgpack_dumps, _msgpack_loads)
+    CODECS["application/msgpack"] = CODECS[MSGPACK]
+
+
+def negotiate(accept):
+    """
+    根据 Accept 请求头选择响应编码
+
+    Args:
+        accept: (String) wsgienv["HTTP_ACCEPT"]
+    Returns:
+        (String) CODECS 中的 Content-Type, 使用 JSON 时返回 None
+    """
+    # 快速路径: 大部分请求不会使用二进制编码
+    if not accept or "pack" not in accept:
+        return None
+
+    # 客户端同时接受 JSON 且优先级不低于二进制编码时, 使用 JSON
+    best = None
+    best_q = 0.0
+    for item in accept.split(","):
+        media_type, _, params = item.partition(";")
+        media_type = media_type.strip().lower()
+        if media_type not in CODECS and media_type != "application/json":
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if q > best_q or (q == best_q and media_type == "application/json"):
+            best, best_q = media_type, q
+    return best if best in CODECS else None
+
+
+def content_type_of(wsgienv):
+    """
+    请求 body 的编码
+
+    Args:
+        wsgienv: (Dict) wsgi env
+    Returns:
+        (String) CODECS 中的 Content-Type, 其他情况返回 None
+    """
+    content_type = wsgienv.get("CONTENT_TYPE")
+    if not content_type or "pack" not in content_type:
+        return None
+    content_type = content_type.partition(";")[0].strip().lower()
+    return content_type if content_type in CODECS else None
+
+
+def dumps(content_type, obj):
+    """
+    序列化
+
+    Args:
+        content_type: (String) CODECS 中的 Content-Type
+        obj         : 待序列化的对象
+    Returns:
+        (String)
+    Raises:
+        TypeError/ValueError: 不支持的值
+    """
+    return CODECS[content_type][0](obj)
+
+
+def loads(content_type, body):
+    """
+    反序列化
+
+    Args:
+        content_type: (String) CODECS 中的 Content-Type
+        body        : (String)
+    Returns:
+        反序列化结果
+    """
+    return CODECS[content_type][1](body)
@@ -1,15 +1,50 @@
 # coding:utf8
 """
 用于生成 reqid
+
+    v2(默认): 64 bit 整数, 仅做可逆的位混淆, 首字符为 g-n(不是 16 进制字符), 其余为小写 16 进制, 线程安全且不加锁
+    v1: DES 加密, 大写 16 进制, 仅用于解析历史 reqid
 """
 import uuid
 import ctypes
 import os
+import time
 import base64
 import datetime
+import itertools
 
 from xlib.util import pyDes
 
+# v2 reqid 的位分布(高位 -> 低位)
+_V2_VERSION_BIT = 1 << 63
+_V2_MAC_BITS = 8
+_V2_PID_BITS = 4
+_V2_TIME_BITS = 40
+_V2_COUNTER_BITS = 11
+# 时间戳起始时间 2021-01-01 00:00:00 UTC(ms), 40 bit 可表示约 34 年
+_V2_EPOCH_MS = 1609459200000
+
+# v2 首个 16 进制字符(最高位为版本位, 取值 8-f)映射为 g-n, 与 v1(0-9A-F)不会冲突
+_V2_FIRST_CHARS = "ghijklmn"
+
+# 位混淆: x ^= x >> 32, 然后乘以奇数(mod 2**63), 两步均可逆
+_MASK63 = (1 << 63) - 1
+_OBF_MULTIPLIER = 0x5DEECE66D2A5F3B
+
+
+def _mod_inverse(a, m):
+    """
+    a 在 mod m 下的乘法逆元(扩展欧几里得)
+    """
+    r0, r1, s0, s1 = m, a % m, 0, 1
+    while r1:
+        q = r0 // r1
+        r0, r1 = r1, r0 - q * r1
+        s0, s1 = s1, s0 - q * s1
+    return s0 % m
+
+_OBF_INVERSE = _mod_inverse(_OBF_MULTIPLIER, 1 << 63)
+
 
 class UUID64(object):
     """
@@ -22,7 +57,9 @@ class UUID64(object):
         self._pid = os.getpid()
         # 先取 pid 与低四位按位与(值范围为 0-15)，然后左移动 4 位到高四位
         self._pid_factor = (self._pid & 0x0f) << 4
-        self.counter = 0
+        # 计数器, itertools.count 的 next 在 GIL 下是原子操作, 多线程无需加锁
+        self._counter = itertools.count(1)
+        self._v2_counter = itertools.count()
         self._cipher = pyDes.Des(self.ENC_KEY)
 
         if uuid._uuid_generate_time:
@@ -32,10 +69,61 @@ class UUID64(object):
         else:
             raw = uuid.uuid1().get_bytes()
         self._host_id = raw[-2:]
+        self._v2_prefix = self._mk_v2_prefix()
+
+    def _mk_v2_prefix(self):
+        """
+        v2 reqid 中不变的部分: 版本位 | mac 低 8 位 | pid 低 4 位
+        """
+        mac_tail = ((ord(self._host_id[0]) << 8) | ord(self._host_id[1])) & ((1 << _V2_MAC_BITS) - 1)
+        prefix = (mac_tail << _V2_PID_BITS) | (self._pid & 0x0f)
+        return prefix << (_V2_TIME_BITS + _V2_COUNTER_BITS)
+
+    def reinit_after_fork(self):
+        """
+        fork 后在子进程中调用, 更新 pid 因子
+        """
+        self._pid = os.getpid()
+        self._pid_factor = (self._pid & 0x0f) << 4
+        self._counter = itertools.count(1)
+        self._v2_counter = itertools.count()
+        self._v2_prefix = self._mk_v2_prefix()
 
     def gen(self):
         """
-        生成 reqid
+        生成 reqid(v2)
+
+            64 bit 整数:
+                +---------+-----------------+---------+-----------------------+-------------+
+                | version | mac_addr[-1:]   | pid low |  timestamp(ms)        | counter low |
+                | (1 bit) | (8 bit)         | (4 bit) | 2021-01-01 起(40 bit) |  (11 bit)   |
+                +---------+-----------------+---------+-----------------------+-------------+
+            低 63 bit 经过可逆的位混淆(x ^= x >> 32; x *= _OBF_MULTIPLIER), 版本位保持为 1,
+            然后按 16 位小写 16 进制输出, 首字符(8-f)映射为 g-n, 如: i1c0e83fd0a2c57e
+
+            counter 为进程内原子计数器(itertools.count)的低 11 位, 不加锁;
+            取 counter 前后的时间戳不同(线程在两者之间被切换)时重新获取, 保证 counter 是在该毫秒内取得的,
+            同一毫秒内超过 2048 个 reqid 时才会重复(单进程生成耗时约 1.5us, 每毫秒不超过约 700 个)
+
+            历史(v1) reqid 为大写 16 进制(0-9A-F), decode 时根据首字符区分
+        Returns:
+            reqid: (str), 16 字节
+        """
+        while True:
+            now = int(time.time() * 1000)
+            counter = next(self._v2_counter) & ((1 << _V2_COUNTER_BITS) - 1)
+            if int(time.time() * 1000) == now:
+                break
+        tm = (now - _V2_EPOCH_MS) & ((1 << _V2_TIME_BITS) - 1)
+        value = self._v2_prefix | (tm << _V2_COUNTER_BITS) | counter
+        value ^= value >> 32
+        value = (value * _OBF_MULTIPLIER) & _MASK63
+        reqid = "%016x" % (_V2_VERSION_BIT | value)
+        return _V2_FIRST_CHARS[int(reqid[0], 16) - 8] + reqid[1:]
+
+    def gen_v1(self):
+        """
+        生成 v1 reqid(DES 加密, 开销较大, 仅用于兼容测试)
 
             uuid.uuid1(35734e80-08ff-11eb-b0cc-f45c89b7b8f9) -- 基于时间戳:
                             |
@@ -59,7 +147,7 @@ class UUID64(object):
         Returns:
             reqid: (str), 16 字节 example:9602CFF26E1E6FED
         """
-        self.counter += 1
+        counter = next(self._counter)
 
         if uuid._uuid_generate_time:
             buf = ctypes.create_string_buffer(16)
@@ -68,7 +156,7 @@ class UUID64(object):
         else:
             raw = uuid.uuid1().get_bytes()
 
-        tm = (raw[4] + raw[5]) + (raw[0] + raw[1]) + chr((ord(raw[2]) & 0xf0) | (self.counter & 0x0f))
+        tm = (raw[4] + raw[5]) + (raw[0] + raw[1]) + chr((ord(raw[2]) & 0xf0) | (counter & 0x0f))
         mid = chr(self._pid_factor | (ord(raw[7]) & 0x0f))
 
         uuid64 = "%s%s%s" % (self._host_id, mid, tm)
@@ -88,8 +176,15 @@ class UUID64(object):
         req_datetime = datetime.datetime.fromtimestamp(unix_timestamp).strftime("%Y-%m-%d %H:%M:%S.%f")
         return unix_timestamp, req_datetime
 
+    @staticmethod
+    def is_v2(reqid):
+        """
+        是否为 v2 reqid: 首字符为 g-n(v1 为 16 进制字符)
+        """
+        return reqid[:1] in _V2_FIRST_CHARS
+
     def decode(self, reqid):
-        """解析 reqid
+        """解析 reqid(支持 v1/v2)
         Args:
             reqid:(Str) reqid
         Returns:
@@ -99,9 +194,13 @@ class UUID64(object):
                 "pid_low": 5,
                 "counter_low": 1,
                 "mac_addr": "B8F9",
-                "datetime": "2020-10-08 20:10:45.773722"
+                "datetime": "2020-10-08 20:10:45.773722",
+                "version": 1
                }
         """
+        if self.is_v2(reqid):
+            return self._decode_v2(reqid)
+
         # b16 解码，然后进行解密
         shortuuid = self._cipher.decrypt(base64.b16decode(reqid))
         # 对 shortuuid 进行 b16 编码
@@ -115,6 +214,36 @@ class UUID64(object):
         _res_info["counter_low"] = int("0x0" + shortuuid_b16[15], 16)
         # pid 的低四位，取值为 0-15
         _res_info["pid_low"] = int("0x0" + shortuuid_b16[4], 16)
+        _res_info["version"] = 1
+        return _res_info
+
+    def _decode_v2(self, reqid):
+        """解析 v2 reqid
+        Args:
+            reqid:(Str) eg: i1c0e83fd0a2c57e
+        Returns:
+            res_info:(Dict) 同 decode, mac_addr 为 mac 地址的最后 1 字节(2 位 16 进制)
+        """
+        first = "%x" % (_V2_FIRST_CHARS.index(reqid[0]) + 8)
+        value = (int(first + reqid[1:], 16) & _MASK63) * _OBF_INVERSE & _MASK63
+        value ^= value >> 32
+
+        counter = value & ((1 << _V2_COUNTER_BITS) - 1)
+        value >>= _V2_COUNTER_BITS
+        tm = value & ((1 << _V2_TIME_BITS) - 1)
+        value >>= _V2_TIME_BITS
+        pid_low = value & ((1 << _V2_PID_BITS) - 1)
+        mac_tail = value >> _V2_PID_BITS
+
+        unix_timestamp = (tm + _V2_EPOCH_MS) / 1000.0
+        _res_info = {}
+        _res_info["mac_addr"] = "%02X" % mac_tail
+        _res_info["timestamp"] = unix_timestamp
+        _res_info["datetime"] = datetime.datetime.fromtimestamp(unix_timestamp).strftime("%Y-%m-%d %H:%M:%S.%f")
+        # 同一毫秒内的序号，取值为 0-2047
+        _res_info["counter_low"] = int(counter)
+        _res_info["pid_low"] = int(pid_low)
+        _res_info["version"] = 2
         return _res_info
 
 
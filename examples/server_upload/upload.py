@@ -10,13 +10,11 @@
 """
 from xlib.httpgateway import Request
 from xlib import retstat
-from xlib import httpgateway
-import hashlib
-import binascii
+import os
 
 
 __info__ = "meetbill"
-__version__ = "1.0.2"
+__version__ = "1.0.3"
 
 
 def put(req, md5=""):
@@ -27,19 +25,18 @@ def put(req, md5=""):
     isinstance(req, Request)
     req.start_timming()
 
-    blkdata = httpgateway.read_wsgi_post(req.wsgienv)
-    blksize = len(blkdata)
-    req.timming("rp")
-    if blksize < 1:
+    # 流式写入临时文件并计算 md5, 内存占用与文件大小无关
+    tmp_path = '/tmp/file_tmp.%s' % req.reqid
+    try:
+        blkinfo = req.body_to_file(tmp_path, ("md5",))
+    except IOError:
         return retstat.ERR_BAD_PARAMS
+    req.timming("rp")
+    if blkinfo["size"] < 1 or (md5 and md5 != blkinfo["md5"]):
+        os.remove(tmp_path)
+        return retstat.ERR_BAD_PARAMS if blkinfo["size"] < 1 else retstat.ERR_BLOCK_CRC_VERIFY_FAILED
 
-    blkmd5_digest = hashlib.md5(blkdata).digest()
-    if md5 and md5 != binascii.b2a_hex(blkmd5_digest):
-        return retstat.ERR_BLOCK_CRC_VERIFY_FAILED
-    req.timming("md5")
-
-    with open('/tmp/file_tmp', 'wb') as f:
-        f.write(blkdata)
+    os.rename(tmp_path, '/tmp/file_tmp')
 
     fid = "xxxx"
     req.log_params["fid"] = fid